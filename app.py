@@ -1,6 +1,13 @@
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, send_file, abort, Response
+from urllib.parse import quote
+import base64
+import hashlib
+import json_backend
+import mimetypes
 import os
+import requests
 import sys
+import threading
 import time # For delays or unique naming if needed
 
 # Add the current directory to sys.path to allow importing local modules
@@ -9,19 +16,40 @@ sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from media_downloader_tool import (
     SUPPORTED_PLATFORMS,
     download_selected_item, # Re-usable for downloading specific items
+    open_download_stream, # For relaying a file to the browser without saving it first
+    get_platform_listing, # list_* dispatch behind the shared listing cache / single-flight
+    warm_popular_searches, # Re-lists the most frequent logged searches before their cache entries expire
     # Direct search_X functions might be too CLI-oriented with their print statements.
-    # We'll primarily use list_X_media functions and then download_selected_item.
+    # Listings go through get_platform_listing, downloads through download_selected_item.
 )
 
-# Import listing functions from individual downloaders
-from giphy_downloader import list_giphy_media, GIPHY_API_KEY, DEFAULT_DOWNLOAD_TIMEOUT as GIPHY_TIMEOUT
-from morbotron_scraper import list_morbotron_media, DEFAULT_DOWNLOAD_TIMEOUT as MORBOTRON_TIMEOUT
-from wikimedia_scraper import list_wikimedia_media, DEFAULT_DOWNLOAD_TIMEOUT as WIKIMEDIA_TIMEOUT
-from pixabay_scraper import list_pixabay_videos, PIXABAY_API_KEY, DEFAULT_DOWNLOAD_TIMEOUT as PIXABAY_TIMEOUT
-from frinkiac_scraper import list_frinkiac_media, DEFAULT_DOWNLOAD_TIMEOUT as FRINKIAC_TIMEOUT
-from mixkit_scraper import list_mixkit_videos, DEFAULT_DOWNLOAD_TIMEOUT as MIXKIT_TIMEOUT
-from wikimedia_oauth_scraper import list_wikimedia_oauth_media, DEFAULT_DOWNLOAD_TIMEOUT as WIKIMEDIA_OAUTH_TIMEOUT
-# from comb_io_scraper import list_comb_io_media # If it becomes available
+# Per-platform download timeouts and API keys (listing goes through get_platform_listing above)
+from giphy_downloader import GIPHY_API_KEY, DEFAULT_DOWNLOAD_TIMEOUT as GIPHY_TIMEOUT
+from morbotron_scraper import DEFAULT_DOWNLOAD_TIMEOUT as MORBOTRON_TIMEOUT
+from wikimedia_scraper import DEFAULT_DOWNLOAD_TIMEOUT as WIKIMEDIA_TIMEOUT
+from pixabay_scraper import PIXABAY_API_KEY, DEFAULT_DOWNLOAD_TIMEOUT as PIXABAY_TIMEOUT
+from frinkiac_scraper import DEFAULT_DOWNLOAD_TIMEOUT as FRINKIAC_TIMEOUT
+from mixkit_scraper import DEFAULT_DOWNLOAD_TIMEOUT as MIXKIT_TIMEOUT
+from wikimedia_oauth_scraper import DEFAULT_DOWNLOAD_TIMEOUT as WIKIMEDIA_OAUTH_TIMEOUT
+# from comb_io_scraper import DEFAULT_DOWNLOAD_TIMEOUT as COMBIO_TIMEOUT # If it becomes available
+import singleflight
+from storage_manager import StorageManager, DEFAULT_SPECULATIVE_MAX_AGE
+from download_prefetch import (Prefetcher, DEFAULT_MAX_ITEM_BYTES as DEFAULT_PREFETCH_MAX_ITEM_BYTES,
+                               DEFAULT_BUDGET_BYTES as DEFAULT_PREFETCH_BUDGET_BYTES, DEFAULT_WORKERS as DEFAULT_PREFETCH_WORKERS)
+from query_log import configure_query_log, record_search
+from media_library import configure_media_library, search_library, known_item_ids, record_item as record_library_item, LIBRARY_NAME
+from listing_cache import (configure_listing_cache, DEFAULT_LISTING_CACHE_TTL, DEFAULT_EMPTY_TTL, DEFAULT_ERROR_TTL,
+                           DEFAULT_STALE_TTL)
+from deadline import Deadline
+from renditions import make_size_limits
+from integrity import configure_integrity, expected_length, new_hasher, record_download, DEFAULT_HASH_ALGORITHM
+from media_probe import configure_media_probe, DEFAULT_PROBE_BYTES, DEFAULT_PROBE_CACHE_TTL
+from output_layout import configure_output_layout, index_file, locate, output_path, DEFAULT_LAYOUT
+from transfer_scheduler import (configure_transfer_scheduler, get_transfer_scheduler, parse_platform_limits,
+                                use_transfer_priority, INTERACTIVE, DEFAULT_MARKER_PATH, DEFAULT_YIELD_BYTES_PER_SEC)
+from profiling import sample_stacks, format_collapsed
+from circuit_breaker import configure_circuit_breakers, breaker_state, DEFAULT_FAILURE_THRESHOLD, DEFAULT_RESET_TIMEOUT
+from preview_cache import init_preview_cache, fetch_preview, is_allowed_preview_url, DEFAULT_PREVIEW_CACHE_MAX_BYTES
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24) # For session management, flash messages, etc.
@@ -53,6 +81,168 @@ if not os.path.exists(DOWNLOAD_BASE_DIR):
     os.makedirs(DOWNLOAD_BASE_DIR)
 
 app.config['DOWNLOAD_FOLDER'] = DOWNLOAD_BASE_DIR
+# Platform folders of DOWNLOAD_FOLDER: "flat", or "sharded" into hash-prefix subfolders with an index (see output_layout)
+configure_output_layout(os.environ.get("DOWNLOAD_LAYOUT", DEFAULT_LAYOUT), DOWNLOAD_BASE_DIR)
+
+# Web downloads are a cache, not a library: keep them under a byte quota and drop old/unused ones.
+DOWNLOAD_QUOTA_BYTES = int(os.environ.get("DOWNLOAD_QUOTA_BYTES", 1024 * 1024 * 1024)) # 1 GB
+DOWNLOAD_MAX_AGE_SECONDS = int(os.environ.get("DOWNLOAD_MAX_AGE_SECONDS", 7 * 24 * 3600)) or None # 0 disables age eviction
+# Prefetched files nobody clicked (see PREFETCH_TOP_K) are evicted first, and dropped after this long regardless
+PREFETCH_MAX_AGE_SECONDS = int(os.environ.get("PREFETCH_MAX_AGE_SECONDS", DEFAULT_SPECULATIVE_MAX_AGE)) or None
+download_storage = StorageManager(DOWNLOAD_BASE_DIR, DOWNLOAD_QUOTA_BYTES, max_age_seconds=DOWNLOAD_MAX_AGE_SECONDS,
+                                  speculative_max_age=PREFETCH_MAX_AGE_SECONDS)
+
+# How finished downloads are handed to the client:
+#   "none"       - Flask/Werkzeug streams the file (Range, ETag and If-* handled by send_from_directory,
+#                  gunicorn uses sendfile() via wsgi.file_wrapper where it can)
+#   "x-sendfile" - emit X-Sendfile for Apache (mod_xsendfile) / lighttpd, the worker returns immediately
+#   "x-accel"    - emit X-Accel-Redirect for nginx; DOWNLOAD_ACCEL_PREFIX must be an `internal` location
+#                  that aliases DOWNLOAD_FOLDER, e.g. `location /protected-downloads/ { internal; alias .../downloads/; }`
+# With an offload mode the front proxy does the transfer (and Range/conditional handling), so a large
+# file doesn't tie up a gunicorn worker for the whole transfer.
+DOWNLOAD_OFFLOAD = os.environ.get("DOWNLOAD_OFFLOAD", "none").lower()
+DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX", "/protected-downloads/")
+app.config['USE_X_SENDFILE'] = DOWNLOAD_OFFLOAD == "x-sendfile"
+
+# How /download gets the file to the browser:
+#   "cache"  - download it into DOWNLOAD_FOLDER first, then serve it (default)
+#   "stream" - relay the upstream body to the browser as it arrives (first byte after the upstream's first byte)
+# The form can override this per request with a `delivery` field.
+DOWNLOAD_MODE = os.environ.get("DOWNLOAD_MODE", "cache").lower()
+# In "stream" mode, also keep a copy in DOWNLOAD_FOLDER while relaying (off by default to save disk).
+STREAM_CACHE_COPY = os.environ.get("STREAM_CACHE_COPY", "0").lower() in ("1", "true", "yes")
+STREAM_CHUNK_SIZE = 64 * 1024 # bytes
+
+# Thumbnails/renditions shown on results.html are proxied and cached here instead of
+# making every browser pull the full-size originals.
+PREVIEW_CACHE_DIR = os.path.join(app.instance_path, 'preview_cache')
+PREVIEW_CACHE_MAX_BYTES = int(os.environ.get("PREVIEW_CACHE_MAX_BYTES", DEFAULT_PREVIEW_CACHE_MAX_BYTES))
+PREVIEW_MAX_AGE = 30 * 24 * 3600 # seconds; preview URLs are content-addressed upstream, so they can be cached long
+init_preview_cache(PREVIEW_CACHE_DIR, PREVIEW_CACHE_MAX_BYTES)
+
+
+# Listing results are shared between gunicorn workers for a short time, so a burst of identical
+# searches makes a single upstream request per platform. Empty listings and errors are kept
+# briefly too; popular listings are served up to LISTING_CACHE_STALE_TTL past expiry while one
+# background refresh runs.
+LISTING_CACHE_DIR = os.path.join(app.instance_path, 'listing_cache')
+LISTING_CACHE_TTL = int(os.environ.get("LISTING_CACHE_TTL", DEFAULT_LISTING_CACHE_TTL))
+LISTING_CACHE_EMPTY_TTL = int(os.environ.get("LISTING_CACHE_EMPTY_TTL", DEFAULT_EMPTY_TTL))
+LISTING_CACHE_ERROR_TTL = int(os.environ.get("LISTING_CACHE_ERROR_TTL", DEFAULT_ERROR_TTL))
+LISTING_CACHE_STALE_TTL = int(os.environ.get("LISTING_CACHE_STALE_TTL", DEFAULT_STALE_TTL))
+configure_listing_cache(LISTING_CACHE_DIR, LISTING_CACHE_TTL, LISTING_CACHE_EMPTY_TTL, LISTING_CACHE_ERROR_TTL,
+                        LISTING_CACHE_STALE_TTL)
+
+# Searches are logged (instance/query_log.jsonl) so a background warmer can re-list the CACHE_WARMER_TOP_N most
+# frequent ones per platform every CACHE_WARMER_INTERVAL seconds (0 = off), before their listings expire, and
+# cache the previews of their first page. Only one worker on the host warms at a time.
+QUERY_LOG_PATH = os.environ.get("QUERY_LOG_PATH", os.path.join(app.instance_path, 'query_log.jsonl'))
+configure_query_log(QUERY_LOG_PATH)
+CACHE_WARMER_INTERVAL = int(os.environ.get("CACHE_WARMER_INTERVAL", 60))
+CACHE_WARMER_TOP_N = int(os.environ.get("CACHE_WARMER_TOP_N", 5))
+CACHE_WARMER_PREVIEWS = os.environ.get("CACHE_WARMER_PREVIEWS", "1").lower() in ("1", "true", "yes")
+
+# Downloads are indexed (title, subtitles, descriptions, local path) in a SQLite library, so searches with
+# "search already-downloaded media first" are answered from DOWNLOAD_FOLDER before going upstream.
+LIBRARY_PATH = os.path.join(app.instance_path, LIBRARY_NAME)
+configure_media_library(LIBRARY_PATH)
+# Listing fields the results page posts back with a download, for the library index
+LIBRARY_METADATA_KEYS = ("id", "size_bytes", "preview_image_url", "rendition", "episode", "timestamp", "subtitle", "description")
+MAX_METADATA_LENGTH = 16 * 1024
+
+# Jinja filter: the LIBRARY_METADATA_KEYS of an item as JSON, for the download form's hidden field
+def library_metadata(item):
+    return json_backend.dumps({key: item[key] for key in LIBRARY_METADATA_KEYS if item.get(key) is not None})
+
+app.jinja_env.filters['library_metadata'] = library_metadata
+
+# Circuit breakers: skip a platform after this many consecutive failed listings, probe again after the reset time
+CIRCUIT_BREAKER_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_THRESHOLD", DEFAULT_FAILURE_THRESHOLD))
+CIRCUIT_BREAKER_RESET_SECONDS = int(os.environ.get("CIRCUIT_BREAKER_RESET_SECONDS", DEFAULT_RESET_TIMEOUT))
+configure_circuit_breakers(CIRCUIT_BREAKER_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS)
+
+# Total time budget for one /search; each platform call only gets what is left of it
+SEARCH_DEADLINE_SECONDS = float(os.environ.get("SEARCH_DEADLINE_SECONDS", 20))
+
+# Download bandwidth (KB/s, per worker process; unset = unlimited), e.g. DOWNLOAD_RATE_LIMIT_KB=2048 and
+# DOWNLOAD_PLATFORM_RATE_LIMITS_KB="pixabay=1024,mixkit=512". Web downloads are interactive: while one runs,
+# batch runs on this host (the CLI, sharing TRANSFER_MARKER_PATH) slow down to BATCH_YIELD_RATE_KB between them.
+# Prefetches (background priority) share PREFETCH_RATE_LIMIT_KB (0 = no cap of their own).
+DOWNLOAD_RATE_LIMIT_KB = float(os.environ.get("DOWNLOAD_RATE_LIMIT_KB", 0))
+DOWNLOAD_PLATFORM_RATE_LIMITS = parse_platform_limits(os.environ.get("DOWNLOAD_PLATFORM_RATE_LIMITS_KB", ""))
+BATCH_YIELD_RATE_KB = float(os.environ.get("BATCH_YIELD_RATE_KB", DEFAULT_YIELD_BYTES_PER_SEC / 1024))
+PREFETCH_RATE_LIMIT_KB = float(os.environ.get("PREFETCH_RATE_LIMIT_KB", 512))
+configure_transfer_scheduler(int(DOWNLOAD_RATE_LIMIT_KB * 1024) or None, DOWNLOAD_PLATFORM_RATE_LIMITS,
+                             int(BATCH_YIELD_RATE_KB * 1024), os.environ.get("TRANSFER_MARKER_PATH", DEFAULT_MARKER_PATH),
+                             int(PREFETCH_RATE_LIMIT_KB * 1024) or None)
+
+# Speculative prefetch (off unless PREFETCH_TOP_K > 0): after /search, the first PREFETCH_TOP_K results of each
+# platform are downloaded into DOWNLOAD_FOLDER in the background (PREFETCH_WORKERS at a time), so the likely
+# "Download" clicks are served from disk. Items over PREFETCH_MAX_ITEM_MB are skipped, and unclaimed prefetches
+# may take at most PREFETCH_BUDGET_MB of the download quota.
+PREFETCH_TOP_K = int(os.environ.get("PREFETCH_TOP_K", 0))
+PREFETCH_MAX_ITEM_MB = float(os.environ.get("PREFETCH_MAX_ITEM_MB", DEFAULT_PREFETCH_MAX_ITEM_BYTES / (1024 * 1024)))
+PREFETCH_BUDGET_MB = float(os.environ.get("PREFETCH_BUDGET_MB", DEFAULT_PREFETCH_BUDGET_BYTES / (1024 * 1024)))
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", DEFAULT_PREFETCH_WORKERS))
+prefetcher = Prefetcher(download_storage, DOWNLOAD_BASE_DIR,
+                        lambda item, download_dir, query: download_selected_item(item, download_dir, skip_existing=True, query=query),
+                        PREFETCH_TOP_K, int(PREFETCH_MAX_ITEM_MB * 1024 * 1024), int(PREFETCH_BUDGET_MB * 1024 * 1024),
+                        PREFETCH_WORKERS)
+
+# Hash recorded in each download folder's manifest (sha256 or blake2b), checked by `media_downloader_tool.py verify`
+configure_integrity(os.environ.get("DOWNLOAD_HASH_ALGORITHM", DEFAULT_HASH_ALGORITHM))
+# Ranged probes for item size/dimensions/duration (Frinkiac, Morbotron, Mixkit listings), cached per URL
+configure_media_probe(int(os.environ.get("MEDIA_PROBE_KB", DEFAULT_PROBE_BYTES // 1024)) * 1024,
+                      cache_ttl=int(os.environ.get("MEDIA_PROBE_CACHE_TTL", DEFAULT_PROBE_CACHE_TTL)))
+
+# JSON search API: largest page size, and how long clients/proxies may reuse a response without revalidating
+API_SEARCH_MAX_LIMIT = 50
+API_SEARCH_MAX_AGE = int(os.environ.get("API_SEARCH_MAX_AGE", min(LISTING_CACHE_TTL, 60)))
+
+# Live sampling profiler at /debug/profile?seconds=N; off unless DEBUG_PROFILE is set, since it exposes stack traces
+DEBUG_PROFILE_ENABLED = os.environ.get("DEBUG_PROFILE", "0").lower() in ("1", "true", "yes")
+DEBUG_PROFILE_MAX_SECONDS = 60
+
+
+@app.before_request
+def ensure_storage_eviction():
+    # Started lazily so each gunicorn worker (forked after --preload) gets its own eviction thread.
+    download_storage.start_background_eviction()
+    start_cache_warmer()
+
+
+_warmer_thread = None
+_warmer_pid = None
+_warmer_lock = threading.Lock()
+
+
+def start_cache_warmer():
+    """Starts this process's cache warmer thread if enabled (safe to call repeatedly, and again after fork)."""
+    global _warmer_thread, _warmer_pid
+    if CACHE_WARMER_INTERVAL <= 0:
+        return
+    with _warmer_lock:
+        if _warmer_thread is not None and _warmer_pid == os.getpid() and _warmer_thread.is_alive():
+            return
+        _warmer_pid = os.getpid()
+        _warmer_thread = threading.Thread(target=_cache_warmer_loop, name="cache-warmer", daemon=True)
+        _warmer_thread.start()
+
+
+def _cache_warmer_loop():
+    while True:
+        time.sleep(CACHE_WARMER_INTERVAL)
+        try:
+            with singleflight.file_lock("cache-warmer", blocking=False) as leader:
+                if not leader:
+                    continue  # Another worker is warming right now
+                # Refresh anything that would expire before the next round (with a round's slack)
+                refreshed = warm_popular_searches(CACHE_WARMER_TOP_N, api_timeout=10, ahead=2 * CACHE_WARMER_INTERVAL,
+                                                  fetch_preview=fetch_preview if CACHE_WARMER_PREVIEWS else None)
+            if refreshed:
+                print(f"Cache warmer: refreshed {refreshed} popular listing(s)")
+        except Exception as e:  # Never let the warmer thread die
+            print(f"Cache warmer: pass failed: {e}")
 
 
 # Helper to get platform default timeout - useful for UI display or logic
@@ -67,6 +257,8 @@ def get_platform_default_timeout(platform):
     # if platform == "comb_io": return COMBIO_TIMEOUT # Placeholder
     return 10 # Generic default
 
+MEDIA_TYPES = ["all", "image", "gif", "video", "audio", "sticker"]
+
 @app.route('/', methods=['GET'])
 def index():
     warnings = []
@@ -77,9 +269,60 @@ def index():
 
     return render_template('index.html',
                            platforms=SUPPORTED_PLATFORMS, # SUPPORTED_PLATFORMS from media_downloader_tool.py will have all
-                           media_types=["all", "image", "gif", "video", "audio", "sticker"],
+                           media_types=MEDIA_TYPES,
                            warnings=warnings if warnings else None)
 
+def parse_optional_positive(value, cast=int):
+    """Optional numeric field: None when empty, else a positive number (ValueError otherwise)."""
+    if value is None or not str(value).strip():
+        return None
+    number = cast(value)
+    if not number > 0:
+        raise ValueError("must be positive")
+    return number
+
+def parse_size_limits(fields):
+    """renditions.make_size_limits() from form/query fields max_width, max_height, max_item_mb, target_height."""
+    max_item_mb = parse_optional_positive(fields.get('max_item_mb'), float)
+    return make_size_limits(parse_optional_positive(fields.get('max_width')),
+                            parse_optional_positive(fields.get('max_height')),
+                            int(max_item_mb * 1024 * 1024) if max_item_mb else None,
+                            parse_optional_positive(fields.get('target_height')))
+
+def get_platform_block(platform, query, fetch_limit, media_type, api_timeout, deadline, size_limits=None):
+    """One platform's listing as the status block used by results.html and /api/search."""
+    # Concurrent identical searches (other threads or workers) share one upstream call
+    platform_results = get_platform_listing(platform, query, fetch_limit, media_type, api_timeout, deadline, size_limits)
+
+    # Store structured results including errors/status
+    current_platform_data = {"platform_name": platform, "items": [], "error": None, "status_message": None}
+    if isinstance(platform_results, dict): # New return type
+        current_platform_data["items"] = platform_results.get("items", [])
+        current_platform_data["error"] = platform_results.get("error")
+        current_platform_data["status_message"] = platform_results.get("status_message")
+    elif isinstance(platform_results, list): # Old return type (fallback, should be phased out)
+         current_platform_data["items"] = platform_results
+    current_platform_data["breaker"] = breaker_state(platform)
+    return current_platform_data
+
+def get_library_first_block(platform, query, limit, fetch_limit, media_type, api_timeout, deadline, size_limits=None):
+    """
+    get_platform_block(), answered from the media library alone when it has `limit` matches. Otherwise
+    the library's matches come first, followed by the platform's items that aren't downloaded yet.
+    """
+    library_items = search_library(query, [platform], media_type, limit)
+    if len(library_items) >= limit:
+        return {"platform_name": platform, "items": library_items, "error": None,
+                "status_message": f"{platform.title()}: Answered from already-downloaded media.",
+                "breaker": breaker_state(platform)}
+    block = get_platform_block(platform, query, fetch_limit, media_type, api_timeout, deadline, size_limits)
+    if library_items:
+        upstream_items = block["items"]
+        known = known_item_ids(platform, [item.get("id") for item in upstream_items])
+        block["items"] = library_items + [item for item in upstream_items if str(item.get("id")) not in known]
+    return block
+
+
 @app.route('/search', methods=['POST'])
 def search():
     query = request.form.get('query')
@@ -88,6 +331,11 @@ def search():
     limit_per_platform = int(request.form.get('limit', 5))
     # Timeouts from form - assuming they are provided as strings
     api_call_timeout = int(request.form.get('api_call_timeout', 10))
+    local_first = request.form.get('local_first') == '1'
+    try:
+        size_limits = parse_size_limits(request.form)
+    except ValueError:
+        return "Error: Size limits must be positive numbers.", 400
     # download_timeout = int(request.form.get('download_timeout', get_platform_default_timeout('generic'))) # This needs to be per item
 
     if not query:
@@ -95,6 +343,8 @@ def search():
     if not selected_platforms:
         return "Error: At least one platform must be selected.", 400
 
+    record_search(query, selected_platforms, media_type, limit_per_platform * 2, limit_per_platform, size_limits)
+    deadline = Deadline(SEARCH_DEADLINE_SECONDS)
     all_results = []
     # For web, better to fetch a decent number for display then let user pick (or paginate)
     # The 'limit' from UI can mean items to *display* per platform before selection,
@@ -102,47 +352,12 @@ def search():
     # Let's assume 'limit' is for how many items to list from each source initially.
 
     for platform in selected_platforms:
-        platform_results = []
-        if platform == 'giphy':
-            if GIPHY_API_KEY != "YOUR_GIPHY_API_KEY_HERE":
-                platform_results = list_giphy_media(query, limit_per_platform * 2, media_type, api_call_timeout)
-            else:
-                print("Skipping Giphy search in web UI: API key not set.")
-        elif platform == 'morbotron':
-            mt = "image" if media_type not in ["image", "all"] else media_type
-            if media_type == "all" or media_type == "image":
-                platform_results = list_morbotron_media(query, limit_per_platform * 2, mt, api_call_timeout)
-        elif platform == 'wikimedia':
-            platform_results = list_wikimedia_media(query, limit_per_platform * 2, media_type, api_call_timeout)
-        elif platform == 'wikimedia_oauth':
-            platform_results = list_wikimedia_oauth_media(query, limit_per_platform * 2, media_type, api_call_timeout)
-        elif platform == 'pixabay':
-            if PIXABAY_API_KEY != "YOUR_PIXABAY_API_KEY_HERE":
-                if media_type == "all" or media_type == "video":
-                    platform_results = list_pixabay_videos(query, limit_per_platform * 2, api_timeout=api_call_timeout)
-                # else: print(f"WebUI: Pixabay skipped, wrong media type '{media_type}'")
-            else:
-                print("Skipping Pixabay search in web UI: API key not set.")
-        elif platform == 'frinkiac':
-            if media_type == "all" or media_type == "image": # Frinkiac is image specific
-                platform_results = list_frinkiac_media(query, limit_per_platform * 2, api_timeout=api_call_timeout)
-            # else: print(f"WebUI: Frinkiac skipped, wrong media type '{media_type}'")
-        elif platform == 'mixkit':
-            if media_type == "all" or media_type == "video": # Mixkit is video specific (for this downloader)
-                platform_results = list_mixkit_videos(query, limit_per_platform * 2, api_timeout=api_call_timeout)
-            # else: print(f"WebUI: Mixkit skipped, wrong media type '{media_type}'")
-        # elif platform == 'comb_io':
-            # list_call_result = list_comb_io_media(query, limit_per_platform * 2, media_type, api_call_timeout)
-
-        # Store structured results including errors/status
-        current_platform_data = {"platform_name": platform, "items": [], "error": None, "status_message": None}
-        if isinstance(platform_results, dict): # New return type
-            current_platform_data["items"] = platform_results.get("items", [])
-            current_platform_data["error"] = platform_results.get("error")
-            current_platform_data["status_message"] = platform_results.get("status_message")
-        elif isinstance(platform_results, list): # Old return type (fallback, should be phased out)
-             current_platform_data["items"] = platform_results
-
+        if local_first:
+            current_platform_data = get_library_first_block(platform, query, limit_per_platform, limit_per_platform * 2, media_type,
+                                                            api_call_timeout, deadline, size_limits)
+        else:
+            current_platform_data = get_platform_block(platform, query, limit_per_platform * 2, media_type, api_call_timeout, deadline,
+                                                       size_limits)
         all_results.append(current_platform_data) # all_results is now a list of these dicts
 
         # Only extend the flat list for display if items exist, for the old results.html compatibility (will change)
@@ -150,8 +365,6 @@ def search():
         # This will be simplified when results.html is updated.
         # flat_item_list.extend(current_platform_data["items"])
 
-        time.sleep(0.5) # Small delay between platform API calls
-
     # Sanitize query for use as part of a directory name, if needed later for organizing downloads
     safe_query_name = "".join(c if c.isalnum() else "_" for c in query[:50]).strip('_') or "search"
 
@@ -163,6 +376,9 @@ def search():
         # We take up to 'limit_per_platform' from these for the final display from this specific platform.
         display_items.extend(items_from_platform[:limit_per_platform])
 
+    # Start fetching the items most likely to be clicked (a no-op unless PREFETCH_TOP_K is set)
+    prefetcher.prefetch_results([{"items": block.get('items', [])[:limit_per_platform]} for block in all_results], query)
+
     # The existing overall slice limit_per_platform * len(selected_platforms)
     # can still act as a total cap. If limit_per_platform=5 and 6 platforms selected,
     # display_items could now have up to 30 items (5 from each). The slice would be [:30],
@@ -181,6 +397,140 @@ def search():
                            safe_query_name=safe_query_name)
 
 
+def _api_error(message, status=400):
+    return Response(json_backend.dumps({"error": message}), status=status, mimetype='application/json')
+
+
+def _search_params_key(query, platforms, media_type, limit, size_limits=None):
+    """Short fingerprint of a search, stored in its cursors so they can't be replayed against another search."""
+    raw = json_backend.dumps([query, platforms, media_type, limit, size_limits])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def _encode_cursor(params_key, offsets):
+    raw = json_backend.dumps({"k": params_key, "o": offsets})
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor, params_key):
+    """Returns {platform: offset} from a cursor, or None if it is malformed or belongs to another search."""
+    try:
+        data = json_backend.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, dict) or data.get("k") != params_key or not isinstance(data.get("o"), dict):
+        return None
+    offsets = data["o"]
+    if not all(isinstance(offset, int) and offset >= 0 for offset in offsets.values()):
+        return None
+    return offsets
+
+
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    """
+    JSON search: ?q=...&platforms=giphy,wikimedia&media_type=all&limit=5[&max_width=&max_height=&max_item_mb=&target_height=][&cursor=...]
+    Returns a status block per platform, up to `limit` items per platform, and `next_cursor`
+    for the following page (null once every platform is exhausted).
+    """
+    query = request.args.get('q', '').strip()
+    platforms = [p for value in request.args.getlist('platforms') for p in value.split(',') if p]
+    media_type = request.args.get('media_type', 'all')
+    try:
+        limit = int(request.args.get('limit', 5))
+        api_call_timeout = int(request.args.get('api_call_timeout', 10))
+    except ValueError:
+        return _api_error("limit and api_call_timeout must be integers.")
+    try:
+        size_limits = parse_size_limits(request.args)
+    except ValueError:
+        return _api_error("max_width, max_height, max_item_mb and target_height must be positive numbers.")
+
+    if not query:
+        return _api_error("Search query (q) is required.")
+    if not platforms:
+        return _api_error("At least one platform must be selected.")
+    unknown = [p for p in platforms if p not in SUPPORTED_PLATFORMS]
+    if unknown:
+        return _api_error(f"Unknown platform(s): {', '.join(unknown)}.")
+    if media_type not in MEDIA_TYPES:
+        return _api_error(f"Unknown media_type '{media_type}'.")
+    if not 1 <= limit <= API_SEARCH_MAX_LIMIT:
+        return _api_error(f"limit must be between 1 and {API_SEARCH_MAX_LIMIT}.")
+
+    params_key = _search_params_key(query, platforms, media_type, limit, size_limits)
+    cursor = request.args.get('cursor')
+    if cursor:
+        offsets = _decode_cursor(cursor, params_key)
+        if offsets is None:
+            return _api_error("Invalid cursor for this search.")
+    else:
+        offsets = {platform: 0 for platform in platforms}
+        record_search(query, platforms, media_type, limit * 2, limit, size_limits)  # First pages only
+
+    deadline = Deadline(SEARCH_DEADLINE_SECONDS)
+    # Same listing size as the HTML search, so the first page shares its listing cache entries
+    window = limit * 2
+    platform_blocks = []
+    items = []
+    next_offsets = {}
+    any_error = False
+    for platform in platforms:
+        if platform not in offsets:
+            continue # Exhausted on an earlier page
+        offset = offsets[platform]
+        # Listers always start from the top, so fetch whole windows: consecutive pages hit the same cache entry
+        fetch_limit = -(-(offset + limit) // window) * window
+        block = get_platform_block(platform, query, fetch_limit, media_type, api_call_timeout, deadline, size_limits)
+        listed = block["items"]
+        page = listed[offset:offset + limit]
+        has_more = not block["error"] and (len(listed) > offset + limit or len(listed) >= fetch_limit)
+        if has_more:
+            next_offsets[platform] = offset + len(page)
+        any_error = any_error or bool(block["error"])
+        items.extend(item.to_dict() if hasattr(item, 'to_dict') else dict(item) for item in page)
+        platform_blocks.append({
+            "platform": platform,
+            "error": block["error"],
+            "status_message": block["status_message"],
+            "breaker": block["breaker"],
+            "offset": offset,
+            "returned": len(page),
+            "has_more": has_more,
+        })
+
+    body = json_backend.dumps({
+        "query": query,
+        "media_type": media_type,
+        "limit": limit,
+        "platforms": platform_blocks,
+        "items": items,
+        "next_cursor": _encode_cursor(params_key, next_offsets) if next_offsets else None,
+    })
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha256(body.encode('utf-8')).hexdigest())
+    # Pages with a platform error shouldn't be reused without asking again
+    response.headers['Cache-Control'] = "no-cache" if any_error else f"public, max-age={API_SEARCH_MAX_AGE}"
+    return response.make_conditional(request)
+
+
+@app.route('/preview', methods=['GET'])
+def preview():
+    src = request.args.get('src', '')
+    if not is_allowed_preview_url(src):
+        return "Error: Preview source not allowed.", 400
+
+    cached = fetch_preview(src)
+    if not cached:
+        # Upstream failed or returned something we won't cache; let the browser try the source directly.
+        return redirect(src)
+
+    path, mimetype = cached
+    response = send_file(path, mimetype=mimetype, max_age=PREVIEW_MAX_AGE, conditional=True)
+    response.headers['Cache-Control'] = f"public, max-age={PREVIEW_MAX_AGE}, immutable"
+    return response
+
+
 @app.route('/download', methods=['POST'])
 def download():
     item_url = request.form.get('url')
@@ -195,6 +545,8 @@ def download():
 
     if not all([item_url, item_filename, item_platform]):
         return "Error: Missing item details for download.", 400
+    if item_platform not in SUPPORTED_PLATFORMS or os.path.basename(item_filename) != item_filename:
+        return "Error: Invalid item details for download.", 400
 
     # Use a fixed base output directory for web downloads for now
     # Each download will be in DOWNLOAD_BASE_DIR / platform_name / query_name / filename
@@ -202,12 +554,23 @@ def download():
 
     # Create the item object expected by download_selected_item
     item_details = {
+        **parse_item_metadata(request.form.get('metadata')), # Extra listing fields, for the library index
         'url': item_url,
         'filename': item_filename,
         'platform': item_platform,
         'title': item_title, # Not strictly needed by download_selected_item but good to have
         'type': item_type    # Same as above
     }
+    search_query = request.form.get('query')
+    # A prefetch of this item still running goes on at interactive priority; download_selected_item() below waits for it
+    prefetch_pending = prefetcher.claim(item_details)
+
+    delivery = request.form.get('delivery', DOWNLOAD_MODE).lower()
+    if delivery == "stream" and not prefetch_pending:
+        # Cached or prefetched earlier: no need to go upstream
+        if locate(os.path.join(app.config['DOWNLOAD_FOLDER'], item_platform), item_filename):
+            return redirect(url_for('downloaded_file', platform=item_platform, filename=item_filename), code=303)
+        return stream_item_to_client(item_details, search_query)
 
     # Download timeout: use platform default for now, or could add a form field for it
     # For now, download_selected_item has its own logic for this using platform defaults.
@@ -226,35 +589,173 @@ def download():
     # platform_output_dir = os.path.join(base_output_dir, item['platform'])
 
     # Call the download function. It will save to app.config['DOWNLOAD_FOLDER']/platform/filename
-    download_path = download_selected_item(item_details, app.config['DOWNLOAD_FOLDER'])
+    # skip_existing: the download folder is a cache, and concurrent clicks on the same item share one transfer
+    # Someone is waiting for this one: it gets bandwidth ahead of batch runs
+    with use_transfer_priority(INTERACTIVE):
+        download_path = download_selected_item(item_details, app.config['DOWNLOAD_FOLDER'], skip_existing=True, query=search_query)
+        if not download_path and prefetch_pending:
+            # The prefetch this request waited for failed; a speculative failure shouldn't fail the click
+            download_path = download_selected_item(item_details, app.config['DOWNLOAD_FOLDER'], skip_existing=True, query=search_query)
 
     if download_path:
-        # Provide a link to download the file from the server's static/download directory
-        # The file is now at app.config['DOWNLOAD_FOLDER']/item_platform/item_filename
-        # We need to serve it. `send_from_directory` is good for this.
-        # The path for send_from_directory is relative to the directory specified.
-        # So, directory is app.config['DOWNLOAD_FOLDER']/item_platform
-        # and filename is item_filename
-        platform_specific_download_folder = os.path.join(app.config['DOWNLOAD_FOLDER'], item_platform)
-
-        # Ensure the directory exists if download_selected_item didn't create it (it should)
-        # if not os.path.exists(platform_specific_download_folder):
-        #    os.makedirs(platform_specific_download_folder)
+        download_storage.record(download_path)
+        # The file is now at app.config['DOWNLOAD_FOLDER']/item_platform/item_filename (or its shard folder).
+        # Redirect to the GET route that serves it, so the browser can use Range (resume/seek)
+        # and conditional requests against it, and so an offloading proxy can take over the transfer.
 
         # Check if file exists after download_selected_item reports success
-        actual_file_path = os.path.join(platform_specific_download_folder, item_filename)
-        if os.path.exists(actual_file_path):
-             return send_from_directory(directory=platform_specific_download_folder,
-                                       path=item_filename,  # Changed from filename= to path= for Flask 2.x
-                                       as_attachment=True)
+        if os.path.exists(download_path):
+            return redirect(url_for('downloaded_file', platform=item_platform, filename=item_filename), code=303)
         else:
             # This case should ideally not happen if download_path was returned.
-            return "Error: File not found on server after download attempt. Path: " + actual_file_path, 404
+            return "Error: File not found on server after download attempt. Path: " + download_path, 404
 
     else:
         return f"Error: Failed to download '{item_title}'.", 500
 
 
+def _attachment_header(filename):
+    """Content-Disposition value that survives non-ASCII filenames."""
+    ascii_name = filename.encode("ascii", "ignore").decode("ascii").replace('"', '') or "download"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quote(filename)}"
+
+
+def parse_item_metadata(raw):
+    """The listing fields posted with a download (LIBRARY_METADATA_KEYS only); {} if absent or malformed."""
+    if not raw or len(raw) > MAX_METADATA_LENGTH:
+        return {}
+    try:
+        data = json_backend.loads(raw)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    return {key: value for key, value in data.items()
+            if key in LIBRARY_METADATA_KEYS and isinstance(value, (str, int, float)) and not isinstance(value, bool)}
+
+
+def stream_item_to_client(item_details, search_query=None):
+    """
+    Relays the upstream body of an item straight to the client, chunk by chunk, passing along the
+    upstream Content-Length and Content-Type. With STREAM_CACHE_COPY the same chunks are also written
+    to DOWNLOAD_FOLDER/platform/filename (only kept if the transfer completes).
+    """
+    try:
+        upstream = open_download_stream(item_details)
+    except requests.exceptions.RequestException as e:
+        print(f"Error streaming {item_details['url']}: {e}")
+        return f"Error: Failed to download '{item_details.get('title')}'.", 502
+
+    filename = item_details['filename']
+    content_type = (upstream.headers.get('Content-Type')
+                    or mimetypes.guess_type(filename)[0]
+                    or 'application/octet-stream')
+    headers = {'Content-Disposition': _attachment_header(filename)}
+    # requests decodes gzip/deflate bodies, so the upstream length only holds for identity encoding
+    content_encoding = upstream.headers.get('Content-Encoding', 'identity').lower()
+    if upstream.headers.get('Content-Length') and content_encoding in ('', 'identity'):
+        headers['Content-Length'] = upstream.headers['Content-Length']
+
+    cache_path = None
+    if STREAM_CACHE_COPY:
+        cache_path = output_path(os.path.join(app.config['DOWNLOAD_FOLDER'], item_details['platform']), filename)
+
+    def relay():
+        tmp_path = None
+        cache_file = None
+        hasher = new_hasher() if cache_path else None
+        written = 0
+        completed = False
+        try:
+            if cache_path:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                tmp_path = f"{cache_path}.{os.getpid()}.part"
+                cache_file = open(tmp_path, 'wb')
+            with get_transfer_scheduler().transfer(item_details['platform'], INTERACTIVE) as transfer:
+                for chunk in upstream.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    transfer.throttle(len(chunk))
+                    if cache_file:
+                        cache_file.write(chunk)
+                        hasher.update(chunk)
+                        written += len(chunk)
+                    yield chunk
+            # A body shorter (or longer) than announced is relayed as is, but not kept as the cached copy
+            completed = expected_length(upstream) in (None, written)
+        finally:
+            # Runs on completion, upstream errors and client disconnects (generator close)
+            upstream.close()
+            if cache_file:
+                cache_file.close()
+                if completed:
+                    os.replace(tmp_path, cache_path)
+                    record_download(cache_path, written, hasher.name, hasher.hexdigest(), item_details['url'], item_details['platform'])
+                    index_file(cache_path, written)
+                    download_storage.record(cache_path)
+                    record_library_item(item_details, cache_path, search_query)
+                else:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+    return Response(relay(), headers=headers, content_type=content_type, direct_passthrough=True)
+
+
+def send_download_file(platform, filename):
+    """
+    Sends DOWNLOAD_FOLDER/platform/filename (or its shard folder) as an attachment using the configured
+    DOWNLOAD_OFFLOAD mode. Range, ETag and Last-Modified/If-* handling come from Werkzeug (or from the proxy when offloading).
+    """
+    file_path = locate(os.path.join(app.config['DOWNLOAD_FOLDER'], platform), filename)
+    if file_path is None or os.path.basename(file_path) != filename:
+        abort(404)
+    platform_specific_download_folder = os.path.dirname(file_path)
+    download_storage.touch(file_path) # Refresh LRU position; also keeps it inside the serve grace window
+
+    if DOWNLOAD_OFFLOAD == "x-accel":
+        # send_from_directory still builds the headers (type, disposition, ETag) and does the safe path join;
+        # we then drop the body and let nginx stream the file from its internal location.
+        response = send_from_directory(directory=platform_specific_download_folder, path=filename,
+                                       as_attachment=True, conditional=False)
+        response.close()
+        response.direct_passthrough = False
+        response.set_data(b"")
+        relative_path = os.path.relpath(file_path, app.config['DOWNLOAD_FOLDER']).replace(os.sep, "/")
+        response.headers['X-Accel-Redirect'] = f"{DOWNLOAD_ACCEL_PREFIX.rstrip('/')}/{quote(relative_path)}"
+        return response
+
+    # "none" and "x-sendfile" (USE_X_SENDFILE is set from DOWNLOAD_OFFLOAD at startup)
+    # Pinned while send_from_directory opens the file; once the handle is open, an eviction
+    # (unlink) can't cut the transfer short, and the touch above keeps it out of the next passes.
+    download_storage.pin(file_path)
+    try:
+        return send_from_directory(directory=platform_specific_download_folder,
+                                   path=filename,  # Changed from filename= to path= for Flask 2.x
+                                   as_attachment=True, conditional=True, etag=True)
+    finally:
+        download_storage.unpin(file_path)
+
+
+@app.route('/downloads/<platform>/<filename>', methods=['GET'])
+def downloaded_file(platform, filename):
+    if platform not in SUPPORTED_PLATFORMS:
+        abort(404)
+    return send_download_file(platform, filename)
+
+
+@app.route('/debug/profile', methods=['GET'])
+def debug_profile():
+    """Samples this worker's threads for ?seconds=N and returns collapsed stacks (for flamegraph.pl / speedscope)."""
+    if not DEBUG_PROFILE_ENABLED:
+        abort(404)
+    try:
+        seconds = float(request.args.get('seconds', 5))
+    except ValueError:
+        return "Error: seconds must be a number.", 400
+    seconds = min(max(seconds, 0.1), DEBUG_PROFILE_MAX_SECONDS)
+    counts = sample_stacks(seconds)
+    return Response(format_collapsed(counts), mimetype='text/plain')
+
 if __name__ == '__main__':
     # Create instance path if it doesn't exist
     if not os.path.exists(app.instance_path):
@@ -0,0 +1,88 @@
+"""
+Benchmark: size, transfer time and decode time of Giphy search responses, slim vs full.
+
+Runs the same live searches with GIPHY_RESPONSE_MODE "slim" (the `fields` the downloader
+reads, plus GIPHY_BUNDLE if set) and "full", and checks that both pick the same rendition
+for every item, so slimming changes nothing but the payload:
+
+    GIPHY_API_KEY=... python benchmarks/bench_giphy_payload.py "cats" --limits 50 100
+
+Response bytes are the decompressed body; request time includes the network, so run a few
+rounds and compare the medians.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+import json_backend  # noqa: E402
+from giphy_downloader import (  # noqa: E402
+    GIPHY_API_KEY, GIPHY_RESPONSE_MODES, GIPHY_SEARCH_URL, choose_giphy_rendition, giphy_search_params,
+)
+
+
+def fetch(query, limit, mode, timeout):
+    started = time.perf_counter()
+    response = requests.get(GIPHY_SEARCH_URL, params=giphy_search_params(query, limit, mode), timeout=timeout)
+    response.raise_for_status()
+    body = response.content
+    return body, time.perf_counter() - started
+
+
+def chosen_renditions(data, media_type):
+    chosen = {}
+    for item in data.get("data") or []:
+        info, extension, _ = choose_giphy_rendition(item, media_type)
+        chosen[item.get("id")] = (info.get("name"), info.get("url"), extension) if info else None
+    return chosen
+
+
+def bench(query, limits, media_type, rounds, number, timeout):
+    header = f"{'limit':>6} {'mode':<5} {'items':>6} {'KiB':>9} {'request ms':>11} {'decode ms':>10} {'same picks':>11}"
+    print(header)
+    for limit in limits:
+        reference = None
+        for mode in GIPHY_RESPONSE_MODES[::-1]:  # full first, as the reference
+            sizes, times = [], []
+            for _ in range(rounds):
+                body, seconds = fetch(query, limit, mode, timeout)
+                sizes.append(len(body))
+                times.append(seconds)
+            data = json_backend.loads(body)
+            decode = min(timeit.repeat(lambda: json_backend.loads(body), number=number, repeat=3)) / number
+            picks = chosen_renditions(data, media_type)
+            if reference is None:
+                reference, same = picks, "-"
+            else:
+                common = set(picks) & set(reference)
+                same = f"{sum(picks[key] == reference[key] for key in common)}/{len(common)}"
+            print(f"{limit:>6} {mode:<5} {len(data.get('data') or []):>6} {statistics.median(sizes) / 1024:>9.1f} "
+                  f"{statistics.median(times) * 1000:>11.1f} {decode * 1000:>10.3f} {same:>11}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare slim and full Giphy search responses.")
+    parser.add_argument("query", help="Search query.")
+    parser.add_argument("--limits", nargs="+", type=int, default=[50, 100], help="Result counts to request (default: 50 100).")
+    parser.add_argument("--media_type", default="all", choices=["gif", "video", "sticker", "all"],
+                        help="Media type used for the rendition check (default: all).")
+    parser.add_argument("--rounds", type=int, default=3, help="Requests per limit and mode (default: 3).")
+    parser.add_argument("--number", type=int, default=50, help="Decodes per timing run (default: 50).")
+    parser.add_argument("--timeout", type=float, default=15, help="Request timeout in seconds (default: 15).")
+    args = parser.parse_args()
+
+    if not GIPHY_API_KEY or GIPHY_API_KEY == "YOUR_GIPHY_API_KEY_HERE":
+        print("Set GIPHY_API_KEY to run this benchmark.")
+        return
+    print(f"json_backend uses: {json_backend.BACKEND}")
+    bench(args.query, args.limits, args.media_type, args.rounds, args.number, args.timeout)
+
+
+if __name__ == "__main__":
+    main()
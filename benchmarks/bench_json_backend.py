@@ -0,0 +1,104 @@
+"""
+Micro-benchmark: JSON decoding of real API payloads with the stdlib vs orjson.
+
+Payloads are recorded from the live platforms rather than made up, since their shape (deep
+nesting, long strings, many small objects) is what decides the speed-up:
+
+    python benchmarks/bench_json_backend.py --record "cats" --platforms wikimedia morbotron giphy
+    python benchmarks/bench_json_backend.py
+
+Recording runs the normal listers and saves every document they decode into
+benchmarks/payloads/ (Giphy/Pixabay need their API keys set). Without --record, each saved
+payload is decoded repeatedly with every available backend.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_backend  # noqa: E402
+
+PAYLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "payloads")
+
+
+def record(query, platforms, limit):
+    from media_downloader_tool import list_platform_media
+
+    if not os.path.exists(PAYLOAD_DIR):
+        os.makedirs(PAYLOAD_DIR)
+    original_loads = json_backend.loads
+    current = {"platform": None, "count": 0}
+
+    def recording_loads(data):
+        current["count"] += 1
+        name = f"{current['platform']}_{current['count']}.json"
+        with open(os.path.join(PAYLOAD_DIR, name), "wb") as f:
+            f.write(data if isinstance(data, bytes) else data.encode("utf-8"))
+        print(f"Recorded {name} ({len(data)} bytes)")
+        return original_loads(data)
+
+    json_backend.loads = recording_loads
+    try:
+        for platform in platforms:
+            current["platform"], current["count"] = platform, 0
+            result = list_platform_media(platform, query, limit)
+            if result.get("error") or result.get("status_message"):
+                print(f"{platform}: {result.get('error') or result.get('status_message')}")
+    finally:
+        json_backend.loads = original_loads
+
+
+def decoders():
+    available = {"json (stdlib)": json.loads}
+    if json_backend.orjson is not None:
+        available["orjson"] = json_backend.orjson.loads
+    return available
+
+
+def bench(number):
+    payloads = sorted(name for name in os.listdir(PAYLOAD_DIR) if name.endswith(".json")) if os.path.isdir(PAYLOAD_DIR) else []
+    if not payloads:
+        print(f"No payloads in {PAYLOAD_DIR}. Record some first with --record \"<query>\".")
+        return
+    if json_backend.orjson is None:
+        print("orjson is not installed; only the stdlib backend is measured (pip install orjson).")
+
+    available = decoders()
+    header = f"{'payload':<32} {'KiB':>8} " + " ".join(f"{name + ' MB/s':>18}" for name in available)
+    print(f"json_backend uses: {json_backend.BACKEND}\n{header}")
+    totals = {name: 0.0 for name in available}
+    total_bytes = 0
+    for name in payloads:
+        with open(os.path.join(PAYLOAD_DIR, name), "rb") as f:
+            data = f.read()
+        total_bytes += len(data) * number
+        row = f"{name[:32]:<32} {len(data) / 1024:>8.1f} "
+        for decoder_name, decode in available.items():
+            seconds = min(timeit.repeat(lambda: decode(data), number=number, repeat=3))
+            totals[decoder_name] += seconds
+            row += f"{len(data) * number / seconds / 1e6:>18.1f} "
+        print(row)
+    print(f"{'total':<32} {total_bytes / number / 1024:>8.1f} "
+          + " ".join(f"{total_bytes / seconds / 1e6:>18.1f}" for seconds in totals.values()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark JSON decoding backends on recorded API payloads.")
+    parser.add_argument("--record", metavar="QUERY", help="Record payloads by running the listers for this query.")
+    parser.add_argument("--platforms", nargs="+", default=["wikimedia", "morbotron", "giphy", "pixabay", "mixkit"],
+                        help="Platforms to record from (default: wikimedia morbotron giphy pixabay mixkit).")
+    parser.add_argument("--limit", type=int, default=25, help="Listing size used while recording (default: 25).")
+    parser.add_argument("--number", type=int, default=200, help="Decodes per timing run (default: 200).")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.platforms, args.limit)
+    else:
+        bench(args.number)
+
+
+if __name__ == "__main__":
+    main()
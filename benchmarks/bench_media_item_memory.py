@@ -0,0 +1,71 @@
+"""
+Memory benchmark: per-item overhead of plain dicts vs MediaItem for listing results.
+
+Builds N synthetic items shaped like the scrapers' output (fresh strings per item, as they
+come out of JSON/HTML parsing) and measures the traced allocations with tracemalloc.
+
+    python benchmarks/bench_media_item_memory.py --count 50000
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_item import MediaItem  # noqa: E402
+
+PLATFORMS = ("giphy", "wikimedia", "pixabay", "frinkiac", "mixkit", "morbotron")
+TYPES = ("gif", "image", "video", "image", "video", "image")
+
+
+def _fields(i):
+    # "".join(...) forces a new string object per item, like json.loads / BeautifulSoup do
+    k = i % len(PLATFORMS)
+    platform = "".join(PLATFORMS[k])
+    return {
+        "id": f"id{i}",
+        "title": f"Result title number {i}",
+        "url": f"https://media.example.org/{platform}/{i}/original.mp4",
+        "type": "".join(TYPES[k]),
+        "filename": f"{platform}_query_{i}.mp4",
+        "platform": platform,
+        "size_bytes": 100000 + i,
+        "preview_image_url": f"https://media.example.org/{platform}/{i}/thumb.jpg",
+    }
+
+
+def build_dicts(count):
+    return [_fields(i) for i in range(count)]
+
+
+def build_media_items(count):
+    return [MediaItem(**_fields(i)) for i in range(count)]
+
+
+def measure(builder, count):
+    gc.collect()
+    tracemalloc.start()
+    items = builder(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory use of dict vs MediaItem listing results.")
+    parser.add_argument("--count", type=int, default=50000, help="Number of items to build (default: 50000)")
+    args = parser.parse_args()
+
+    dict_bytes = measure(build_dicts, args.count)
+    item_bytes = measure(build_media_items, args.count)
+    print(f"{args.count} items")
+    print(f"  dict:      {dict_bytes / 1024 / 1024:8.2f} MiB  {dict_bytes / args.count:7.1f} B/item")
+    print(f"  MediaItem: {item_bytes / 1024 / 1024:8.2f} MiB  {item_bytes / args.count:7.1f} B/item")
+    print(f"  saved:     {(dict_bytes - item_bytes) / args.count:7.1f} B/item ({100 * (1 - item_bytes / dict_bytes):.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import threading
+import time
+
+# Per-platform circuit breakers for the listing calls.
+# A platform that keeps failing (network errors, timeouts, or a scraper reporting that the
+# page structure changed) would otherwise cost every search its full request timeout.
+# After `failure_threshold` consecutive failures the breaker opens: calls return the last
+# failure immediately. Once `reset_timeout` seconds have passed, the next call starts a
+# single probe in a background thread (half-open) and still returns immediately; the probe's
+# outcome closes the breaker or keeps it open for another `reset_timeout`.
+#
+# State is per process; each gunicorn worker learns about a broken platform on its own.
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_RESET_TIMEOUT = 120  # seconds a breaker stays open before probing again
+
+
+def is_failure(result):
+    """A listing result counts as a failure if it has an error or the scraper saw an unexpected page."""
+    return bool(result.get("error") or result.get("structure_changed"))
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one platform."""
+
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_failure = None  # Result dict of the most recent failure
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        """State for display: {"state", "consecutive_failures", "retry_in"} (retry_in in seconds, or None)."""
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = max(0, int(self.opened_at + self.reset_timeout - time.time()))
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures, "retry_in": retry_in}
+
+    def _record(self, result):
+        with self._lock:
+            if result.get("deadline_exceeded"):
+                if self.state == HALF_OPEN:
+                    self.state = OPEN  # Inconclusive probe; try again after another reset_timeout
+                    self.opened_at = time.time()
+                return  # The caller ran out of time; says nothing about the platform
+            if is_failure(result):
+                self.consecutive_failures += 1
+                self.last_failure = result
+                if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                    if self.state != OPEN:
+                        print(f"Circuit breaker: {self.name} opened after {self.consecutive_failures} consecutive failure(s)")
+                    self.state = OPEN
+                    self.opened_at = time.time()
+            else:
+                if self.state != CLOSED:
+                    print(f"Circuit breaker: {self.name} closed again")
+                self.state = CLOSED
+                self.consecutive_failures = 0
+                self.opened_at = None
+
+    def _run(self, fetch):
+        try:
+            result = fetch()
+        except Exception as e:  # Listers normally return error dicts; don't let a crash skip the bookkeeping
+            result = {"items": [], "error": f"{self.name.title()}: Unexpected error: {e}", "status_message": None}
+        self._record(result)
+        return result
+
+    def _open_result(self):
+        last = self.last_failure or {}
+        reason = last.get("error") or last.get("status_message") or "repeated failures"
+        return {
+            "items": [],
+            "error": f"{self.name.title()}: Temporarily skipped after {self.consecutive_failures} consecutive failure(s). Last: {reason}",
+            "status_message": None,
+            "circuit_open": True,
+        }
+
+    def call(self, fetch):
+        """Runs fetch() (returning a listing result dict) unless the breaker is open."""
+        with self._lock:
+            if self.state == CLOSED:
+                probe = False
+            elif self.state == OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                probe = True
+            else:
+                return self._open_result()  # Open, or a probe is already running
+
+            if probe:
+                result = self._open_result()
+
+        if probe:
+            threading.Thread(target=self._run, args=(fetch,), name=f"breaker-probe-{self.name}", daemon=True).start()
+            return result
+        return self._run(fetch)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_failure_threshold = DEFAULT_FAILURE_THRESHOLD
+_reset_timeout = DEFAULT_RESET_TIMEOUT
+
+
+def configure_circuit_breakers(failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT):
+    """Sets the thresholds used for breakers created from now on (call before the first listing)."""
+    global _failure_threshold, _reset_timeout
+    _failure_threshold = failure_threshold
+    _reset_timeout = reset_timeout
+
+
+def get_breaker(platform):
+    with _breakers_lock:
+        breaker = _breakers.get(platform)
+        if breaker is None:
+            breaker = CircuitBreaker(platform, _failure_threshold, _reset_timeout)
+            _breakers[platform] = breaker
+        return breaker
+
+
+def breaker_state(platform):
+    """Snapshot dict for the platform's breaker (see CircuitBreaker.snapshot)."""
+    return get_breaker(platform).snapshot()
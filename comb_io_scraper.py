@@ -1,7 +1,10 @@
 import requests
 import os
 import argparse
-import json
+from profiling import add_profile_arguments, profiler_from_args
+from json_backend import JSONDecodeError, response_json
+from download_utils import save_response
+from output_layout import output_path
 
 COMB_IO_SEARCH_API_URL = "https://comb.io/api/v1/caption/search"
 DEFAULT_DOWNLOAD_TIMEOUT = 10 # seconds
@@ -18,11 +21,9 @@ def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT)
         response = requests.get(url, stream=True, headers=headers, timeout=timeout)
         response.raise_for_status()
 
-        file_path = os.path.join(folder_name, file_name)
+        file_path = output_path(folder_name, file_name)
 
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        save_response(response, file_path, "comb_io")
         print(f"Downloaded {file_name} to {folder_name}")
         return file_path
     except requests.exceptions.Timeout:
@@ -57,14 +58,14 @@ def search_comb_io(query, limit=5, output_dir="comb_io_media", media_type="gif",
     try:
         response = requests.get(COMB_IO_SEARCH_API_URL, params=params, headers=headers, timeout=timeout)
         response.raise_for_status()
-        results = response.json()
+        results = response_json(response)
     except requests.exceptions.Timeout:
         print(f"Timeout during Comb.io API request for query: {query}")
         return []
     except requests.exceptions.RequestException as e:
         print(f"API request error for Comb.io query '{query}': {e}")
         return []
-    except json.JSONDecodeError:
+    except JSONDecodeError:
         print(f"Error decoding JSON from Comb.io: {response.text if 'response' in locals() else 'No response text'}")
         return []
 
@@ -128,8 +129,12 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", type=str, default="comb_io_media", help="Directory to save downloaded media.")
     parser.add_argument("--media_type", type=str, default="gif", choices=["gif", "video"], help="Type of media to download (gif or video).")
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
 
     print(f"Searching Comb.io for '{args.query}' ({args.media_type}s) and downloading up to {args.limit} items to '{args.output_dir}'...")
-    search_comb_io(args.query, args.limit, args.output_dir, args.media_type)
+    with profiler.stage("search+download"):
+        search_comb_io(args.query, args.limit, args.output_dir, args.media_type)
     print("Comb.io download process complete.")
+    profiler.write_report()
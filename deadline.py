@@ -0,0 +1,59 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Request deadlines.
+# A web search has one overall time budget; every upstream call made on its behalf should
+# get only what is left of it, instead of each one getting the full api_call_timeout.
+# The active deadline is kept per thread (use_deadline()), so the list_* functions and the
+# HTTP helpers they call can clamp their timeouts without a new parameter on every signature.
+
+MIN_REQUEST_TIMEOUT = 0.5  # seconds; below this an upstream call is not worth starting
+
+
+class Deadline:
+    """A point in time by which some work must be finished."""
+
+    def __init__(self, seconds):
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() < MIN_REQUEST_TIMEOUT
+
+    def clamp(self, timeout):
+        """The smaller of `timeout` and the time left (None means no timeout of our own)."""
+        remaining = self.remaining()
+        return remaining if timeout is None else min(timeout, remaining)
+
+
+_local = threading.local()
+
+
+def current_deadline():
+    """The deadline active in this thread, or None."""
+    return getattr(_local, "deadline", None)
+
+
+@contextmanager
+def use_deadline(deadline):
+    """Makes `deadline` (may be None) the active deadline of this thread for the duration of the block."""
+    previous = current_deadline()
+    _local.deadline = deadline
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+def clamp_timeout(timeout):
+    """Clamps a request timeout to the active deadline, if there is one."""
+    deadline = current_deadline()
+    return timeout if deadline is None else deadline.clamp(timeout)
+
+
+def deadline_expired():
+    deadline = current_deadline()
+    return deadline is not None and deadline.expired()
@@ -0,0 +1,132 @@
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Ordering and packing of a batch run's downloads.
+# Without it a run downloads in listing order, so one 300 MB Wikimedia video can hold up dozens
+# of small Giphy or Morbotron images. The listers already report size_bytes for most items;
+# the planner uses it to:
+#   - order the work: "listing" (as listed), "shortest" (smallest first, which completes the
+#     most items in a given time), or "fair" (queries take turns, each smallest first, so one
+#     query's large files don't starve the others),
+#   - defer items over a size cap before anything starts,
+#   - with a deadline (deadline.Deadline), start an item only if its estimated transfer time
+#     still fits in what is left; the rest are deferred rather than started and cut off.
+# Transfer times are estimated from the throughput of the downloads finished so far in this
+# run (a moving average per download), starting from an assumed rate.
+# Items without a size are assumed to be as large as the median of the sized ones.
+
+POLICIES = ("listing", "shortest", "fair")
+DEFAULT_POLICY = "listing"
+DEFAULT_ASSUMED_BYTES_PER_SEC = 1024 * 1024  # Until a download in this run has been measured
+DEFAULT_UNKNOWN_SIZE = 2 * 1024 * 1024  # When no item in the run has a size either
+PER_ITEM_OVERHEAD_SECONDS = 0.5  # Connection setup, redirects, the first byte
+THROUGHPUT_SMOOTHING = 0.3  # Weight of the newest measurement in the moving average
+
+
+def make_job(item, query, output_dir):
+    """One planned download: the listed item, the query it was found for, and where it goes."""
+    return {"item": item, "query": query, "output_dir": output_dir, "size": item.get("size_bytes")}
+
+
+def assumed_unknown_size(jobs):
+    sizes = [job["size"] for job in jobs if job["size"]]
+    return int(statistics.median(sizes)) if sizes else DEFAULT_UNKNOWN_SIZE
+
+
+def order_jobs(jobs, policy=DEFAULT_POLICY):
+    """The jobs in the order the policy downloads them (stable: equal sizes keep listing order)."""
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown scheduling policy '{policy}' (expected one of {', '.join(POLICIES)})")
+    if policy == "listing":
+        return list(jobs)
+    unknown_size = assumed_unknown_size(jobs)
+    by_size = sorted(jobs, key=lambda job: job["size"] or unknown_size)
+    if policy == "shortest":
+        return by_size
+    per_query = {}
+    for job in by_size:
+        per_query.setdefault(job["query"], deque()).append(job)
+    ordered = []
+    while per_query:
+        for query in list(per_query):
+            ordered.append(per_query[query].popleft())
+            if not per_query[query]:
+                del per_query[query]
+    return ordered
+
+
+class ThroughputEstimator:
+    """Moving average of per-download throughput; turns sizes into estimated transfer times."""
+
+    def __init__(self, assumed_bytes_per_sec=DEFAULT_ASSUMED_BYTES_PER_SEC, unknown_size=DEFAULT_UNKNOWN_SIZE):
+        self.bytes_per_sec = float(assumed_bytes_per_sec)
+        self.unknown_size = unknown_size
+        self.samples = 0
+        self._lock = threading.Lock()
+
+    def record(self, size_bytes, seconds):
+        if not size_bytes or seconds <= 0:
+            return
+        rate = size_bytes / max(seconds - PER_ITEM_OVERHEAD_SECONDS, seconds / 2)
+        with self._lock:
+            weight = 1.0 if self.samples == 0 else THROUGHPUT_SMOOTHING  # The first measurement replaces the assumption
+            self.bytes_per_sec += weight * (rate - self.bytes_per_sec)
+            self.samples += 1
+
+    def estimate_seconds(self, size_bytes):
+        return PER_ITEM_OVERHEAD_SECONDS + (size_bytes or self.unknown_size) / self.bytes_per_sec
+
+
+def run_plan(jobs, download, policy=DEFAULT_POLICY, workers=1, deadline=None, max_item_bytes=None,
+             assumed_bytes_per_sec=DEFAULT_ASSUMED_BYTES_PER_SEC, measure=None):
+    """
+    Downloads the jobs with `workers` threads in the policy's order. download(job) returns a path
+    or None; measure(path) returns the bytes transferred (for the throughput estimate).
+    Returns {"completed": [(job, path)], "failed": [job], "deferred": [(job, reason)],
+    "bytes_per_sec": final estimate}; reason is "oversized" or "deadline".
+    """
+    results = {"completed": [], "failed": [], "deferred": []}
+    pending = deque()
+    for job in order_jobs(jobs, policy):
+        if max_item_bytes and job["size"] and job["size"] > max_item_bytes:
+            results["deferred"].append((job, "oversized"))
+        else:
+            pending.append(job)
+    estimator = ThroughputEstimator(assumed_bytes_per_sec, assumed_unknown_size(jobs))
+    lock = threading.Lock()
+
+    def next_job():
+        with lock:
+            while pending:
+                job = pending.popleft()
+                # The time left only shrinks, so a job that doesn't fit now won't fit later either
+                if deadline is not None and estimator.estimate_seconds(job["size"]) > deadline.remaining():
+                    results["deferred"].append((job, "deadline"))
+                    continue
+                return job
+            return None
+
+    def worker():
+        while True:
+            job = next_job()
+            if job is None:
+                return
+            started = time.monotonic()
+            path = download(job)
+            elapsed = time.monotonic() - started
+            with lock:
+                if path:
+                    results["completed"].append((job, path))
+                else:
+                    results["failed"].append(job)
+            if path:
+                estimator.record(measure(path) if measure else job["size"], elapsed)
+
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="planned-download") as pool:
+        list(pool.map(lambda _: worker(), range(workers)))  # Re-raises a worker's exception
+    results["bytes_per_sec"] = estimator.bytes_per_sec
+    return results
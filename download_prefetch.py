@@ -0,0 +1,205 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import singleflight
+from output_layout import locate
+from transfer_scheduler import BACKGROUND, INTERACTIVE, get_transfer_scheduler, use_transfer_priority
+
+# Speculative downloads of the results people are likely to click.
+# Most "Download" clicks on the results page are for the first few items of a platform, and
+# each one then waits for the whole upstream transfer. After /search renders, the Prefetcher
+# queues the top_k displayed items of each platform for download into the download cache, so
+# the click finds the file already there.
+#
+# Limits:
+#   - disk: prefetched files that nobody has asked for yet may take at most budget_bytes, and
+#     a prefetch never pushes the cache over its quota (it would evict files people did ask for),
+#   - size: items over max_item_bytes, and items without a size unless they are images, are skipped,
+#   - bandwidth: prefetches run at BACKGROUND priority (they yield to interactive and batch
+#     transfers, and share the scheduler's background cap), at most `workers` at a time.
+# Prefetched files are recorded as speculative in the StorageManager, which evicts them first
+# unless they get claimed. claim() is called by /download: if the item is still being
+# prefetched, its transfer is promoted to INTERACTIVE priority, since someone now waits for it.
+# The click usually lands in another gunicorn worker, so claims also go through marker files
+# in claims_dir: a queued prefetch has a <hash>.pending file, claim() touches <hash>.claim
+# next to it, and the prefetch's transfer polls for that file and promotes itself.
+
+DEFAULT_TOP_K = 2
+DEFAULT_MAX_ITEM_BYTES = 20 * 1024 * 1024
+DEFAULT_BUDGET_BYTES = 200 * 1024 * 1024
+DEFAULT_WORKERS = 2
+UNSIZED_TYPES = ("image", "gif", "sticker")  # Types small enough to prefetch without a listed size
+UNSIZED_ESTIMATE_BYTES = 1024 * 1024  # What an unsized image counts against the budget
+MAX_QUEUED_PER_WORKER = 8  # Beyond this the queue is stale before it drains; new searches are skipped
+PENDING_MAX_AGE = 15 * 60  # An older pending marker was left behind by a process that died
+DEFAULT_CLAIMS_DIR = os.path.join(singleflight.LOCK_DIR, "prefetch_claims")  # Shared by all processes on the host
+
+
+class Prefetcher:
+    """Background downloads of likely clicks into a StorageManager-managed download folder."""
+
+    def __init__(self, storage, download_dir, download, top_k=DEFAULT_TOP_K, max_item_bytes=DEFAULT_MAX_ITEM_BYTES,
+                 budget_bytes=DEFAULT_BUDGET_BYTES, workers=DEFAULT_WORKERS, claims_dir=DEFAULT_CLAIMS_DIR):
+        """download(item, download_dir, query) downloads an item into download_dir/<platform>/ and returns the path or None."""
+        self.storage = storage
+        self.download_dir = download_dir
+        self.download = download
+        self.top_k = top_k
+        self.max_item_bytes = max_item_bytes
+        self.budget_bytes = budget_bytes
+        self.workers = max(1, workers)
+        self.claims_dir = claims_dir
+        self._queued = {}  # target path -> bytes reserved against the budget
+        self._running = {}  # target path -> id of the thread downloading it
+        self._claimed = set()  # target paths someone asked for while they were queued or running
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self.stats = {"queued": 0, "downloaded": 0, "failed": 0, "skipped_budget": 0, "claimed": 0}
+
+    @property
+    def enabled(self):
+        return self.top_k > 0 and self.budget_bytes > 0
+
+    def _target_path(self, item):
+        return os.path.join(self.download_dir, item["platform"], item["filename"])
+
+    def _marker(self, target, kind):
+        """Path of a target's cross-process marker: kind is "pending" or "claim"."""
+        digest = hashlib.sha1(os.path.abspath(target).encode("utf-8")).hexdigest()
+        return os.path.join(self.claims_dir, f"{digest}.{kind}")
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "a"):
+                os.utime(path, None)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _claimed_elsewhere(self, target, since):
+        """True if a claim marker for target was touched after `since` (time.time()), by any process."""
+        try:
+            return os.path.getmtime(self._marker(target, "claim")) >= since
+        except OSError:
+            return False
+
+    def _estimate(self, item):
+        """Bytes the item counts against the budget, or None if it shouldn't be prefetched."""
+        size = item.get("size_bytes")
+        if size:
+            return size if size <= self.max_item_bytes else None
+        return UNSIZED_ESTIMATE_BYTES if item.get("type") in UNSIZED_TYPES else None
+
+    def _submit(self, job):
+        if self._executor is None or self._executor_pid != os.getpid():  # Threads don't survive a fork
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch")
+            self._executor_pid = os.getpid()
+        self._executor.submit(job)
+
+    def prefetch_results(self, blocks, query=None):
+        """
+        Queues the first top_k items of each platform block (results.html's {"items": [...]}) that
+        aren't cached yet and fit the limits. Returns the number queued.
+        """
+        if not self.enabled:
+            return 0
+        queued = 0
+        for block in blocks:
+            for item in block.get("items", [])[:self.top_k]:
+                if item.get("local_path") or not item.get("url") or not item.get("filename") or not item.get("platform"):
+                    continue  # Already in the library, or not downloadable
+                if os.path.basename(item["filename"]) != item["filename"]:
+                    continue
+                if self._queue(item, query):
+                    queued += 1
+        return queued
+
+    def _queue(self, item, query):
+        estimate = self._estimate(item)
+        if estimate is None:
+            return False
+        target = self._target_path(item)
+        with self._lock:
+            if target in self._queued or locate(os.path.dirname(target), item["filename"]):
+                return False
+            if len(self._queued) >= self.workers * MAX_QUEUED_PER_WORKER:
+                self.stats["skipped_budget"] += 1
+                return False
+            reserved = sum(self._queued.values())
+            if (self.storage.speculative_bytes + reserved + estimate > self.budget_bytes
+                    or self.storage.total_bytes + reserved + estimate > self.storage.quota_bytes):
+                self.stats["skipped_budget"] += 1
+                return False
+            self._queued[target] = estimate
+            self.stats["queued"] += 1
+        queued_at = time.time()
+        self._touch(self._marker(target, "pending"))
+        self._submit(lambda: self._prefetch(item, query, target, queued_at))
+        return True
+
+    def _prefetch(self, item, query, target, queued_at):
+        claimed_elsewhere = lambda: self._claimed_elsewhere(target, queued_at)
+        with self._lock:
+            self._running[target] = threading.get_ident()
+            priority = INTERACTIVE if target in self._claimed or claimed_elsewhere() else BACKGROUND
+        path = None
+        attempted = not locate(os.path.dirname(target), item["filename"])  # A click may have fetched it while this was queued
+        try:
+            if attempted:
+                with use_transfer_priority(priority, promote_check=claimed_elsewhere):
+                    path = self.download(item, self.download_dir, query)
+        except Exception as e:  # A failed guess must never surface anywhere
+            print(f"Prefetch: {item.get('url')} failed: {e}")
+        finally:
+            claimed_by_marker = claimed_elsewhere()
+            self._remove(self._marker(target, "pending"))
+            self._remove(self._marker(target, "claim"))
+            with self._lock:
+                self._queued.pop(target, None)
+                self._running.pop(target, None)
+                claimed = target in self._claimed or claimed_by_marker
+                self._claimed.discard(target)
+                if attempted:
+                    self.stats["downloaded" if path else "failed"] += 1
+        if path:
+            self.storage.record(path, speculative=not claimed)
+
+    def claim(self, item):
+        """
+        Called when someone asks for an item: if it is being prefetched right now, in this process
+        or another one, its transfer continues at INTERACTIVE priority. Returns True if a prefetch
+        was queued or running.
+        """
+        target = self._target_path(item)
+        with self._lock:
+            local = target in self._queued
+            if local:
+                self.stats["claimed"] += 1
+                self._claimed.add(target)
+            thread_id = self._running.get(target)
+        if thread_id is not None:
+            get_transfer_scheduler().promote(thread_id, INTERACTIVE)
+        if local:
+            return True
+        try:
+            pending = time.time() - os.path.getmtime(self._marker(target, "pending")) < PENDING_MAX_AGE
+        except OSError:
+            pending = False
+        if not pending:
+            return False
+        self._touch(self._marker(target, "claim"))  # Picked up by the other process's transfer
+        with self._lock:
+            self.stats["claimed"] += 1
+        return True
@@ -0,0 +1,46 @@
+import os
+import threading
+
+from integrity import IncompleteDownloadError, expected_length, new_hasher, record_download
+from output_layout import index_file
+from transfer_scheduler import get_transfer_scheduler
+
+# The write loop shared by every platform's download_file(): streams a requests response to
+# disk in chunks, each one going through the transfer scheduler (bandwidth caps, priorities)
+# and the integrity hash. The body goes to a .part file that only replaces file_path once the
+# byte count matches the announced Content-Length, so a cut-off transfer never leaves a
+# truncated file under the real name. Complete files are added to the output layout's index
+# (a no-op for flat directories).
+
+DOWNLOAD_CHUNK_SIZE = 8192
+
+
+def save_response(response, file_path, platform, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    Writes a streaming response to file_path, throttled per the transfer scheduler, and records
+    its size and hash in the directory's manifest. Returns the bytes written.
+    Raises IncompleteDownloadError (a requests RequestException) on a length mismatch.
+    """
+    hasher = new_hasher()
+    expected = expected_length(response)
+    tmp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.part"
+    written = 0
+    try:
+        with get_transfer_scheduler().transfer(platform) as transfer, open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                transfer.throttle(len(chunk))
+                f.write(chunk)
+                hasher.update(chunk)
+                written += len(chunk)
+        if expected is not None and written != expected:
+            raise IncompleteDownloadError(f"received {written} of {expected} bytes")
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    record_download(file_path, written, hasher.name, hasher.hexdigest(), getattr(response, "url", None), platform)
+    index_file(file_path, written)
+    return written
@@ -4,21 +4,12 @@ import os
 import argparse
 import json # Still useful for structured data, though not for API responses
 import re
-
-# Attempt to import the helper function. If this script is run standalone, this might fail.
-try:
-    from media_downloader_tool import get_remote_file_size
-except ImportError:
-    # Fallback for standalone execution or if media_downloader_tool is not in PYTHONPATH
-    def get_remote_file_size(url, timeout=5):
-        # print(f"Warning: Using fallback get_remote_file_size for {url}")
-        try:
-            response = requests.head(url, timeout=timeout, allow_redirects=True)
-            response.raise_for_status()
-            content_length = response.headers.get('Content-Length')
-            return int(content_length) if content_length else None
-        except Exception: # Broad exception for fallback
-            return None
+from media_item import MediaItem
+from profiling import add_profile_arguments, profiler_from_args
+from download_utils import save_response
+from output_layout import output_path
+from media_library import record_item as record_library_item
+from media_probe import probe_media, probe_metadata
 
 # Frinkiac base URL.
 FRINKIAC_BASE_URL = "https://frinkiac.com"
@@ -26,18 +17,17 @@ FRINKIAC_BASE_URL = "https://frinkiac.com"
 DEFAULT_DOWNLOAD_TIMEOUT = 10  # seconds
 DEFAULT_REQUEST_TIMEOUT = 10 # seconds for fetching HTML
 
+DOWNLOAD_HEADERS = {'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z'}
+
 def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT):
     """Downloads a file from a URL into a specified folder with a timeout."""
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
-    headers = {'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z'}
     try:
-        response = requests.get(url, stream=True, headers=headers, timeout=timeout)
+        response = requests.get(url, stream=True, headers=DOWNLOAD_HEADERS, timeout=timeout)
         response.raise_for_status()
-        file_path = os.path.join(folder_name, file_name)
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        file_path = output_path(folder_name, file_name)
+        save_response(response, file_path, "frinkiac")
         print(f"Downloaded {file_name} to {folder_name}")
         return file_path
     except requests.exceptions.Timeout:
@@ -95,7 +85,9 @@ def list_frinkiac_media(query_quote, list_limit=25, request_timeout=DEFAULT_REQU
 
     if not frame_panels:
         # print(f"No frame panels found for '{query_quote}' on Frinkiac.")
-        return {"items": [], "error": None, "status_message": f"Frinkiac: No matching frames found for '{query_quote[:50]}'"}
+        # Frinkiac's search is fuzzy and returns frames for almost any text, so a page without
+        # any frame panels most likely means the markup changed (counted by the circuit breaker).
+        return {"items": [], "error": None, "status_message": f"Frinkiac: No matching frames found for '{query_quote[:50]}'", "structure_changed": True}
 
     for panel in frame_panels:
         if len(found_items) >= list_limit:
@@ -132,30 +124,33 @@ def list_frinkiac_media(query_quote, list_limit=25, request_timeout=DEFAULT_REQU
         final_filename = f"frinkiac_{smart_query_name_base}_{item_id}{file_extension}"
         final_filename = "_".join(filter(None, final_filename.split('_')))
 
-        size_bytes = get_remote_file_size(image_url, timeout=request_timeout) # Use request_timeout for HEAD
-
-        found_items.append({
-            "id": item_id,
-            "title": title,
-            "url": image_url,
-            "type": "image",
-            "filename": final_filename,
-            "platform": "frinkiac",
-            "episode": episode,
-            "timestamp": timestamp,
-            "subtitle": full_subtitle,
-            "preview_image_url": image_url, # For image, preview is the image itself
-            "size_bytes": size_bytes
-        })
+        probe = probe_media(image_url, timeout=request_timeout, headers=DOWNLOAD_HEADERS) # Size and dimensions from the first bytes
+
+        found_items.append(MediaItem(
+            id=item_id,
+            title=title,
+            url=image_url,
+            type="image",
+            filename=final_filename,
+            platform="frinkiac",
+            episode=episode,
+            timestamp=timestamp,
+            subtitle=full_subtitle,
+            preview_image_url=image_url, # For image, preview is the image itself
+            size_bytes=probe["size_bytes"] if probe else None,
+            **probe_metadata(probe)
+        ))
 
     status_msg = None
+    structure_changed = False
     if not found_items and not soup.find_all('div', class_='frame-panel'): # Check if frame_panels was empty initially
         # This case is now handled by the earlier check on frame_panels, but as a safeguard:
         status_msg = f"Frinkiac: No frame panels found at all for '{query_quote[:50]}'."
     elif not found_items: # Found panels but couldn't extract items
         status_msg = f"Frinkiac: Found frame panels but could not extract valid items for '{query_quote[:50]}'."
+        structure_changed = True
 
-    return {"items": found_items[:list_limit], "error": None, "status_message": status_msg}
+    return {"items": found_items[:list_limit], "error": None, "status_message": status_msg, "structure_changed": structure_changed}
 
 
 def search_frinkiac_media(query_quote, limit=5, output_dir="frinkiac_media", request_timeout=DEFAULT_REQUEST_TIMEOUT, download_timeout=DEFAULT_DOWNLOAD_TIMEOUT, **kwargs):
@@ -186,6 +181,7 @@ def search_frinkiac_media(query_quote, limit=5, output_dir="frinkiac_media", req
         download_path = download_file(item['url'], output_dir, item['filename'], timeout=download_timeout)
         if download_path:
             downloaded_files.append(download_path)
+            record_library_item(item, download_path, query_quote)
 
     return downloaded_files
 
@@ -197,18 +193,22 @@ if __name__ == "__main__":
     parser.add_argument("--request_timeout", type=int, default=DEFAULT_REQUEST_TIMEOUT, help="Timeout for fetching HTML page in seconds.")
     parser.add_argument("--download_timeout", type=int, default=DEFAULT_DOWNLOAD_TIMEOUT, help="Timeout for file downloads in seconds.")
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
 
     print(f"Searching Frinkiac (scraping) for quote '{args.quote}' and downloading up to {args.limit} images to '{args.output_dir}'...")
-    downloaded = search_frinkiac_media(
-        args.quote,
-        args.limit,
-        args.output_dir,
-        request_timeout=args.request_timeout,
-        download_timeout=args.download_timeout
-    )
+    with profiler.stage("search+download"):
+        downloaded = search_frinkiac_media(
+            args.quote,
+            args.limit,
+            args.output_dir,
+            request_timeout=args.request_timeout,
+            download_timeout=args.download_timeout
+        )
     if downloaded:
         print(f"Frinkiac: Successfully downloaded {len(downloaded)} images via scraping.")
     else:
         print("Frinkiac: No images downloaded via scraping.")
     print("Frinkiac image download process complete.")
+    profiler.write_report()
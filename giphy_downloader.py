@@ -1,11 +1,43 @@
 import requests
 import os
 import argparse
+from hedging import hedged_get
+from media_item import MediaItem
+from profiling import add_profile_arguments, profiler_from_args
+from json_backend import JSONDecodeError, response_json
+from renditions import add_size_limit_arguments, rendition, rendition_suffix, select_rendition, size_limits_from_args
+from download_utils import save_response
+from output_layout import output_path
+from media_library import record_item as record_library_item
 
 # Attempt to get API key from environment variable, otherwise use placeholder
 GIPHY_API_KEY = os.environ.get("GIPHY_API_KEY", "YOUR_GIPHY_API_KEY_HERE")
 GIPHY_SEARCH_URL = "https://api.giphy.com/v1/gifs/search"
+GIPHY_GIFS_URL = "https://api.giphy.com/v1/gifs"  # Lookup by id: ?ids=a,b,c
+GIPHY_IDS_PER_REQUEST = 100  # Most ids the lookup endpoint takes per call
+# Small animated rendition used for the web results page instead of the full original
+GIPHY_PREVIEW_RENDITION = "fixed_height_small"
 DEFAULT_DOWNLOAD_TIMEOUT = 10 # seconds
+# Renditions to choose from, in order of preference when no size limits are given
+GIPHY_VIDEO_RENDITIONS = ("original_mp4", "hd", "fixed_height", "fixed_width", "fixed_height_small", "preview")
+GIPHY_GIF_RENDITIONS = ("original", "downsized_large", "downsized_medium", "downsized", "fixed_height", "fixed_width",
+                        "fixed_height_small", "preview_gif")
+
+DOWNLOAD_HEADERS = {} # Giphy's media CDN needs no special headers
+
+# Response slimming. By default each item in a search response carries every rendition Giphy has,
+# the uploader's user object and analytics URLs, while this module reads only id, title, type and
+# a few `images` entries. In "slim" mode the search asks for just those (the API's `fields`
+# parameter), plus an optional `bundle` (GIPHY_BUNDLE, e.g. "low_bandwidth", which also limits the
+# renditions offered). "full" asks for the default payload. If a slim response ever comes back
+# without renditions, the search is repeated in full mode.
+# benchmarks/bench_giphy_payload.py measures the difference.
+GIPHY_RESPONSE_MODES = ("slim", "full")
+GIPHY_RESPONSE_MODE = os.environ.get("GIPHY_RESPONSE_MODE", "slim")
+GIPHY_BUNDLE = os.environ.get("GIPHY_BUNDLE") or None
+GIPHY_SLIM_FIELDS = ",".join(["id", "title", "type"] + [
+    f"images.{name}" for name in dict.fromkeys(GIPHY_VIDEO_RENDITIONS + GIPHY_GIF_RENDITIONS + (GIPHY_PREVIEW_RENDITION,))
+])
 
 def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT):
     """Downloads a file from a URL into a specified folder with a timeout."""
@@ -13,14 +45,12 @@ def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT)
         os.makedirs(folder_name)
 
     try:
-        response = requests.get(url, stream=True, timeout=timeout)
+        response = requests.get(url, stream=True, headers=DOWNLOAD_HEADERS, timeout=timeout)
         response.raise_for_status()  # Ensure we notice bad responses
 
-        file_path = os.path.join(folder_name, file_name)
+        file_path = output_path(folder_name, file_name)
 
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        save_response(response, file_path, "giphy")
         print(f"Downloaded {file_name} to {folder_name}")
         return file_path
     except requests.exceptions.Timeout:
@@ -30,10 +60,100 @@ def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT)
         print(f"Error downloading {url} to {file_name}: {e}")
         return None
 
-def search_giphy(query, limit=5, output_dir="giphy_media", media_type="gif", timeout=DEFAULT_DOWNLOAD_TIMEOUT):
+def choose_giphy_rendition(item, media_type, size_limits=None):
+    """
+    Picks the rendition of a Giphy result to download (see renditions.py).
+    Returns (rendition dict or None, file extension, media type of the item).
+    """
+    images_data = item.get("images", {})
+    size_limits = size_limits or {}
+    is_sticker = item.get("type") == "sticker"
+
+    def gif_rendition():
+        candidates = [rendition(name, info.get("url"), info.get("width"), info.get("height"), info.get("size"))
+                      for name in GIPHY_GIF_RENDITIONS for info in [images_data.get(name) or {}]]
+        return select_rendition(candidates, **size_limits)
+
+    if is_sticker and media_type in ("sticker", "all"):
+        chosen = gif_rendition()
+        if chosen:
+            return chosen, ".gif", "sticker" # Stickers are GIFs with transparency
+
+    elif media_type in ("video", "all"):
+        candidates = [rendition(name, info.get("mp4"), info.get("width"), info.get("height"), info.get("mp4_size"))
+                      for name in GIPHY_VIDEO_RENDITIONS for info in [images_data.get(name) or {}]]
+        chosen = select_rendition(candidates, **size_limits)
+        if chosen:
+            return chosen, ".mp4", "video"
+
+    if media_type in ("gif", "all", "image"):
+        # Fallback to GIF if video not found/requested or sticker not primary
+        chosen = gif_rendition()
+        if chosen:
+            return chosen, ".gif", "sticker" if is_sticker else "gif" # A sticker keeps its type when GIF was requested
+    return None, ".gif", "gif"
+
+
+def giphy_response_params(response_mode=None):
+    """The `fields`/`bundle` parameters of a response mode ({} for "full")."""
+    params = {}
+    if (response_mode or GIPHY_RESPONSE_MODE) == "slim":
+        params["fields"] = GIPHY_SLIM_FIELDS
+        if GIPHY_BUNDLE:
+            params["bundle"] = GIPHY_BUNDLE
+    return params
+
+
+def giphy_search_params(query, limit, response_mode=None):
+    """Query parameters of a search call; response_mode is "slim" or "full" (default: GIPHY_RESPONSE_MODE)."""
+    return {
+        "api_key": GIPHY_API_KEY,
+        "q": query,
+        "limit": limit,
+        "offset": 0,
+        "rating": "g",
+        "lang": "en",
+        # "type": search_type # This param is for search type (gifs, stickers, text) not file format
+        **giphy_response_params(response_mode),
+    }
+
+
+def fetch_giphy(url, params, timeout, response_mode=None, hedge=False):
+    """
+    GETs a Giphy endpoint with params plus the response mode's fields and returns the decoded
+    payload. hedge: go through hedging.hedged_get (listing calls) instead of a plain requests.get.
+    Raises requests exceptions and JSONDecodeError.
+    """
+    def get(mode):
+        request_params = {**params, **giphy_response_params(mode)}
+        if hedge:
+            response = hedged_get("giphy", url, params=request_params, timeout=timeout)
+        else:
+            response = requests.get(url, params=request_params, timeout=timeout)
+        response.raise_for_status()
+        return response_json(response)
+
+    mode = response_mode or GIPHY_RESPONSE_MODE
+    data = get(mode)
+    items = data.get("data") or []
+    if mode == "slim" and items and not any(item.get("images") for item in items):
+        print("Giphy: the slim response had no renditions; repeating the request in full mode")
+        data = get("full")
+    return data
+
+
+def fetch_giphy_search(query, limit, timeout, response_mode=None, hedge=False):
+    """Runs a search call and returns the decoded payload (see fetch_giphy)."""
+    return fetch_giphy(GIPHY_SEARCH_URL, giphy_search_params(query, limit, "full"), timeout, response_mode, hedge)
+
+
+def search_giphy(query, limit=5, output_dir="giphy_media", media_type="gif", timeout=DEFAULT_DOWNLOAD_TIMEOUT, size_limits=None,
+                 response_mode=None):
     """
     Searches Giphy for media based on a query and downloads them.
     Currently, Giphy API primarily returns GIFs.
+    size_limits (renditions.make_size_limits) picks smaller renditions than the originals.
+    response_mode: "slim" or "full" payloads (default: GIPHY_RESPONSE_MODE).
     """
     if GIPHY_API_KEY == "YOUR_GIPHY_API_KEY_HERE":
         print("Giphy API key is not set. Please set it in giphy_downloader.py.")
@@ -48,19 +168,7 @@ def search_giphy(query, limit=5, output_dir="giphy_media", media_type="gif", tim
     # Note: Giphy API also has a video API, but it's different from the GIF search.
     # This function will focus on GIF-like media from the standard search endpoint.
 
-    params = {
-        "api_key": GIPHY_API_KEY,
-        "q": query,
-        "limit": limit,
-        "offset": 0,
-        "rating": "g",
-        "lang": "en",
-        # "type": search_type # This param is for search type (gifs, stickers, text) not file format
-    }
-
-    response = requests.get(GIPHY_SEARCH_URL, params=params, timeout=timeout)
-    response.raise_for_status()
-    data = response.json()
+    data = fetch_giphy_search(query, limit, timeout, response_mode)
 
     if not data.get("data"):
         print(f"No results found for '{query}' on Giphy.")
@@ -75,40 +183,16 @@ def search_giphy(query, limit=5, output_dir="giphy_media", media_type="gif", tim
 
     for item in data["data"]:
         try:
-            item_id = item.get("id")
-            # Giphy's 'images' object has various formats.
-            # 'original' is usually a large GIF.
-            # 'original_mp4' is often available and smaller for animated content.
-            # 'fixed_height_small' or 'preview_gif' for smaller previews.
-
-            media_item_url = None
-            file_extension = ".gif" # Default to .gif
-
-            if media_type == "video" or media_type == "all": # Prioritize video if requested
-                if item.get("images", {}).get("original_mp4", {}).get("mp4"):
-                    media_item_url = item.get("images").get("original_mp4").get("mp4")
-                    file_extension = ".mp4"
-                elif item.get("images", {}).get("hd", {}).get("mp4"): # Some older items might have this
-                     media_item_url = item.get("images").get("hd").get("mp4")
-                     file_extension = ".mp4"
-
-            if not media_item_url and (media_type == "gif" or media_type == "all" or media_type == "image"):
-                # Fallback to gif if video not found or gif specifically requested
-                media_item_url = item.get("images", {}).get("original", {}).get("url")
-                file_extension = ".gif" # Ensure it's .gif
-                # Giphy API also returns 'type' which can be 'gif', 'sticker', etc.
-                # We could use item.get('type') to refine extension if needed, but URL often has it.
-
-            if not media_item_url:
-                print(f"Could not find suitable media URL for item ID {item_id} (type: {media_type})")
+            # Same item (rendition, filename with its rendition suffix) as list_giphy_media() builds
+            media_item = giphy_media_item(item, media_type, size_limits, smart_query_name)
+            if media_item is None:
+                print(f"Could not find suitable media URL for item ID {item.get('id')} (type: {media_type})")
                 continue
 
-            # Smart Filename
-            file_name = f"giphy_{smart_query_name}_{item_id}{file_extension}"
-
-            download_path = download_file(media_item_url, output_dir, file_name, timeout=timeout)
+            download_path = download_file(media_item.url, output_dir, media_item.filename, timeout=timeout)
             if download_path:
                 downloaded_files.append(download_path)
+                record_library_item(media_item, download_path, query)
 
         except Exception as e:
             print(f"Error processing Giphy item {item.get('id')}: {e}")
@@ -116,9 +200,52 @@ def search_giphy(query, limit=5, output_dir="giphy_media", media_type="gif", tim
     return downloaded_files
 
 
-def list_giphy_media(query, limit=25, media_type="gif", timeout=DEFAULT_DOWNLOAD_TIMEOUT):
+def giphy_media_item(item, media_type="all", size_limits=None, name_base=""):
+    """
+    The MediaItem for one Giphy result (search or id lookup), or None if it has no rendition of
+    the requested media_type. name_base goes into the filename (giphy_<name_base>_<id>.<ext>), and
+    the rendition's name too when the size limits picked another one than the default.
+    """
+    item_id = item.get("id")
+    title = item.get("title") or f"Giphy {item_id}"
+    images_data = item.get("images", {})
+
+    chosen, file_extension, item_actual_media_type = choose_giphy_rendition(item, media_type, size_limits)
+    if not chosen or not chosen["url"]:
+        return None
+    # Filter based on requested media_type vs what we found
+    if media_type != "all":
+        if media_type == "gif" and item_actual_media_type not in ["gif", "sticker"]:
+            return None
+        if media_type == "sticker" and item_actual_media_type != "sticker":
+            return None
+        if media_type == "video" and item_actual_media_type != "video":
+            return None
+
+    preview_info = images_data.get(GIPHY_PREVIEW_RENDITION, {})
+    preview_image_url = preview_info.get("webp") or preview_info.get("url")
+
+    default, _, _ = choose_giphy_rendition(item, media_type) if size_limits else (chosen, None, None)
+    suffix = rendition_suffix(chosen, default)
+    file_name = f"giphy_{name_base}_{item_id}{suffix}{file_extension}" if name_base else f"giphy_{item_id}{suffix}{file_extension}"
+    return MediaItem(
+        id=item_id,
+        title=title,
+        url=chosen["url"],
+        type=item_actual_media_type,  # gif, video, sticker
+        filename=file_name,
+        platform="giphy",
+        size_bytes=chosen["size_bytes"], # Add the size
+        preview_image_url=preview_image_url,
+        rendition=chosen["name"]
+    )
+
+
+def list_giphy_media(query, limit=25, media_type="gif", timeout=DEFAULT_DOWNLOAD_TIMEOUT, size_limits=None, response_mode=None):
     """
     Searches Giphy for media based on a query and returns a list of media item details.
+    size_limits (renditions.make_size_limits) choose the rendition of each item (see renditions.py);
+    the one used is recorded as the item's 'rendition'. response_mode: "slim" (default) or "full" payloads.
     """
     if GIPHY_API_KEY == "YOUR_GIPHY_API_KEY_HERE":
         print("Giphy API key is not set. Please set it in giphy_downloader.py.")
@@ -128,26 +255,15 @@ def list_giphy_media(query, limit=25, media_type="gif", timeout=DEFAULT_DOWNLOAD
     if media_type == "sticker":
         search_type = "stickers"
 
-    params = {
-        "api_key": GIPHY_API_KEY,
-        "q": query,
-        "limit": limit, # Fetch more for listing, actual download limit applied later
-        "offset": 0,
-        "rating": "g",
-        "lang": "en",
-    }
-
     try:
-        response = requests.get(GIPHY_SEARCH_URL, params=params, timeout=timeout)
-        response.raise_for_status()
-        data = response.json()
+        data = fetch_giphy_search(query, limit, timeout, response_mode, hedge=True)
     except requests.exceptions.Timeout:
-        print(f"Timeout during Giphy API request for query: {query}")
-        return []
+        # print(f"Timeout during Giphy API request for query: {query}")
+        return {"items": [], "error": f"Giphy: API timeout for '{query[:50]}'", "status_message": None}
     except requests.exceptions.RequestException as e:
         # print(f"API request error for Giphy query '{query}': {e}")
         return {"items": [], "error": f"Giphy: API request error for '{query[:50]}': {e}", "status_message": None}
-    except requests.exceptions.JSONDecodeError: # Corrected exception type
+    except JSONDecodeError:
         # print(f"Error decoding JSON from Giphy: {response.text if 'response' in locals() else 'No response text'}")
         return {"items": [], "error": f"Giphy: Error decoding API response for '{query[:50]}'", "status_message": None}
     except Exception as e: # Catch other potential errors
@@ -163,98 +279,47 @@ def list_giphy_media(query, limit=25, media_type="gif", timeout=DEFAULT_DOWNLOAD
     smart_query_name_base = "".join(c if c.isalnum() else "_" for c in smart_query_name_base)
 
     for item in data["data"]:
-        item_id = item.get("id")
-        title = item.get("title") or f"Giphy {item_id}"
-        images_data = item.get("images", {})
-
-        media_item_url = None
-        file_extension = ".gif"  # Default
-        item_actual_media_type = "gif"  # Default
-        size_bytes = None
-        selected_rendition_key = None # To fetch size from the correct rendition
-
-        # Determine media type and URL, prioritize based on request
-        if item.get("type") == "sticker" and (media_type == "sticker" or media_type == "all"):
-            selected_rendition_key = "original"
-            rendition_info = images_data.get(selected_rendition_key, {})
-            media_item_url = rendition_info.get("url")
-            size_bytes = rendition_info.get("size") # Sticker .gif often has 'size'
-            file_extension = ".gif" # Stickers are often GIFs
-            if "webp" in rendition_info and rendition_info.get("webp_size"): # Prefer webp if available and has size
-                # This logic can be expanded if webp is a distinct preferred type
-                pass
-            item_actual_media_type = "sticker"
-
-        elif (media_type == "video" or media_type == "all"):
-            original_mp4_info = images_data.get("original_mp4", {})
-            hd_mp4_info = images_data.get("hd", {})  # Older format
-
-            if original_mp4_info.get("mp4"):
-                selected_rendition_key = "original_mp4"
-                media_item_url = original_mp4_info.get("mp4")
-                size_bytes = original_mp4_info.get("mp4_size")  # Specific key for mp4 size
-                file_extension = ".mp4"
-                item_actual_media_type = "video"
-            elif hd_mp4_info.get("mp4"):  # Fallback to HD if original_mp4 not present
-                selected_rendition_key = "hd"
-                media_item_url = hd_mp4_info.get("mp4")
-                size_bytes = hd_mp4_info.get("size")  # HD might use generic 'size'
-                file_extension = ".mp4"
-                item_actual_media_type = "video"
-
-        if not media_item_url and (media_type == "gif" or media_type == "all" or media_type == "image"):
-            # Fallback to GIF if video not found/requested or sticker not primary
-            original_gif_info = images_data.get("original", {})
-            if original_gif_info.get("url"):
-                selected_rendition_key = "original"
-                media_item_url = original_gif_info.get("url")
-                size_bytes = original_gif_info.get("size")
-                file_extension = ".gif"
-                item_actual_media_type = "gif"
-                if item.get("type") == "sticker": # If it's a sticker but GIF was requested
-                    item_actual_media_type = "sticker" # Keep its original type designation
-
-        # Ensure size_bytes is integer if found as string
-        if size_bytes is not None:
-            try:
-                size_bytes = int(size_bytes)
-            except ValueError:
-                # print(f"Warning: Could not convert size '{size_bytes}' to int for Giphy item {item_id}")
-                size_bytes = None
-
-        # If size_bytes is still None and we have a selected_rendition_key, try 'size' field for that rendition
-        if size_bytes is None and selected_rendition_key:
-            rendition_data = images_data.get(selected_rendition_key, {})
-            if rendition_data.get("size"):
-                try:
-                    size_bytes = int(rendition_data.get("size"))
-                except ValueError:
-                    size_bytes = None
-
-
-        if media_item_url:
-            # Filter based on requested media_type vs what we found
-            if media_type != "all":
-                if media_type == "gif" and item_actual_media_type not in ["gif", "sticker"]:
-                    continue
-                if media_type == "sticker" and item_actual_media_type != "sticker":
-                    continue
-                if media_type == "video" and item_actual_media_type != "video":
-                    continue
-
-            file_name = f"giphy_{smart_query_name_base}_{item_id}{file_extension}"
-            found_items.append({
-                "id": item_id,
-                "title": title,
-                "url": media_item_url,
-                "type": item_actual_media_type,  # gif, video, sticker
-                "filename": file_name,
-                "platform": "giphy",
-                "size_bytes": size_bytes # Add the size
-            })
+        media_item = giphy_media_item(item, media_type, size_limits, smart_query_name_base)
+        if media_item:
+            found_items.append(media_item)
     return {"items": found_items, "error": None, "status_message": None if found_items else f"Giphy: No items matched criteria for '{query[:50]}'"}
 
 
+def resolve_giphy_ids(ids, media_type="all", timeout=DEFAULT_DOWNLOAD_TIMEOUT, size_limits=None, name_base="", response_mode=None):
+    """
+    Looks known Giphy ids up again (e.g. to refresh their URLs or rebuild an archive) with the
+    ids endpoint, GIPHY_IDS_PER_REQUEST per call, instead of searching. Returns the listing dict
+    ('items' in the order of ids, 'error', 'status_message') plus 'missing': the ids Giphy no
+    longer returns (or that have no rendition of media_type). A failed batch sets 'error' and
+    its ids count as missing; the other batches are still resolved.
+    """
+    ids = list(dict.fromkeys(str(item_id) for item_id in ids if item_id))
+    if GIPHY_API_KEY == "YOUR_GIPHY_API_KEY_HERE":
+        return {"items": [], "error": None, "status_message": "Giphy: API key not set, ids not resolved.", "missing": ids}
+
+    resolved, errors = {}, []
+    for start in range(0, len(ids), GIPHY_IDS_PER_REQUEST):
+        batch = ids[start:start + GIPHY_IDS_PER_REQUEST]
+        try:
+            data = fetch_giphy(GIPHY_GIFS_URL, {"api_key": GIPHY_API_KEY, "ids": ",".join(batch)}, timeout, response_mode,
+                               hedge=True)
+        except requests.exceptions.RequestException as e:
+            errors.append(f"Giphy: id lookup failed for {len(batch)} id(s): {e}")
+            continue
+        except JSONDecodeError:
+            errors.append(f"Giphy: Error decoding the id lookup response for {len(batch)} id(s)")
+            continue
+        for item in data.get("data") or []:
+            media_item = giphy_media_item(item, media_type, size_limits, name_base)
+            if media_item:
+                resolved[str(item.get("id"))] = media_item
+
+    items = [resolved[item_id] for item_id in ids if item_id in resolved]
+    missing = [item_id for item_id in ids if item_id not in resolved]
+    return {"items": items, "error": "; ".join(errors) or None,
+            "status_message": f"Giphy: {len(missing)} of {len(ids)} id(s) not found." if missing else None, "missing": missing}
+
+
 if __name__ == "__main__":
     # Updated main for testing the new return type of list_giphy_media
     parser = argparse.ArgumentParser(description="Download media from Giphy.") # Changed "GIFs" to "media"
@@ -263,16 +328,23 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", type=str, default="giphy_media", help="Directory to save downloaded media.")
     parser.add_argument("--media_type", type=str, default="gif", choices=["gif", "video", "sticker", "all"], help="Type of media to prefer.")
     parser.add_argument("--timeout", type=int, default=DEFAULT_DOWNLOAD_TIMEOUT, help="Download timeout in seconds.")
+    parser.add_argument("--response_mode", choices=GIPHY_RESPONSE_MODES, default=GIPHY_RESPONSE_MODE,
+                        help=f"'slim' asks Giphy only for the fields used here, 'full' for the whole payload (default: {GIPHY_RESPONSE_MODE}).")
+    add_size_limit_arguments(parser)
 
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
+    size_limits = size_limits_from_args(args)
 
     if GIPHY_API_KEY == "YOUR_GIPHY_API_KEY_HERE":
         print("Please replace 'YOUR_GIPHY_API_KEY_HERE' with your actual Giphy API key in giphy_downloader.py")
     else:
         # Test listing
         print(f"\n--- Listing Giphy for '{args.query}' (type: {args.media_type}, limit: {args.limit}) ---")
-        list_result = list_giphy_media(args.query, args.limit, args.media_type, args.timeout)
+        with profiler.stage("list"):
+            list_result = list_giphy_media(args.query, args.limit, args.media_type, args.timeout, size_limits, args.response_mode)
         if list_result.get("error"):
             print(f"Error listing: {list_result['error']}")
         elif not list_result.get("items") and list_result.get("status_message"):
@@ -280,13 +352,15 @@ if __name__ == "__main__":
         elif list_result.get("items"):
             print(f"Found {len(list_result['items'])} items for listing:")
             for item in list_result['items']:
-                print(f"  - Title: {item['title']}, Type: {item['type']}, URL: {item['url']}")
+                print(f"  - Title: {item['title']}, Type: {item['type']}, Rendition: {item.get('rendition')}, URL: {item['url']}")
         else:
             print("No items found or an unknown issue occurred during listing.")
 
         # Test downloading using search_giphy
         print(f"\n--- Downloading from Giphy for '{args.query}' (type: {args.media_type}, limit: {args.limit}) ---")
-        downloaded_files = search_giphy(args.query, args.limit, args.output_dir, args.media_type, args.timeout)
+        with profiler.stage("search+download"):
+            downloaded_files = search_giphy(args.query, args.limit, args.output_dir, args.media_type, args.timeout, size_limits,
+                                            args.response_mode)
         if downloaded_files:
             print(f"Giphy: Successfully downloaded {len(downloaded_files)} files to '{args.output_dir}'.")
         else:
@@ -295,3 +369,4 @@ if __name__ == "__main__":
             print(f"Giphy: No files were downloaded for '{args.query}'. Check logs if items were expected.")
 
         print("\nGiphy CLI test process complete.")
+        profiler.write_report()
@@ -0,0 +1,117 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from deadline import MIN_REQUEST_TIMEOUT, clamp_timeout
+
+# Hedged GETs for idempotent listing API calls.
+# Upstream APIs occasionally stall for seconds on a request that normally takes 200 ms.
+# hedged_get() tracks recent latencies per platform; when a request is still running after
+# the platform's observed p95, it sends one identical request and returns whichever answers
+# first. Hedges are capped at MAX_HEDGE_FRACTION of requests so upstream load barely grows.
+# Timeouts are clamped to the active deadline (see deadline.py).
+
+LATENCY_WINDOW = 200  # Most recent successful request latencies kept per platform
+MIN_SAMPLES_FOR_HEDGING = 20  # Don't hedge until the p95 means something
+HEDGE_PERCENTILE = 0.95
+MAX_HEDGE_FRACTION = 0.1  # At most one extra request per ten
+MAX_HEDGE_WORKERS = 16
+
+_executor = ThreadPoolExecutor(max_workers=MAX_HEDGE_WORKERS, thread_name_prefix="hedged-get")
+
+
+class LatencyTracker:
+    """Recent request latencies and hedge budget for one platform."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._requests = 0
+        self._hedges = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self._lock:
+            if len(self._samples) < MIN_SAMPLES_FOR_HEDGING:
+                return None
+            ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def count_request(self):
+        with self._lock:
+            self._requests += 1
+
+    def take_hedge(self):
+        """True (and counts it) if another hedge fits in the budget."""
+        with self._lock:
+            if self._hedges + 1 > MAX_HEDGE_FRACTION * self._requests:
+                return False
+            self._hedges += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {"samples": len(self._samples), "requests": self._requests, "hedges": self._hedges}
+
+
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(platform):
+    with _trackers_lock:
+        tracker = _trackers.get(platform)
+        if tracker is None:
+            tracker = _trackers[platform] = LatencyTracker()
+        return tracker
+
+
+def _timed_get(tracker, url, timeout, kwargs):
+    started = time.monotonic()
+    response = requests.get(url, timeout=timeout, **kwargs)
+    tracker.record(time.monotonic() - started)
+    return response
+
+
+def hedged_get(platform, url, timeout=10, hedge=True, **kwargs):
+    """
+    requests.get() for an idempotent listing call, with the timeout clamped to the active
+    deadline and an optional hedge request once the call is slower than the platform's p95.
+    Raises requests exceptions like requests.get() (Timeout if the deadline is already used up).
+    """
+    timeout = clamp_timeout(timeout)
+    if timeout is not None and timeout < MIN_REQUEST_TIMEOUT:
+        raise requests.exceptions.Timeout(f"No time left in the request deadline for {platform}")
+
+    tracker = get_tracker(platform)
+    tracker.count_request()
+    hedge_after = tracker.percentile(HEDGE_PERCENTILE) if hedge else None
+    if hedge_after is None or (timeout is not None and hedge_after >= timeout):
+        return _timed_get(tracker, url, timeout, kwargs)
+
+    started = time.monotonic()
+    primary = _executor.submit(_timed_get, tracker, url, timeout, kwargs)
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+
+    remaining = None if timeout is None else timeout - (time.monotonic() - started)
+    if (remaining is not None and remaining < MIN_REQUEST_TIMEOUT) or not tracker.take_hedge():
+        return primary.result()
+
+    pending = [primary, _executor.submit(_timed_get, tracker, url, remaining, kwargs)]
+    last_error = None
+    while pending:
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            if future.exception() is None:
+                return future.result()  # The other request finishes in the background
+            last_error = future.exception()
+    raise last_error
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import json_backend
+import singleflight
+
+# Integrity records for downloaded files.
+# download_utils.save_response() hashes each file in the same loop that writes it (no second
+# read), checks the byte count against the response's Content-Length, and appends a line to
+# a manifest in the file's directory:
+#   {"file": "giphy_cats_abc.mp4", "size": 123456, "algorithm": "sha256", "hash": "...",
+#    "url": "...", "platform": "giphy", "downloaded_at": 1700000000.0}
+# The manifest is append-only; the last line for a file wins. A file removed on purpose (e.g.
+# evicted from the web app's download cache) gets a {"file": ..., "deleted": true} line, which
+# drops its record. Once a manifest has doubled in size since it was last checked and is mostly
+# superseded lines, it is rewritten with the live records only (under a cross-process lock that
+# appends take too, so no line is lost). verify_tree() re-hashes a whole output tree in parallel
+# against those records (`media_downloader_tool.py verify <dir>`).
+
+MANIFEST_NAME = ".manifest.jsonl"
+HASH_ALGORITHMS = ("sha256", "blake2b")  # blake2b is usually faster on 64-bit CPUs
+DEFAULT_HASH_ALGORITHM = "sha256"
+VERIFY_CHUNK_SIZE = 1024 * 1024
+MANIFEST_COMPACT_MIN_BYTES = 256 * 1024  # Smaller manifests are never rewritten
+
+_algorithm = DEFAULT_HASH_ALGORITHM
+_manifest_lock = threading.Lock()
+_checked_sizes = {}  # manifest path -> its size after the last compaction check in this process
+
+
+class IncompleteDownloadError(requests.exceptions.RequestException):
+    """The body ended before (or ran past) the length the server announced."""
+
+
+def configure_integrity(algorithm=DEFAULT_HASH_ALGORITHM):
+    """Sets the hash algorithm for downloads from now on."""
+    global _algorithm
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm '{algorithm}' (expected one of {', '.join(HASH_ALGORITHMS)})")
+    _algorithm = algorithm
+
+
+def new_hasher(algorithm=None):
+    return hashlib.new(algorithm or _algorithm)
+
+
+def expected_length(response):
+    """The body length the response announces, or None (no Content-Length, or a compressed transfer)."""
+    content_length = response.headers.get("Content-Length")
+    if not content_length or response.headers.get("Content-Encoding", "identity").lower() not in ("", "identity"):
+        return None
+    try:
+        return int(content_length)
+    except ValueError:
+        return None
+
+
+def record_download(file_path, size, algorithm, digest, url=None, platform=None):
+    """Appends the integrity record of a finished download to its directory's manifest."""
+    directory, name = os.path.split(os.path.abspath(file_path))
+    line = json_backend.dumps({
+        "file": name, "size": size, "algorithm": algorithm, "hash": digest,
+        "url": url, "platform": platform, "downloaded_at": time.time(),
+    }) + "\n"
+    _append(directory, line)
+
+
+def _append(directory, text):
+    try:
+        with _manifest_lock, singleflight.file_lock("manifest:" + directory), \
+                open(os.path.join(directory, MANIFEST_NAME), "a", encoding="utf-8") as f:
+            f.write(text)  # One write per batch; O_APPEND keeps lines from other processes intact
+    except OSError as e:
+        print(f"Integrity: could not update manifest in {directory}: {e}")
+
+
+def record_deletions(file_paths):
+    """Marks files that were removed on purpose (evicted, pruned) as deleted in their manifests, then compacts them if due."""
+    by_directory = {}
+    for file_path in file_paths:
+        directory, name = os.path.split(os.path.abspath(file_path))
+        by_directory.setdefault(directory, []).append(name)
+    now = time.time()
+    for directory, names in by_directory.items():
+        if not os.path.exists(os.path.join(directory, MANIFEST_NAME)):
+            continue  # Never recorded, e.g. downloaded before manifests existed
+        _append(directory, "".join(json_backend.dumps({"file": name, "deleted": True, "deleted_at": now}) + "\n" for name in names))
+        compact_manifest(directory)
+
+
+def compact_manifest(directory, force=False):
+    """
+    Rewrites a directory's manifest with only its live records, if it has at least doubled since the
+    last check and less than half its lines are still live (always with force). Returns True if rewritten.
+    """
+    path = os.path.join(directory, MANIFEST_NAME)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return False
+    if not force and (size < MANIFEST_COMPACT_MIN_BYTES or size < 2 * _checked_sizes.get(path, 0)):
+        return False
+    try:
+        with _manifest_lock, singleflight.file_lock("manifest:" + directory):
+            with open(path, "r", encoding="utf-8") as f:
+                line_count = sum(1 for _ in f)
+            records = read_manifest(directory)
+            if not force and len(records) * 2 >= line_count:
+                _checked_sizes[path] = size
+                return False
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("".join(json_backend.dumps(record) + "\n" for record in records.values()))
+            os.replace(tmp_path, path)
+            _checked_sizes[path] = os.path.getsize(path)
+            return True
+    except OSError as e:
+        print(f"Integrity: could not compact manifest in {directory}: {e}")
+        return False
+
+
+def read_manifest(directory):
+    """{filename: latest record} for one directory ({} if it has no manifest)."""
+    records = {}
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json_backend.loads(line)
+                except ValueError:
+                    continue  # A torn line from an interrupted run
+                if not isinstance(record, dict) or not record.get("file"):
+                    continue
+                if record.get("deleted"):
+                    records.pop(record["file"], None)
+                else:
+                    records[record["file"]] = record
+    except OSError:
+        pass
+    return records
+
+
+def hash_file(path, algorithm=None):
+    """(size, hex digest) of a file on disk."""
+    hasher = new_hasher(algorithm)
+    size = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(VERIFY_CHUNK_SIZE), b""):
+            hasher.update(block)
+            size += len(block)
+    return size, hasher.hexdigest()
+
+
+def _check(path, record):
+    if not os.path.exists(path):
+        return "missing", path
+    try:
+        size, digest = hash_file(path, record.get("algorithm"))
+    except (OSError, ValueError) as e:
+        return "unreadable", f"{path}: {e}"
+    if size != record.get("size"):
+        return "size_mismatch", f"{path}: {size} bytes, expected {record.get('size')}"
+    if digest != record.get("hash"):
+        return "corrupt", path
+    return "ok", path
+
+
+def verify_tree(root, workers=4):
+    """
+    Re-hashes every file recorded in the manifests under root (in parallel; hashlib releases
+    the GIL on large buffers). Returns {"ok", "corrupt", "size_mismatch", "missing",
+    "unreadable", "untracked"} -> list of paths/messages; untracked files have no record.
+    """
+    results = {key: [] for key in ("ok", "corrupt", "size_mismatch", "missing", "unreadable", "untracked")}
+    checks = []
+    for dirpath, _, filenames in os.walk(root):
+        records = read_manifest(dirpath)
+        for name, record in records.items():
+            checks.append((os.path.join(dirpath, name), record))
+        for name in filenames:
+            # Dotfiles (the manifest, the library index) are bookkeeping, not downloads
+            if not name.startswith(".") and name not in records and not name.endswith(".part"):
+                results["untracked"].append(os.path.join(dirpath, name))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="verify") as pool:
+        for status, detail in pool.map(lambda check: _check(*check), checks):
+            results[status].append(detail)
+    return results
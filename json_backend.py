@@ -0,0 +1,41 @@
+import json
+
+try:
+    import orjson  # Optional: several times faster than the stdlib for the API payloads we parse
+except ImportError:
+    orjson = None
+
+# One JSON layer for every scraper, the caches and the web API.
+# Uses orjson when it is installed and the stdlib json module otherwise; callers don't need
+# to care which. orjson's decode error subclasses json.JSONDecodeError, so
+# `except JSONDecodeError` (or ValueError) works with both.
+
+BACKEND = "orjson" if orjson is not None else "json"
+JSONDecodeError = json.JSONDecodeError
+
+
+def loads(data):
+    """Parses JSON from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, default=None):
+    """Serialises obj to a str. `default` is called for objects the backend can't serialise."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, default=default)
+
+
+def load(fp):
+    return loads(fp.read())
+
+
+def dump(obj, fp, default=None):
+    fp.write(dumps(obj, default=default))
+
+
+def response_json(response):
+    """Drop-in for requests' response.json() that goes through the selected backend."""
+    return loads(response.content)
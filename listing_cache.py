@@ -0,0 +1,249 @@
+import hashlib
+import os
+import threading
+import time
+
+import json_backend
+import singleflight
+from media_item import MediaItem
+
+# Short-lived cache of listing results ({"items", "error", "status_message"} dicts), shared by
+# all processes that point at the same directory. Together with singleflight this means that
+# when several users search the same term at once, one upstream request is made: threads in a
+# worker wait on the in-process call, other workers wait on the file lock and then read the
+# entry the first worker wrote.
+#
+# Entries live for a TTL that depends on what they hold:
+#   listings with items   ttl (default 300s)
+#   "No results found"    empty_ttl (default 120s; new uploads should show up reasonably soon)
+#   errors                a short TTL per error class (ERROR_TTLS), capped at error_ttl, so a
+#                         query that fails upstream isn't retried by every user who repeats it
+# Results cut short by the caller's own deadline, or answered by an open circuit breaker, are
+# never stored: they say nothing about the query.
+#
+# Stale-while-revalidate: a listing with items that has expired less than stale_ttl ago, and was
+# asked for at least stale_min_hits times by this process, is returned as is while one
+# background thread fetches a fresh copy. Popular searches never wait on an expired entry.
+#
+# Without configure_listing_cache() (e.g. the CLI), only in-process coalescing is done.
+
+DEFAULT_LISTING_CACHE_TTL = 300  # seconds
+DEFAULT_EMPTY_TTL = 120
+DEFAULT_ERROR_TTL = 60  # Upper bound for ERROR_TTLS
+DEFAULT_STALE_TTL = 600  # How long past expiry a popular listing may still be served
+DEFAULT_STALE_MIN_HITS = 2
+
+# Error class -> seconds an error result is cached. Timeouts and network errors are often
+# momentary; rate limits, auth and parse failures won't fix themselves in a few seconds.
+ERROR_TTLS = {"timeout": 10, "network": 15, "rate_limited": 60, "auth": 60, "parse": 60, "other": 30}
+
+_cache_dir = None
+_ttl = DEFAULT_LISTING_CACHE_TTL
+_empty_ttl = DEFAULT_EMPTY_TTL
+_error_ttl = DEFAULT_ERROR_TTL
+_stale_ttl = DEFAULT_STALE_TTL
+_stale_min_hits = DEFAULT_STALE_MIN_HITS
+MAX_TRACKED_KEYS = 4096  # The hit counter is reset when it grows past this
+
+_hits = {}
+_refreshing = set()
+_state_lock = threading.Lock()
+
+
+def configure_listing_cache(cache_dir, ttl=DEFAULT_LISTING_CACHE_TTL, empty_ttl=DEFAULT_EMPTY_TTL,
+                            error_ttl=DEFAULT_ERROR_TTL, stale_ttl=DEFAULT_STALE_TTL,
+                            stale_min_hits=DEFAULT_STALE_MIN_HITS):
+    """
+    Enables the on-disk listing cache in `cache_dir` with entries valid for `ttl` seconds (empty
+    listings `empty_ttl`, errors at most `error_ttl`; 0 disables storing them). Popular listings
+    are served up to `stale_ttl` seconds past expiry while they are refreshed (0 disables that).
+    """
+    global _cache_dir, _ttl, _empty_ttl, _error_ttl, _stale_ttl, _stale_min_hits
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    _cache_dir = cache_dir
+    _ttl = ttl
+    _empty_ttl = empty_ttl
+    _error_ttl = error_ttl
+    _stale_ttl = stale_ttl
+    _stale_min_hits = stale_min_hits
+
+
+def classify_error(message):
+    """Error class (a key of ERROR_TTLS) for a lister's error message."""
+    text = (message or "").lower()
+    if "timeout" in text or "timed out" in text:
+        return "timeout"
+    if "429" in text or "rate limit" in text or "too many requests" in text:
+        return "rate_limited"
+    if "401" in text or "403" in text or "authentication" in text or "api key" in text:
+        return "auth"
+    if "decoding" in text or "processing page" in text or "structure" in text:
+        return "parse"
+    if "network" in text or "request error" in text or "connection" in text:
+        return "network"
+    return "other"
+
+
+def entry_ttl(result):
+    """Seconds a listing result may be cached, or 0 if it must not be stored."""
+    if result.get("deadline_exceeded") or result.get("circuit_open"):
+        return 0
+    if result.get("error"):
+        return min(ERROR_TTLS[classify_error(result["error"])], _error_ttl)
+    if not result.get("items"):
+        return _empty_ttl
+    return _ttl
+
+
+def listing_cache_key(platform, query, limit, media_type, variant=None):
+    """variant: extra lister options that change the result (e.g. a resolution cap), or None."""
+    parts = [platform, query.strip().lower(), limit, media_type]
+    if variant:
+        parts.append(variant)
+    raw = json_backend.dumps(parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(_cache_dir, key + ".json")
+
+
+def _read_entry(key):
+    """The stored {"stored_at", "ttl", "result"} entry for key, or None."""
+    if _cache_dir is None:
+        return None
+    try:
+        with open(_entry_path(key), "r", encoding="utf-8") as f:
+            entry = json_backend.load(f)
+    except (OSError, ValueError):
+        return None
+    result = entry.get("result")
+    if not isinstance(result, dict):
+        return None
+    result["items"] = [MediaItem.from_dict(item) for item in result.get("items", [])]
+    return entry
+
+
+def _age(entry):
+    """Seconds past the entry's expiry (negative while it is fresh)."""
+    return time.time() - entry.get("stored_at", 0) - entry.get("ttl", _ttl)
+
+
+def _read_fresh(key, min_remaining=0):
+    """Returns the cached result for key if present and not expiring within min_remaining seconds, else None."""
+    entry = _read_entry(key)
+    if entry is None or _age(entry) > -min_remaining:
+        return None
+    return entry["result"]
+
+
+def _count_hit(key):
+    with _state_lock:
+        if len(_hits) >= MAX_TRACKED_KEYS and key not in _hits:
+            _hits.clear()
+        _hits[key] = _hits.get(key, 0) + 1
+        return _hits[key]
+
+
+def _to_json(value):
+    if isinstance(value, MediaItem):
+        return value.to_dict()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _write(key, result, ttl):
+    path = _entry_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json_backend.dump({"stored_at": time.time(), "ttl": ttl, "result": result}, f, default=_to_json)
+        os.replace(tmp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Listing cache: could not store entry: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _fetch_and_store(key, fetch, store_errors=True, min_remaining=0):
+    """
+    Fetches under the cross-process lock, unless another worker stored a fresh entry meanwhile.
+    Returns (result, fetched).
+    """
+    with singleflight.file_lock("listing:" + key):
+        cached = _read_fresh(key, min_remaining)  # Another worker may have filled it while we waited
+        if cached is not None:
+            return cached, False
+        result = fetch()
+        ttl = entry_ttl(result)
+        if ttl > 0 and (store_errors or not result.get("error")):
+            _write(key, result, ttl)
+        return result, True
+
+
+def _refresh_in_background(key, fetch):
+    """Starts one background refresh of key per process (no-op if one is already running)."""
+    with _state_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def refresh():
+        try:
+            # Not coalesced with foreground loads: those keep getting the stale entry meanwhile.
+            # A failed refresh doesn't replace it either; the next request tries again.
+            _fetch_and_store(key, fetch, store_errors=False)
+        except Exception as e:  # Nobody is waiting on this thread; the stale entry stays in place
+            print(f"Listing cache: background refresh failed: {e}")
+        finally:
+            with _state_lock:
+                _refreshing.discard(key)
+
+    threading.Thread(target=refresh, name="listing-refresh", daemon=True).start()
+
+
+def get_listing(platform, query, limit, media_type, fetch, variant=None, refresh=None):
+    """
+    Returns the listing for (platform, query, limit, media_type[, variant]), calling fetch() only if no fresh
+    cached entry exists and no other thread/process is already fetching the same listing.
+    Errors and empty listings are stored for a short time (see entry_ttl()). A popular listing that has
+    just expired is returned stale while refresh() (default: fetch; it runs after the caller has moved
+    on, so it shouldn't carry the caller's deadline) updates it in the background.
+    """
+    key = listing_cache_key(platform, query, limit, media_type, variant)
+    hits = _count_hit(key) if _cache_dir is not None else 0
+
+    def load():
+        if _cache_dir is None:
+            return fetch()
+        entry = _read_entry(key)
+        if entry is not None:
+            overdue = _age(entry)
+            if overdue <= 0:
+                return entry["result"]
+            result = entry["result"]
+            if (overdue <= _stale_ttl and hits >= _stale_min_hits
+                    and result.get("items") and not result.get("error")):
+                _refresh_in_background(key, refresh or fetch)
+                return result
+        return _fetch_and_store(key, fetch)[0]
+
+    result, _ = singleflight.do("listing:" + key, load)
+    return dict(result)  # Callers get their own top-level dict; the item list is shared read-only
+
+
+def warm_listing(platform, query, limit, media_type, fetch, variant=None, ahead=60):
+    """
+    Re-fetches a listing that is missing or expires within `ahead` seconds (for the cache warmer).
+    Returns the fresh result, or None if the cached entry is good for longer or no cache is configured.
+    An error never replaces a stored listing. Doesn't count as a hit for stale-while-revalidate.
+    """
+    if _cache_dir is None:
+        return None
+    key = listing_cache_key(platform, query, limit, media_type, variant)
+    if _read_fresh(key, ahead) is not None:
+        return None
+    result, fetched = _fetch_and_store(key, fetch, store_errors=False, min_remaining=ahead)
+    return result if fetched else None
@@ -1,47 +1,232 @@
 import argparse
 import os
-import requests # Required for get_remote_file_size
+import sys
+from concurrent.futures import ThreadPoolExecutor
+import requests
 import time
 
+import circuit_breaker
+import listing_cache
+import query_log
+from media_library import configure_media_library, search_library, item_locations, known_item_ids, platform_item_ids, record_item as record_library_item, LIBRARY_NAME
+import singleflight
+from deadline import Deadline, use_deadline
+from download_planner import make_job, run_plan, POLICIES as SCHEDULE_POLICIES, DEFAULT_ASSUMED_BYTES_PER_SEC
+from integrity import configure_integrity, verify_tree, HASH_ALGORITHMS, DEFAULT_HASH_ALGORITHM
+from media_probe import configure_media_probe, remote_file_size, DEFAULT_PROBE_BYTES
+from output_layout import configure_output_layout, locate, LAYOUTS, DEFAULT_LAYOUT, SHARD_LEVELS
+from memory_budget import MemoryBudget, MemoryTracker, format_mb, peak_rss_bytes
+from preview_cache import init_preview_cache, fetch_preview as preview_cache_fetch, DEFAULT_PREVIEW_CACHE_MAX_BYTES
+from profiling import add_profile_arguments, profiler_from_args
+from renditions import add_size_limit_arguments, size_limits_from_args
+from transfer_scheduler import configure_transfer_scheduler, parse_platform_limits, DEFAULT_MARKER_PATH, DEFAULT_YIELD_BYTES_PER_SEC
+
 # Import functions from existing downloader scripts
-from giphy_downloader import search_giphy, list_giphy_media, download_file as giphy_download_file, DEFAULT_DOWNLOAD_TIMEOUT as GIPHY_TIMEOUT
-from morbotron_scraper import search_morbotron, list_morbotron_media, download_file as morbotron_download_file, DEFAULT_DOWNLOAD_TIMEOUT as MORBOTRON_TIMEOUT
-from wikimedia_scraper import search_wikimedia, list_wikimedia_media, download_file as wikimedia_download_file, DEFAULT_DOWNLOAD_TIMEOUT as WIKIMEDIA_TIMEOUT
-from pixabay_scraper import search_pixabay_videos, list_pixabay_videos, download_file as pixabay_download_file, DEFAULT_DOWNLOAD_TIMEOUT as PIXABAY_TIMEOUT
-from frinkiac_scraper import search_frinkiac_media, list_frinkiac_media, download_file as frinkiac_download_file, DEFAULT_DOWNLOAD_TIMEOUT as FRINKIAC_TIMEOUT
-from mixkit_scraper import search_mixkit_videos, list_mixkit_videos, download_file as mixkit_download_file, DEFAULT_DOWNLOAD_TIMEOUT as MIXKIT_TIMEOUT
-from wikimedia_oauth_scraper import search_wikimedia_oauth_media, list_wikimedia_oauth_media, download_file as wikimedia_oauth_download_file, DEFAULT_DOWNLOAD_TIMEOUT as WIKIMEDIA_OAUTH_TIMEOUT
+from giphy_downloader import search_giphy, list_giphy_media, resolve_giphy_ids, GIPHY_API_KEY, download_file as giphy_download_file, DEFAULT_DOWNLOAD_TIMEOUT as GIPHY_TIMEOUT, DOWNLOAD_HEADERS as GIPHY_HEADERS
+from morbotron_scraper import search_morbotron, list_morbotron_media, download_file as morbotron_download_file, DEFAULT_DOWNLOAD_TIMEOUT as MORBOTRON_TIMEOUT, DOWNLOAD_HEADERS as MORBOTRON_HEADERS
+from wikimedia_scraper import search_wikimedia, list_wikimedia_media, resolve_wikimedia_media, download_file as wikimedia_download_file, DEFAULT_DOWNLOAD_TIMEOUT as WIKIMEDIA_TIMEOUT, DOWNLOAD_HEADERS as WIKIMEDIA_HEADERS
+from pixabay_scraper import search_pixabay_videos, list_pixabay_videos, PIXABAY_API_KEY, download_file as pixabay_download_file, DEFAULT_DOWNLOAD_TIMEOUT as PIXABAY_TIMEOUT, DOWNLOAD_HEADERS as PIXABAY_HEADERS
+from frinkiac_scraper import search_frinkiac_media, list_frinkiac_media, download_file as frinkiac_download_file, DEFAULT_DOWNLOAD_TIMEOUT as FRINKIAC_TIMEOUT, DOWNLOAD_HEADERS as FRINKIAC_HEADERS
+from mixkit_scraper import search_mixkit_videos, list_mixkit_videos, download_file as mixkit_download_file, DEFAULT_DOWNLOAD_TIMEOUT as MIXKIT_TIMEOUT, DOWNLOAD_HEADERS as MIXKIT_HEADERS
+from wikimedia_oauth_scraper import search_wikimedia_oauth_media, list_wikimedia_oauth_media, download_file as wikimedia_oauth_download_file, DEFAULT_DOWNLOAD_TIMEOUT as WIKIMEDIA_OAUTH_TIMEOUT, DOWNLOAD_HEADERS as WIKIMEDIA_OAUTH_HEADERS
 # Comb.io is currently excluded
 # from comb_io_scraper import search_comb_io, list_comb_io_media, download_file as comb_io_download_file, DEFAULT_DOWNLOAD_TIMEOUT as COMBIO_TIMEOUT
 
 SUPPORTED_PLATFORMS = ["giphy", "morbotron", "wikimedia", "wikimedia_oauth", "pixabay", "frinkiac", "mixkit"]
+RESOLVABLE_PLATFORMS = ["giphy", "wikimedia"]  # Platforms whose items can be looked up again by id in bulk
+
+# Request headers each platform's download_file sends (User-Agent, Referer, ...)
+PLATFORM_DOWNLOAD_HEADERS = {
+    "giphy": GIPHY_HEADERS,
+    "morbotron": MORBOTRON_HEADERS,
+    "wikimedia": WIKIMEDIA_HEADERS,
+    "wikimedia_oauth": WIKIMEDIA_OAUTH_HEADERS,
+    "pixabay": PIXABAY_HEADERS,
+    "frinkiac": FRINKIAC_HEADERS,
+    "mixkit": MIXKIT_HEADERS,
+}
 
 def get_remote_file_size(url, timeout=5):
     """
-    Fetches the size of a remote file using a HEAD request.
-    Returns size in bytes, or None if size cannot be determined or an error occurs.
+    Size of a remote file in bytes, from a cached ranged probe (see media_probe).
+    Returns None if the size cannot be determined or the active request deadline has run out.
+    """
+    return remote_file_size(url, timeout=timeout)
+
+def get_platform_download_timeout(platform):
+    """Returns the default download timeout (seconds) of a platform's downloader."""
+    if platform == 'giphy': return GIPHY_TIMEOUT
+    elif platform == 'morbotron': return MORBOTRON_TIMEOUT
+    elif platform == 'wikimedia': return WIKIMEDIA_TIMEOUT
+    elif platform == 'wikimedia_oauth': return WIKIMEDIA_OAUTH_TIMEOUT
+    elif platform == 'pixabay': return PIXABAY_TIMEOUT
+    elif platform == 'frinkiac': return FRINKIAC_TIMEOUT
+    elif platform == 'mixkit': return MIXKIT_TIMEOUT
+    # elif platform == 'comb_io': return COMBIO_TIMEOUT
+    return 10 # A generic fallback
+
+def open_download_stream(item, download_timeout_override=None):
+    """
+    Starts the upstream GET for an item with the platform's download headers and returns the
+    streaming requests.Response (caller must close it). Raises requests exceptions on failure.
+    Used when relaying a file to a client without saving it first.
     """
+    timeout = download_timeout_override if download_timeout_override is not None else get_platform_download_timeout(item['platform'])
+    headers = PLATFORM_DOWNLOAD_HEADERS.get(item['platform'], {})
+    response = requests.get(item['url'], stream=True, headers=headers, timeout=timeout)
     try:
-        response = requests.head(url, timeout=timeout, allow_redirects=True)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        content_length = response.headers.get('Content-Length')
-        if content_length:
-            return int(content_length)
-        else:
-            # print(f"Warning: Content-Length header not found for {url}")
-            return None
-    except requests.exceptions.Timeout:
-        # print(f"Timeout trying to get file size for {url}")
-        return None
-    except requests.exceptions.RequestException as e:
-        # print(f"Error getting file size for {url}: {e}")
-        return None
-    except Exception as e:
-        # print(f"Unexpected error getting file size for {url}: {e}")
-        return None
+        response.raise_for_status()
+    except requests.exceptions.HTTPError:
+        response.close()
+        raise
+    return response
+
+def list_platform_media(platform, query, limit, media_type="all", api_timeout=10, deadline=None, size_limits=None):
+    """
+    Calls the platform's list_* function with the arguments it expects and always returns a
+    dict with 'items', 'error' and 'status_message' (platforms that can't serve the requested
+    media type, or lack an API key, get a status message instead of a call).
+    Upstream calls go through the platform's circuit breaker, so a platform that keeps failing
+    is skipped immediately until a background probe sees it working again.
+    With a deadline (deadline.Deadline), every request the lister makes gets only the time left.
+    size_limits (renditions.make_size_limits) pick smaller renditions on platforms that offer them:
+    Wikimedia scales images to max_width/max_height, Giphy and Pixabay choose among their renditions.
+    """
+    if deadline is not None:
+        if deadline.expired():
+            return {"items": [], "error": None, "status_message": f"{platform.title()}: Skipped, the search ran out of time.",
+                    "deadline_exceeded": True}
+        api_timeout = deadline.clamp(api_timeout)
+    limits = size_limits or {}
+    if platform == 'giphy':
+        if GIPHY_API_KEY == "YOUR_GIPHY_API_KEY_HERE":
+            return {"items": [], "error": None, "status_message": "Giphy: API key not set, search skipped."}
+        fetch = lambda: list_giphy_media(query, limit, media_type, api_timeout, size_limits)
+    elif platform == 'morbotron':
+        if media_type not in ["all", "image"]: # Morbotron is image specific
+            return {"items": [], "error": None, "status_message": f"Morbotron: Skipped, only supports 'image' or 'all', not '{media_type}'."}
+        fetch = lambda: list_morbotron_media(query, limit, media_type, api_timeout)
+    elif platform == 'wikimedia':
+        fetch = lambda: list_wikimedia_media(query, limit, media_type, api_timeout, limits.get("max_width"), limits.get("max_height"))
+    elif platform == 'wikimedia_oauth':
+        fetch = lambda: list_wikimedia_oauth_media(query, limit, media_type, api_timeout, limits.get("max_width"), limits.get("max_height"))
+    elif platform == 'pixabay':
+        if PIXABAY_API_KEY == "YOUR_PIXABAY_API_KEY_HERE":
+            return {"items": [], "error": None, "status_message": "Pixabay: API key not set, search skipped."}
+        if media_type not in ["all", "video"]: # Pixabay (this module) is video specific
+            return {"items": [], "error": None, "status_message": f"Pixabay: Skipped, only supports 'video' or 'all', not '{media_type}'."}
+        fetch = lambda: list_pixabay_videos(query, limit, api_timeout=api_timeout, size_limits=size_limits)
+    elif platform == 'frinkiac':
+        if media_type not in ["all", "image"]: # Frinkiac is image specific
+            return {"items": [], "error": None, "status_message": f"Frinkiac: Skipped, only supports 'image' or 'all', not '{media_type}'."}
+        fetch = lambda: list_frinkiac_media(query, limit, request_timeout=api_timeout)
+    elif platform == 'mixkit':
+        if media_type not in ["all", "video"]: # Mixkit (this module) is video specific
+            return {"items": [], "error": None, "status_message": f"Mixkit: Skipped, only supports 'video' or 'all', not '{media_type}'."}
+        fetch = lambda: list_mixkit_videos(query, limit, request_timeout=api_timeout)
+    # elif platform == 'comb_io': fetch = lambda: list_comb_io_media(query, limit, media_type, api_timeout)
+    else:
+        return {"items": [], "error": f"Unknown platform '{platform}'", "status_message": None}
+
+    def call_lister():
+        with use_deadline(deadline):
+            result = fetch()
+        if isinstance(result, list): # Some early-exit paths still return a bare (empty) list
+            result = {"items": result, "error": None, "status_message": None if result else f"{platform.title()}: No results for '{query[:50]}'"}
+        if deadline is not None and deadline.expired():
+            # Our budget ran out, so the listing may be cut short (a timeout, or an empty or partial
+            # result): not cached, and not the platform's fault
+            result["deadline_exceeded"] = True
+        return result
+
+    return circuit_breaker.get_breaker(platform).call(call_lister)
+
+def get_platform_listing(platform, query, limit, media_type="all", api_timeout=10, deadline=None, size_limits=None):
+    """
+    list_platform_media() behind the listing cache: concurrent identical listings (threads, or
+    workers sharing a configured cache directory) make one upstream request between them.
+    """
+    return listing_cache.get_listing(platform, query, limit, media_type,
+                                     lambda: list_platform_media(platform, query, limit, media_type, api_timeout, deadline, size_limits),
+                                     variant=size_limits,
+                                     # Background revalidation outlives this request, so it gets no deadline
+                                     refresh=lambda: list_platform_media(platform, query, limit, media_type, api_timeout, None, size_limits))
+
+def resolve_platform_items(platform, item_ids, media_type="all", api_timeout=10, size_limits=None):
+    """
+    Looks known items up again by id in batched API calls (resolve_giphy_ids, resolve_wikimedia_media)
+    instead of searching. Returns the listing dict plus 'missing' (ids that no longer resolve); the
+    items are ready for download_selected_item(). Wikimedia ids may be page ids or file titles.
+    """
+    limits = size_limits or {}
+    if platform == 'giphy':
+        return resolve_giphy_ids(item_ids, media_type, api_timeout, size_limits)
+    if platform == 'wikimedia':
+        item_ids = [str(item_id) for item_id in item_ids if item_id]
+        return resolve_wikimedia_media([item_id for item_id in item_ids if not item_id.isdigit()],
+                                       [item_id for item_id in item_ids if item_id.isdigit()],
+                                       media_type, api_timeout, limits.get("max_width"), limits.get("max_height"))
+    return {"items": [], "error": None, "status_message": f"{platform.title()}: Looking items up by id is not supported.",
+            "missing": list(item_ids)}
+
+def warm_platform_listing(platform, query, limit, media_type="all", api_timeout=10, size_limits=None, ahead=60):
+    """
+    Refreshes the cached listing get_platform_listing() would return if it is missing or expires
+    within `ahead` seconds. Returns the new result, or None if nothing needed doing.
+    """
+    return listing_cache.warm_listing(platform, query, limit, media_type,
+                                      lambda: list_platform_media(platform, query, limit, media_type, api_timeout, None, size_limits),
+                                      variant=size_limits, ahead=ahead)
+
+def warm_popular_searches(top_n, window_seconds=query_log.DEFAULT_WINDOW_SECONDS, api_timeout=10, ahead=60,
+                          fetch_preview=None):
+    """
+    Re-lists the top_n most frequent logged searches per platform (query_log) before their cached
+    listings expire. With fetch_preview (preview_cache.fetch_preview), the previews of the first
+    page of each refreshed listing are cached too. Returns the number of listings refreshed.
+    """
+    refreshed = 0
+    for search in query_log.top_searches(top_n, window_seconds):
+        if search["platform"] not in SUPPORTED_PLATFORMS or not search["query"] or not search["limit"]:
+            continue
+        result = warm_platform_listing(search["platform"], search["query"], search["limit"], search["media_type"],
+                                       api_timeout, search["size_limits"], ahead)
+        if result is None:
+            continue
+        refreshed += 1
+        if fetch_preview is None:
+            continue
+        for item in result.get("items", [])[:search["display"] or search["limit"]]:
+            # The same URLs results.html sends through /preview
+            preview_url = item.get("preview_image_url") or (item.get("url") if item.get("type") in ("image", "gif", "sticker") else None)
+            if preview_url:
+                fetch_preview(preview_url)
+    return refreshed
+
+def list_platforms(platforms, query, limit, media_type, api_timeout, memory_budget, profiler, memory_tracker,
+                   size_limits=None, deadline=None):
+    """
+    Lists `query` on every platform, running up to memory_budget's allowed number of listings at
+    once (fewer as the process nears its memory budget). Returns the results in platform order.
+    """
+    def list_one(platform):
+        with memory_budget, profiler.stage(f"list:{platform}"), memory_tracker.stage(f"list:{platform}"):
+            return get_platform_listing(platform, query, limit, media_type, api_timeout, deadline, size_limits)
+
+    if memory_budget.max_concurrency == 1 or len(platforms) == 1:
+        return [list_one(platform) for platform in platforms]
+    with ThreadPoolExecutor(max_workers=memory_budget.max_concurrency, thread_name_prefix="listing") as pool:
+        return list(pool.map(list_one, platforms))
 
 # Generic download function for interactive mode, using platform-specific downloaders
-def download_selected_item(item, base_output_dir, download_timeout_override=None):
+def download_selected_item(item, base_output_dir, download_timeout_override=None, skip_existing=False, query=None):
+    """
+    Downloads one listed item into base_output_dir/<platform>/<filename> (or its shard directory, see
+    output_layout) and returns the path (or None).
+    Concurrent downloads of the same target (threads or other processes) are coalesced: one transfer
+    runs, the others wait for it and get its file. With skip_existing, a file already on disk is reused.
+    The item is recorded in the media library (if one is configured) under the search `query`.
+    """
     # Ensure base_output_dir itself exists, though platform_output_dir creation is handled below
     if not os.path.exists(base_output_dir):
         try:
@@ -58,15 +243,7 @@ def download_selected_item(item, base_output_dir, download_timeout_override=None
 
     actual_timeout = download_timeout_override # Global override takes precedence
     if actual_timeout is None: # If no global override, use platform default
-        if item['platform'] == 'giphy': actual_timeout = GIPHY_TIMEOUT
-        elif item['platform'] == 'morbotron': actual_timeout = MORBOTRON_TIMEOUT
-        elif item['platform'] == 'wikimedia': actual_timeout = WIKIMEDIA_TIMEOUT
-        elif item['platform'] == 'wikimedia_oauth': actual_timeout = WIKIMEDIA_OAUTH_TIMEOUT
-        elif item['platform'] == 'pixabay': actual_timeout = PIXABAY_TIMEOUT
-        elif item['platform'] == 'frinkiac': actual_timeout = FRINKIAC_TIMEOUT
-        elif item['platform'] == 'mixkit': actual_timeout = MIXKIT_TIMEOUT
-        # elif item['platform'] == 'comb_io': actual_timeout = COMBIO_TIMEOUT
-        else: actual_timeout = 10 # A generic fallback
+        actual_timeout = get_platform_download_timeout(item['platform'])
 
     downloader_function = None
     if item['platform'] == 'giphy': downloader_function = giphy_download_file
@@ -79,14 +256,238 @@ def download_selected_item(item, base_output_dir, download_timeout_override=None
     # elif item['platform'] == 'comb_io': downloader_function = comb_io_download_file
 
     if downloader_function:
-        return downloader_function(item['url'], platform_output_dir, item['filename'], timeout=actual_timeout)
+        # Keyed on the flat path: the same item coalesces whatever the directory's layout
+        flight_key = "download:" + os.path.abspath(os.path.join(platform_output_dir, item['filename']))
+        existed_before = locate(platform_output_dir, item['filename']) is not None
+
+        def fetch():
+            # The lock is held for the whole transfer, so nobody sees (or reuses) a half-written file.
+            with singleflight.file_lock(flight_key):
+                existing_path = locate(platform_output_dir, item['filename'])
+                if existing_path and (skip_existing or not existed_before):
+                    print(f"Using existing file {existing_path}")
+                    return existing_path
+                return downloader_function(item['url'], platform_output_dir, item['filename'], timeout=actual_timeout)
+
+        download_path, _ = singleflight.do(flight_key, fetch)
+        expected_size = item.get('size_bytes')
+        if download_path and expected_size:
+            try:
+                actual_size = os.path.getsize(download_path)
+            except OSError:
+                actual_size = None
+            if actual_size is not None and actual_size != expected_size:
+                # Listing sizes can be stale or approximate, so this is a warning rather than a failure
+                print(f"Warning: {download_path} is {actual_size} bytes, the listing said {expected_size}")
+        if download_path:
+            record_library_item(item, download_path, query)
+        return download_path
     else:
         print(f"Error: No downloader function found for platform {item['platform']}")
         return None
 
 
+def run_planned_downloads(jobs, policy, workers, deadline=None, max_item_bytes=None,
+                          assumed_bytes_per_sec=DEFAULT_ASSUMED_BYTES_PER_SEC, download_timeout_override=None):
+    """
+    Downloads the jobs collected from all queries' listings in the order of a download_planner
+    policy, deferring items over max_item_bytes or that won't finish before the deadline.
+    Prints what was done and deferred, and returns run_plan()'s result.
+    """
+    def download(job):
+        return download_selected_item(job["item"], job["output_dir"], download_timeout_override, query=job["query"])
+
+    def measure(path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    start = time.perf_counter()
+    print(f"\n--- Downloading {len(jobs)} item(s) in {policy} order"
+          + (f", {deadline.remaining():.0f}s left" if deadline is not None else "") + " ---")
+    result = run_plan(jobs, download, policy, workers, deadline, max_item_bytes, assumed_bytes_per_sec, measure)
+    for job, reason in result["deferred"]:
+        item = job["item"]
+        size = f"{item['size_bytes'] / (1024 * 1024):.1f} MB" if item.get("size_bytes") else "size unknown"
+        why = "over the size cap" if reason == "oversized" else "would not finish before the deadline"
+        print(f"Deferred [{item['platform']}] {item['title']} ({size}, '{job['query']}'): {why}")
+    print(f"Downloaded {len(result['completed'])}, failed {len(result['failed'])}, deferred {len(result['deferred'])} "
+          f"of {len(jobs)} item(s) in {time.perf_counter() - start:.1f}s "
+          f"(~{result['bytes_per_sec'] / 1024:.0f} KB/s per download).")
+    return result
+
+
+def print_library_matches(query, platforms, media_type, limit):
+    """Looks query up in the media library per platform, prints the matches, and returns {platform: items}."""
+    matches = {}
+    for platform in platforms:
+        matches[platform] = search_library(query, [platform], media_type, limit)
+        for item in matches[platform]:
+            print(f"[{platform}] In library: {item['title']} ({item['type']}) - {item['local_path']}")
+    return matches
+
+
+def verify_main(argv):
+    """`media_downloader_tool.py verify [dir]`: re-hashes a download tree against its manifests. Returns the exit code."""
+    parser = argparse.ArgumentParser(prog="media_downloader_tool.py verify",
+                                     description="Re-check downloaded files against the sizes and hashes recorded when they were downloaded.")
+    parser.add_argument("output_dir", nargs="?", default="downloaded_media", help="Download tree to check (default: downloaded_media).")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Files hashed in parallel (default: CPU count).")
+    parser.add_argument("--show_untracked", action="store_true", help="List files that have no manifest record.")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.output_dir):
+        print(f"Error: '{args.output_dir}' is not a directory.")
+        return 2
+
+    start = time.perf_counter()
+    results = verify_tree(args.output_dir, args.workers)
+    for status, label in (("corrupt", "HASH MISMATCH"), ("size_mismatch", "SIZE MISMATCH"), ("missing", "MISSING"), ("unreadable", "UNREADABLE")):
+        for detail in results[status]:
+            print(f"{label}: {detail}")
+    if args.show_untracked:
+        for path in results["untracked"]:
+            print(f"UNTRACKED: {path}")
+    problems = sum(len(results[status]) for status in ("corrupt", "size_mismatch", "missing", "unreadable"))
+    print(f"Verified {len(results['ok'])} file(s) OK, {problems} problem(s), {len(results['untracked'])} untracked "
+          f"in {time.perf_counter() - start:.1f}s.")
+    return 1 if problems else 0
+
+
+def warm_main(argv):
+    """`media_downloader_tool.py warm`: refreshes the web app's cached listings for its most popular searches."""
+    instance_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance")  # The Flask app's instance folder
+    parser = argparse.ArgumentParser(prog="media_downloader_tool.py warm",
+                                     description="Re-list the web app's most frequent searches before their cached listings expire.")
+    parser.add_argument("--instance_dir", default=instance_dir, help=f"The web app's instance folder (default: {instance_dir}).")
+    parser.add_argument("--top", type=int, default=10, help="Searches to keep warm per platform (default: 10).")
+    parser.add_argument("--window_hours", type=float, default=24, help="Only count searches this recent (default: 24).")
+    parser.add_argument("--ahead", type=int, default=120, help="Refresh listings that expire within this many seconds (default: 120).")
+    parser.add_argument("--api_call_timeout", type=int, default=10, help="Timeout for each platform call (default: 10).")
+    parser.add_argument("--previews", action="store_true", help="Also cache the previews of each refreshed first page.")
+    parser.add_argument("--loop", type=int, default=0, metavar="SECONDS", help="Keep running, warming every SECONDS (default: run once).")
+    args = parser.parse_args(argv)
+
+    # Entries are written with the same TTLs the web app would use
+    listing_cache.configure_listing_cache(os.path.join(args.instance_dir, "listing_cache"),
+                                          int(os.environ.get("LISTING_CACHE_TTL", listing_cache.DEFAULT_LISTING_CACHE_TTL)),
+                                          int(os.environ.get("LISTING_CACHE_EMPTY_TTL", listing_cache.DEFAULT_EMPTY_TTL)),
+                                          int(os.environ.get("LISTING_CACHE_ERROR_TTL", listing_cache.DEFAULT_ERROR_TTL)))
+    query_log.configure_query_log(os.environ.get("QUERY_LOG_PATH", os.path.join(args.instance_dir, "query_log.jsonl")))
+    fetch_preview = None
+    if args.previews:
+        init_preview_cache(os.path.join(args.instance_dir, "preview_cache"),
+                           int(os.environ.get("PREVIEW_CACHE_MAX_BYTES", DEFAULT_PREVIEW_CACHE_MAX_BYTES)))
+        fetch_preview = preview_cache_fetch
+
+    while True:
+        start = time.perf_counter()
+        refreshed = warm_popular_searches(args.top, args.window_hours * 3600, args.api_call_timeout, args.ahead, fetch_preview)
+        print(f"Warmed {refreshed} listing(s) in {time.perf_counter() - start:.1f}s.")
+        if args.loop <= 0:
+            return 0
+        time.sleep(args.loop)
+
+
+def library_download_target(item, location):
+    """
+    (base output dir, filename, query) that puts a re-downloaded item where the library says it was
+    stored (<base>/<platform>/[shards/]<filename>), or None if that path isn't laid out that way.
+    """
+    path, filename, query = location
+    directory = os.path.dirname(path)
+    for _ in range(SHARD_LEVELS + 1):
+        if os.path.basename(directory) == item['platform']:
+            return os.path.dirname(directory), filename, query
+        directory = os.path.dirname(directory)
+    return None
+
+
+def resolve_main(argv):
+    """`media_downloader_tool.py resolve <platform> [ids]`: re-fetches known items by id, optionally downloading them."""
+    parser = argparse.ArgumentParser(prog="media_downloader_tool.py resolve",
+                                     description="Look known items up again by id (batched API calls, no searching), "
+                                                 "e.g. to refresh their URLs or rebuild a download tree.")
+    parser.add_argument("platform", choices=RESOLVABLE_PLATFORMS, help="Platform the ids belong to.")
+    parser.add_argument("ids", nargs="*", help="Item ids (Giphy ids; Wikimedia page ids or file titles).")
+    parser.add_argument("--ids_file", help="Text file with one id per line, added to the ids given.")
+    parser.add_argument("--from_library", action="store_true", help="Also resolve every item of the platform recorded in --output_dir's library.")
+    parser.add_argument("--output_dir", default="downloaded_media", help="Download tree (and library) to use (default: downloaded_media).")
+    parser.add_argument("--media_type", default="all", choices=["all", "image", "gif", "video", "audio", "sticker"],
+                        help="Only keep items of this type (default: all).")
+    parser.add_argument("--download", action="store_true",
+                        help="Download the resolved items: items the library knows go back where they were stored "
+                             "(under the same filename), others into <output_dir>/<platform>/.")
+    parser.add_argument("--overwrite", action="store_true", help="With --download, fetch files again even if they are already on disk.")
+    parser.add_argument("--download_workers", type=int, default=4, help="Downloads run at the same time (default: 4).")
+    parser.add_argument("--download_timeout", type=int, default=None, help="Timeout for each download (default: the platform's).")
+    parser.add_argument("--api_call_timeout", type=int, default=10, help="Timeout for each lookup call (default: 10).")
+    parser.add_argument("--layout", choices=LAYOUTS, default=DEFAULT_LAYOUT,
+                        help=f"Layout of platform folders created by --download (see the main --layout; default: {DEFAULT_LAYOUT}).")
+    add_size_limit_arguments(parser)
+    args = parser.parse_args(argv)
+    size_limits = size_limits_from_args(args)
+    configure_output_layout(args.layout, args.output_dir)
+
+    configure_media_library(os.path.join(args.output_dir, LIBRARY_NAME))
+    item_ids = list(args.ids)
+    if args.ids_file:
+        try:
+            with open(args.ids_file, "r") as f:
+                item_ids.extend(line.strip() for line in f if line.strip())
+        except OSError as e:
+            print(f"Error: could not read '{args.ids_file}': {e}")
+            return 2
+    if args.from_library:
+        item_ids.extend(platform_item_ids(args.platform))
+    if not item_ids:
+        print("No ids to resolve.")
+        return 2
+
+    start = time.perf_counter()
+    result = resolve_platform_items(args.platform, item_ids, args.media_type, args.api_call_timeout, size_limits)
+    for message in (result.get("error"), result.get("status_message")):
+        if message:
+            print(message)
+    for item_id in result.get("missing", []):
+        print(f"NOT FOUND: {item_id}")
+    items = result.get("items", [])
+    print(f"Resolved {len(items)} item(s) in {time.perf_counter() - start:.1f}s.")
+    if not args.download:
+        for item in items:
+            print(f"{item['id']}: {item['title']} ({item['type']}) - {item['url']}")
+        return 1 if result.get("error") else 0
+
+    # Items downloaded before (e.g. by a search run into <output_dir>/<query>/<platform>/) are refreshed in place
+    locations = item_locations(args.platform, [item['id'] for item in items])
+
+    def download(item):
+        location = locations.get(str(item['id']))
+        target = library_download_target(item, location) if location else None
+        if target is None:
+            return download_selected_item(item, args.output_dir, args.download_timeout, skip_existing=not args.overwrite)
+        base_dir, item['filename'], query = target
+        return download_selected_item(item, base_dir, args.download_timeout, skip_existing=not args.overwrite, query=query)
+
+    with ThreadPoolExecutor(max_workers=max(1, args.download_workers), thread_name_prefix="resolve-download") as pool:
+        paths = list(pool.map(download, items))
+    failed = paths.count(None)
+    print(f"Downloaded {len(items) - failed} of {len(items)} item(s).")
+    return 1 if failed or result.get("error") else 0
+
+
 def main():
-    parser = argparse.ArgumentParser(description="Unified Media Downloader Tool.")
+    if len(sys.argv) > 1 and sys.argv[1] == "verify":
+        sys.exit(verify_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "warm":
+        sys.exit(warm_main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "resolve":
+        sys.exit(resolve_main(sys.argv[2:]))
+
+    parser = argparse.ArgumentParser(description="Unified Media Downloader Tool.",
+                                     epilog="Other commands: 'media_downloader_tool.py verify [output_dir]' re-checks a download tree, "
+                                            "'media_downloader_tool.py warm' refreshes the web app's popular listings, "
+                                            "'media_downloader_tool.py resolve <platform> [ids]' looks known items up again by id.")
     parser.add_argument(
         "queries",
         type=str,
@@ -129,6 +530,12 @@ def main():
         action="store_true",
         help="If set, list found media and ask for confirmation before downloading each item."
     )
+    parser.add_argument(
+        "--local_first",
+        action="store_true",
+        help="Answer from the library of files already downloaded under --output_dir first, and only search platforms "
+             "(and download items) for what is still missing."
+    )
     parser.add_argument(
         "--download_timeout",
         type=int,
@@ -141,13 +548,125 @@ def main():
         default=10,
         help="Timeout in seconds for API search calls."
     )
-
+    parser.add_argument(
+        "--max_download_rate_kb",
+        type=float,
+        default=None,
+        help="Cap on total download speed in KB/s (default: unlimited)."
+    )
+    parser.add_argument(
+        "--platform_download_rate_kb",
+        nargs="+",
+        default=None,
+        metavar="PLATFORM=KB",
+        help="Per-platform download speed caps in KB/s, e.g. pixabay=500 mixkit=200."
+    )
+    parser.add_argument(
+        "--yield_rate_kb",
+        type=float,
+        default=DEFAULT_YIELD_BYTES_PER_SEC / 1024,
+        help="Download speed in KB/s this run drops to while the web app on this host serves an interactive download "
+             f"(default: {DEFAULT_YIELD_BYTES_PER_SEC // 1024}; 0 disables yielding)."
+    )
+    parser.add_argument(
+        "--listing_workers",
+        type=int,
+        default=4,
+        help="How many platforms to list at the same time in interactive mode (1 while profiling or tracing memory)."
+    )
+    parser.add_argument(
+        "--memory_budget_mb",
+        type=int,
+        default=int(os.environ.get("MEMORY_BUDGET_MB", 0)) or None,
+        help="Soft memory budget in MB; listing concurrency is reduced as the process gets close to it. Default: MEMORY_BUDGET_MB or none."
+    )
+    parser.add_argument(
+        "--trace_memory",
+        action="store_true",
+        help="Record tracemalloc snapshots per stage and report which lines allocated the most (slows the run down)."
+    )
+    parser.add_argument(
+        "--hash_algorithm",
+        choices=HASH_ALGORITHMS,
+        default=DEFAULT_HASH_ALGORITHM,
+        help=f"Hash recorded for each download in the folder's manifest, for `verify` (default: {DEFAULT_HASH_ALGORITHM})."
+    )
+    parser.add_argument(
+        "--layout",
+        choices=LAYOUTS,
+        default=DEFAULT_LAYOUT,
+        help="'sharded' stores each platform folder's files in hash-prefix subfolders (giphy/3f/a2/...) with an index, "
+             "for harvests of hundreds of thousands of files. A folder keeps the layout it was created with. "
+             f"Default: {DEFAULT_LAYOUT}."
+    )
+    parser.add_argument(
+        "--probe_kb",
+        type=int,
+        default=DEFAULT_PROBE_BYTES // 1024,
+        help="Bytes fetched (in KB) to read an item's size, dimensions and duration where a listing has to probe the file "
+             f"(Frinkiac, Morbotron, Mixkit; default: {DEFAULT_PROBE_BYTES // 1024})."
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=SCHEDULE_POLICIES,
+        default=None,
+        help="List every query first, then download in this order: 'listing' (as listed), 'shortest' (smallest files "
+             "first, the most items per minute), or 'fair' (queries take turns, smallest first). Sizes come from the listings; items still larger than "
+             "--max_item_mb after picking a rendition are deferred instead of downloaded."
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Finish the run within this many seconds (listing included): items that would not finish in time are "
+             "deferred instead of started. Implies --schedule shortest unless another policy is given."
+    )
+    parser.add_argument(
+        "--download_workers",
+        type=int,
+        default=2,
+        help="With --schedule/--deadline, how many items to download at the same time (default: 2)."
+    )
+    parser.add_argument(
+        "--assumed_rate_kb",
+        type=float,
+        default=None,
+        help="Download speed per item in KB/s assumed for --deadline until the first downloads are measured "
+             f"(default: --max_download_rate_kb shared by the workers, or {DEFAULT_ASSUMED_BYTES_PER_SEC // 1024})."
+    )
+    add_size_limit_arguments(parser)
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
+    scheduled = args.schedule is not None or args.deadline is not None
+    if scheduled and args.interactive:
+        parser.error("--schedule/--deadline and --interactive can't be combined")
+    schedule_policy = args.schedule or "shortest"
+    run_deadline = Deadline(args.deadline) if args.deadline is not None else None
+    size_limits = size_limits_from_args(args)
+    try:
+        platform_rate_limits = parse_platform_limits(args.platform_download_rate_kb)
+    except ValueError as e:
+        parser.error(f"--platform_download_rate_kb: {e}")
+    # CLI downloads run at batch priority; the marker tells us when the web app needs the link
+    configure_transfer_scheduler(int(args.max_download_rate_kb * 1024) if args.max_download_rate_kb else None,
+                                 platform_rate_limits, int(args.yield_rate_kb * 1024),
+                                 os.environ.get("TRANSFER_MARKER_PATH", DEFAULT_MARKER_PATH))
+    configure_integrity(args.hash_algorithm)
+    configure_media_probe(args.probe_kb * 1024)
+    configure_output_layout(args.layout, args.output_dir)
+    profiler = profiler_from_args(args)
+    memory_tracker = MemoryTracker(args.trace_memory)
+    # Per-stage profiles and memory snapshots are only meaningful when stages don't overlap
+    listing_workers = 1 if (profiler.enabled or memory_tracker.enabled) else args.listing_workers
+    memory_budget = MemoryBudget(args.memory_budget_mb * 1024 * 1024 if args.memory_budget_mb else None, listing_workers)
 
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
         print(f"Created base output directory: {args.output_dir}")
+    # Every download is indexed here, for --local_first runs
+    configure_media_library(os.path.join(args.output_dir, LIBRARY_NAME))
 
     search_queries = []
     if args.query_file:
@@ -168,6 +687,7 @@ def main():
         print("No search queries provided.")
         return
 
+    planned_jobs = [] # Collected over all queries when downloads are scheduled
     for query_idx, current_query in enumerate(search_queries):
         print(f"\nProcessing query {query_idx + 1}/{len(search_queries)}: '{current_query}'")
         print(f"Platforms: {', '.join(args.platforms)}")
@@ -175,7 +695,13 @@ def main():
         print(f"Media type: {args.media_type}")
         print(f"Base output directory: {args.output_dir}")
         print(f"Interactive mode: {'On' if args.interactive else 'Off'}")
+        if scheduled:
+            print(f"Scheduled downloads: {schedule_policy} order" + (f", deadline {args.deadline:.0f}s" if run_deadline else ""))
+        if args.local_first:
+            print(f"Library first: On ({os.path.join(args.output_dir, LIBRARY_NAME)})")
         print(f"Download timeout: {args.download_timeout if args.download_timeout is not None else 'Platform default'}")
+        if size_limits:
+            print(f"Size limits: {', '.join(f'{key}={value}' for key, value in size_limits.items())}")
         print(f"API call timeout: {args.api_call_timeout}s\n")
 
         # Sanitize query for directory name
@@ -190,35 +716,27 @@ def main():
         # --- Listing Phase (for interactive mode or if we always want to list first) ---
         if args.interactive:
             print(f"--- Discovering media for '{current_query}' (interactive mode) ---")
+            platforms_to_list = args.platforms
+            if args.local_first:
+                library_items = print_library_matches(current_query, args.platforms, args.media_type, args.limit)
+                # Only platforms the library can't fill go upstream
+                platforms_to_list = [platform for platform in args.platforms if len(library_items[platform]) < args.limit]
+                if not platforms_to_list:
+                    print(f"Everything for '{current_query}' is already in the library.")
+                    continue # Next query
             # Fetch lists of media items from each platform
-            if "giphy" in args.platforms:
-                all_found_media_items.extend(list_giphy_media(current_query, args.limit * 2, args.media_type, args.api_call_timeout))
-            if "morbotron" in args.platforms:
-                mt = "image" if args.media_type not in ["image", "all"] else args.media_type # Frinkiac/Morbotron are image specific
-                if args.media_type == "all" or args.media_type == "image":
-                     all_found_media_items.extend(list_morbotron_media(current_query, args.limit * 2, mt, args.api_call_timeout))
-            if "wikimedia" in args.platforms:
-                all_found_media_items.extend(list_wikimedia_media(current_query, args.limit * 2, args.media_type, args.api_call_timeout))
-            if "wikimedia_oauth" in args.platforms:
-                all_found_media_items.extend(list_wikimedia_oauth_media(current_query, args.limit * 2, args.media_type, args.api_call_timeout))
-            if "pixabay" in args.platforms:
-                # Pixabay downloader currently only supports video type via its video API
-                if args.media_type == "all" or args.media_type == "video":
-                    all_found_media_items.extend(list_pixabay_videos(current_query, args.limit * 2, api_timeout=args.api_call_timeout))
-                elif args.interactive: # only print if interactive and type mismatch
-                    print(f"Pixabay: Skipping as it only supports 'video' or 'all' media type for listing, not '{args.media_type}'.")
-            if "frinkiac" in args.platforms:
-                mt = "image" if args.media_type not in ["image", "all"] else args.media_type
-                if args.media_type == "all" or args.media_type == "image": # Frinkiac is image specific
-                    all_found_media_items.extend(list_frinkiac_media(current_query, args.limit * 2, api_timeout=args.api_call_timeout))
-                elif args.interactive:
-                    print(f"Frinkiac: Skipping as it only supports 'image' or 'all' media type for listing, not '{args.media_type}'.")
-            if "mixkit" in args.platforms:
-                # Mixkit downloader currently only supports video type
-                if args.media_type == "all" or args.media_type == "video":
-                    all_found_media_items.extend(list_mixkit_videos(current_query, args.limit * 2, api_timeout=args.api_call_timeout))
-                elif args.interactive:
-                     print(f"Mixkit: Skipping as it only supports 'video' or 'all' media type for listing, not '{args.media_type}'.")
+            list_results = list_platforms(platforms_to_list, current_query, args.limit * 2, args.media_type, args.api_call_timeout,
+                                          memory_budget, profiler, memory_tracker, size_limits)
+            for platform, list_result in zip(platforms_to_list, list_results):
+                if list_result.get("error"):
+                    print(list_result["error"])
+                elif not list_result.get("items") and list_result.get("status_message"):
+                    print(list_result["status_message"])
+                items = list_result.get("items", [])
+                if args.local_first:
+                    known = known_item_ids(platform, [item.get("id") for item in items])
+                    items = [item for item in items if str(item.get("id")) not in known]
+                all_found_media_items.extend(items)
             # Add other platforms (comb_io) here if they become active
 
             if not all_found_media_items:
@@ -260,12 +778,63 @@ def main():
                 # Pass query_specific_output_dir for this item's platform
                 platform_specific_dl_dir = os.path.join(query_specific_output_dir, item_to_dl['platform'])
 
-                if download_selected_item(item_to_dl, query_specific_output_dir, args.download_timeout):
+                stage_name = f"download:{item_to_dl['platform']}"
+                with profiler.stage(stage_name), memory_tracker.stage(stage_name):
+                    downloaded = download_selected_item(item_to_dl, query_specific_output_dir, args.download_timeout, query=current_query)
+                if downloaded:
                     downloaded_count_for_query +=1
 
             print(f"--- Interactive download for '{current_query}' complete. Downloaded {downloaded_count_for_query} items. ---")
 
+        elif scheduled: # --- Listing only; the downloads of all queries are planned together afterwards ---
+            print(f"--- Listing media for '{current_query}' (downloads scheduled in {schedule_policy} order) ---")
+            library_items = print_library_matches(current_query, args.platforms, args.media_type, args.limit) if args.local_first else {}
+            platforms_to_list = [platform for platform in args.platforms if len(library_items.get(platform, [])) < args.limit]
+            list_results = list_platforms(platforms_to_list, current_query, args.limit * 2 if args.local_first else args.limit,
+                                          args.media_type, args.api_call_timeout, memory_budget, profiler, memory_tracker,
+                                          size_limits, run_deadline)
+            for platform, list_result in zip(platforms_to_list, list_results):
+                if list_result.get("error"):
+                    print(list_result["error"])
+                elif not list_result.get("items") and list_result.get("status_message"):
+                    print(list_result["status_message"])
+                items = list_result.get("items", [])
+                if args.local_first:
+                    known = known_item_ids(platform, [item.get("id") for item in items])
+                    items = [item for item in items if str(item.get("id")) not in known]
+                items = items[:args.limit - len(library_items.get(platform, []))]
+                planned_jobs.extend(make_job(item, current_query, query_specific_output_dir) for item in items)
+                print(f"{platform.title()}: {len(items)} item(s) to download.")
+
+        elif args.local_first: # --- Library first, then only what is missing from each platform ---
+            print(f"--- Checking the library for '{current_query}' ---")
+            library_items = print_library_matches(current_query, args.platforms, args.media_type, args.limit)
+            for platform in args.platforms:
+                missing = args.limit - len(library_items[platform])
+                if missing <= 0:
+                    print(f"{platform.title()}: {len(library_items[platform])} item(s) already in the library, not searching upstream.")
+                    continue
+                with profiler.stage(f"list:{platform}"), memory_tracker.stage(f"list:{platform}"):
+                    list_result = get_platform_listing(platform, current_query, args.limit * 2, args.media_type,
+                                                       args.api_call_timeout, size_limits=size_limits)
+                if list_result.get("error"):
+                    print(list_result["error"])
+                    continue
+                items = list_result.get("items", [])
+                known = known_item_ids(platform, [item.get("id") for item in items])
+                new_items = [item for item in items if str(item.get("id")) not in known][:missing]
+                if not new_items and list_result.get("status_message"):
+                    print(list_result["status_message"])
+                downloaded_count = 0
+                for item in new_items:
+                    with profiler.stage(f"download:{platform}"), memory_tracker.stage(f"download:{platform}"):
+                        if download_selected_item(item, query_specific_output_dir, args.download_timeout, query=current_query):
+                            downloaded_count += 1
+                print(f"{platform.title()}: {len(library_items[platform])} item(s) from the library, {downloaded_count} downloaded.")
+
         else: # --- Direct Download Phase (not interactive) ---
+            # Platforms run one at a time here; the memory budget still checks RSS before each one
+            # and forces a gc pass once the process is over budget
             print(f"--- Downloading media directly for '{current_query}' ---")
             if "giphy" in args.platforms:
                 print("-" * 20)
@@ -273,7 +842,8 @@ def main():
                 giphy_output_subdir = os.path.join(query_specific_output_dir, "giphy")
                 try:
                     m_type = args.media_type if args.media_type not in ["image", "audio"] else "all"
-                    downloaded_count = search_giphy(current_query, args.limit, giphy_output_subdir, m_type, args.api_call_timeout)
+                    with memory_budget, profiler.stage("search:giphy"), memory_tracker.stage("search:giphy"):
+                        downloaded_count = search_giphy(current_query, args.limit, giphy_output_subdir, m_type, args.api_call_timeout, size_limits)
                     if downloaded_count: print(f"Giphy: Downloaded {len(downloaded_count)} files.")
                     else: print(f"Giphy: No files downloaded for '{current_query}'.")
                 except Exception as e: print(f"Giphy Error: {e}")
@@ -286,7 +856,8 @@ def main():
                 try:
                     # Morbotron is image specific
                     if args.media_type == "all" or args.media_type == "image":
-                        downloaded_count = search_morbotron(current_query, args.limit, morbotron_output_subdir, "image", args.api_call_timeout)
+                        with memory_budget, profiler.stage("search:morbotron"), memory_tracker.stage("search:morbotron"):
+                            downloaded_count = search_morbotron(current_query, args.limit, morbotron_output_subdir, "image", args.api_call_timeout)
                         if downloaded_count: print(f"Morbotron: Downloaded {len(downloaded_count)} files.")
                         else: print(f"Morbotron: No files downloaded for '{current_query}'.")
                     else: print(f"Morbotron: Skipping as it only supports 'image' or 'all' media type, not '{args.media_type}'.")
@@ -299,7 +870,9 @@ def main():
                 wikimedia_output_subdir = os.path.join(query_specific_output_dir, "wikimedia")
                 try:
                     m_type = args.media_type if args.media_type != "sticker" else "all" # Wikimedia supports various types
-                    downloaded_count = search_wikimedia(current_query, args.limit, wikimedia_output_subdir, m_type, args.api_call_timeout)
+                    with memory_budget, profiler.stage("search:wikimedia"), memory_tracker.stage("search:wikimedia"):
+                        downloaded_count = search_wikimedia(current_query, args.limit, wikimedia_output_subdir, m_type, args.api_call_timeout,
+                                                            max_width=args.max_width, max_height=args.max_height)
                     if downloaded_count: print(f"Wikimedia: Downloaded {len(downloaded_count)} files.")
                     else: print(f"Wikimedia: No files downloaded for '{current_query}'.")
                 except Exception as e: print(f"Wikimedia Error: {e}")
@@ -311,7 +884,9 @@ def main():
                 wikimedia_oauth_output_subdir = os.path.join(query_specific_output_dir, "wikimedia_oauth")
                 try:
                     m_type = args.media_type if args.media_type != "sticker" else "all" # Wikimedia supports various types
-                    downloaded_count = search_wikimedia_oauth_media(current_query, args.limit, wikimedia_oauth_output_subdir, m_type, args.api_call_timeout, args.download_timeout or WIKIMEDIA_OAUTH_TIMEOUT)
+                    with memory_budget, profiler.stage("search:wikimedia_oauth"), memory_tracker.stage("search:wikimedia_oauth"):
+                        downloaded_count = search_wikimedia_oauth_media(current_query, args.limit, wikimedia_oauth_output_subdir, m_type, args.api_call_timeout, args.download_timeout or WIKIMEDIA_OAUTH_TIMEOUT,
+                                                                        max_width=args.max_width, max_height=args.max_height)
                     if downloaded_count: print(f"Wikimedia OAuth: Downloaded {len(downloaded_count)} files.")
                     else: print(f"Wikimedia OAuth: No files downloaded for '{current_query}'.")
                 except Exception as e: print(f"Wikimedia OAuth Error: {e}")
@@ -324,7 +899,9 @@ def main():
                 try:
                     # Pixabay (this module) is video specific
                     if args.media_type == "all" or args.media_type == "video":
-                        downloaded_count = search_pixabay_videos(current_query, args.limit, pixabay_output_subdir, api_timeout=args.api_call_timeout, download_timeout=args.download_timeout or PIXABAY_TIMEOUT)
+                        with memory_budget, profiler.stage("search:pixabay"), memory_tracker.stage("search:pixabay"):
+                            downloaded_count = search_pixabay_videos(current_query, args.limit, pixabay_output_subdir, api_timeout=args.api_call_timeout, download_timeout=args.download_timeout or PIXABAY_TIMEOUT,
+                                                                     size_limits=size_limits)
                         if downloaded_count: print(f"Pixabay: Downloaded {len(downloaded_count)} files.")
                         else: print(f"Pixabay: No files downloaded for '{current_query}'.")
                     else: print(f"Pixabay: Skipping as it only supports 'video' or 'all' media type, not '{args.media_type}'.")
@@ -338,7 +915,8 @@ def main():
                 try:
                     # Frinkiac is image specific
                     if args.media_type == "all" or args.media_type == "image":
-                        downloaded_count = search_frinkiac_media(current_query, args.limit, frinkiac_output_subdir, api_timeout=args.api_call_timeout, download_timeout=args.download_timeout or FRINKIAC_TIMEOUT)
+                        with memory_budget, profiler.stage("search:frinkiac"), memory_tracker.stage("search:frinkiac"):
+                            downloaded_count = search_frinkiac_media(current_query, args.limit, frinkiac_output_subdir, api_timeout=args.api_call_timeout, download_timeout=args.download_timeout or FRINKIAC_TIMEOUT)
                         if downloaded_count: print(f"Frinkiac: Downloaded {len(downloaded_count)} files.")
                         else: print(f"Frinkiac: No files downloaded for '{current_query}'.")
                     else: print(f"Frinkiac: Skipping as it only supports 'image' or 'all' media type, not '{args.media_type}'.")
@@ -352,7 +930,8 @@ def main():
                 try:
                     # Mixkit (this module) is video specific
                     if args.media_type == "all" or args.media_type == "video":
-                        downloaded_count = search_mixkit_videos(current_query, args.limit, mixkit_output_subdir, api_timeout=args.api_call_timeout, download_timeout=args.download_timeout or MIXKIT_TIMEOUT)
+                        with memory_budget, profiler.stage("search:mixkit"), memory_tracker.stage("search:mixkit"):
+                            downloaded_count = search_mixkit_videos(current_query, args.limit, mixkit_output_subdir, api_timeout=args.api_call_timeout, download_timeout=args.download_timeout or MIXKIT_TIMEOUT)
                         if downloaded_count: print(f"Mixkit: Downloaded {len(downloaded_count)} files.")
                         else: print(f"Mixkit: No files downloaded for '{current_query}'.")
                     else: print(f"Mixkit: Skipping as it only supports 'video' or 'all' media type, not '{args.media_type}'.")
@@ -361,7 +940,28 @@ def main():
 
             # Add Comb.io direct download here if reactivated
 
+    if scheduled and planned_jobs:
+        if args.assumed_rate_kb:
+            assumed_rate = args.assumed_rate_kb * 1024
+        elif args.max_download_rate_kb:
+            assumed_rate = args.max_download_rate_kb * 1024 / max(1, args.download_workers)
+        else:
+            assumed_rate = DEFAULT_ASSUMED_BYTES_PER_SEC
+        with profiler.stage("download:scheduled"), memory_tracker.stage("download:scheduled"):
+            run_planned_downloads(planned_jobs, schedule_policy, 1 if (profiler.enabled or memory_tracker.enabled) else args.download_workers,
+                                  run_deadline, int(args.max_item_mb * 1024 * 1024) if args.max_item_mb else None,
+                                  assumed_rate, args.download_timeout)
+
     print("\nUnified media download process complete for all queries.")
+    profiler.write_report()
+    if memory_tracker.enabled:
+        memory_report = memory_tracker.report()
+        print(f"\n--- Memory by stage (tracemalloc) ---\n{memory_report}")
+        if not os.path.exists(args.profile_dir):
+            os.makedirs(args.profile_dir)
+        with open(os.path.join(args.profile_dir, "memory_report.txt"), "w", encoding="utf-8") as f:
+            f.write(memory_report + "\n")
+    print(f"Peak RSS: {format_mb(peak_rss_bytes())}")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,97 @@
+import sys
+from collections.abc import MutableMapping
+
+# Compact representation of one listed media item.
+# Scrapers used to build a fresh dict per result with the same string keys over and over;
+# batch runs keep tens of thousands of those around. MediaItem stores the common fields in
+# __slots__ (no per-instance dict), interns the platform, type and rendition strings so every item shares
+# one copy, and only allocates a dict for platform-specific extras (episode, subtitle, ...).
+#
+# It is a MutableMapping, so existing code keeps working unchanged: item['url'], item.get(...),
+# dict(item), Jinja's item.title / item.episode, and json via to_dict().
+
+FIELDS = ("id", "title", "url", "type", "filename", "platform", "size_bytes", "preview_image_url", "rendition")
+_FIELD_SET = frozenset(FIELDS)
+# Fields that only show up as keys when set (the old dicts didn't always carry them)
+_OPTIONAL_FIELDS = frozenset(("preview_image_url", "rendition"))
+_INTERNED_FIELDS = ("platform", "type", "rendition")  # Few distinct values, repeated on every item
+
+
+class MediaItem(MutableMapping):
+    """One search result; behaves like the dict the scrapers used to return."""
+
+    __slots__ = FIELDS + ("extras",)
+
+    def __init__(self, id, title, url, type, filename, platform, size_bytes=None,
+                 preview_image_url=None, rendition=None, **extras):
+        self.id = id
+        self.title = title
+        self.url = url
+        self.type = sys.intern(type) if isinstance(type, str) else type
+        self.filename = filename
+        self.platform = sys.intern(platform) if isinstance(platform, str) else platform
+        self.size_bytes = size_bytes
+        self.preview_image_url = preview_image_url
+        self.rendition = sys.intern(rendition) if isinstance(rendition, str) else rendition  # e.g. "fixed_height", "medium"
+        self.extras = extras or None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds a MediaItem from a plain dict (JSON cache entries, form posts)."""
+        if isinstance(data, cls):
+            return data
+        data = dict(data)
+        core = {key: data.pop(key, None) for key in FIELDS}
+        return cls(**core, **data)
+
+    def to_dict(self):
+        """Plain dict with the same keys the scrapers used to return (for JSON)."""
+        return dict(self.items())
+
+    def _has(self, key):
+        if key in _FIELD_SET:
+            return key not in _OPTIONAL_FIELDS or getattr(self, key) is not None
+        return self.extras is not None and key in self.extras
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            if key in _OPTIONAL_FIELDS and getattr(self, key) is None:
+                raise KeyError(key)
+            return getattr(self, key)
+        if self.extras is None:
+            raise KeyError(key)
+        return self.extras[key]
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            if key in _INTERNED_FIELDS and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extras is None:
+                self.extras = {}
+            self.extras[key] = value
+
+    def __delitem__(self, key):
+        if key in _OPTIONAL_FIELDS and getattr(self, key) is not None:
+            setattr(self, key, None)
+        elif key in _FIELD_SET or self.extras is None:
+            raise KeyError(key)
+        else:
+            del self.extras[key]
+
+    def __contains__(self, key):
+        return self._has(key)
+
+    def __iter__(self):
+        for key in FIELDS:
+            if key not in _OPTIONAL_FIELDS or getattr(self, key) is not None:
+                yield key
+        if self.extras:
+            yield from self.extras
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"MediaItem({self.to_dict()!r})"
@@ -0,0 +1,241 @@
+import os
+import sqlite3
+import threading
+import time
+
+import json_backend
+from media_item import MediaItem
+
+# Local index of downloaded media, searchable without going upstream.
+# Every download (download_selected_item(), the scrapers' search_* loops, the web app's cached
+# copies) records the listed item's metadata and its path in a SQLite database. Titles, Frinkiac
+# subtitles, Wikimedia/Mixkit descriptions and episode/timestamp info are full-text indexed
+# (FTS5; a plain LIKE scan where SQLite is built without it), so "search the library first"
+# answers from disk and only what's missing is fetched from the platforms.
+#
+# Paths are stored relative to the database's directory, so an output tree can be moved along
+# with its library. Rows whose file has disappeared (evicted, deleted) are dropped when a search
+# runs into them.
+#
+# Without configure_media_library() recording is a no-op and searches return nothing.
+
+LIBRARY_NAME = ".library.sqlite3"
+TEXT_EXTRAS = ("subtitle", "description", "episode", "timestamp")  # Extras worth searching on
+
+_db_path = None
+_fts = True
+_local = threading.local()
+_schema_lock = threading.Lock()
+
+
+def configure_media_library(db_path):
+    """Opens (creating if needed) the library database at db_path for this process."""
+    global _db_path, _fts
+    directory = os.path.dirname(os.path.abspath(db_path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with _schema_lock:
+        connection = sqlite3.connect(db_path, timeout=10)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")  # Readers don't block the worker that is writing
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS media ("
+                " id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, platform TEXT, item_id TEXT, type TEXT,"
+                " title TEXT, url TEXT, filename TEXT, size_bytes INTEGER, query TEXT, body TEXT, item TEXT,"
+                " downloaded_at REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS media_platform_item ON media (platform, item_id)")
+            try:
+                connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS media_fts USING fts5(title, body, query)")
+                _fts = True
+            except sqlite3.OperationalError:
+                _fts = False  # SQLite without FTS5: search falls back to LIKE
+            connection.commit()
+        finally:
+            connection.close()
+    _db_path = db_path
+
+
+def is_configured():
+    return _db_path is not None
+
+
+def _connection():
+    """This thread's connection to the configured library (sqlite3 connections aren't shared between threads)."""
+    connection = getattr(_local, "connection", None)
+    if connection is None or getattr(_local, "path", None) != _db_path or getattr(_local, "pid", None) != os.getpid():
+        connection = sqlite3.connect(_db_path, timeout=10)
+        _local.connection, _local.path, _local.pid = connection, _db_path, os.getpid()
+    return connection
+
+
+def _root():
+    return os.path.dirname(os.path.abspath(_db_path))
+
+
+def _body_text(item):
+    return " ".join(str(item.get(key)) for key in TEXT_EXTRAS if item.get(key) not in (None, ""))
+
+
+def record_item(item, path, query=None):
+    """Indexes a downloaded item (MediaItem or dict) stored at path; replaces any earlier record of that path."""
+    if _db_path is None or not path:
+        return
+    data = item.to_dict() if isinstance(item, MediaItem) else dict(item)
+    data.pop("local_path", None)
+    relative_path = os.path.relpath(os.path.abspath(path), _root())
+    title, body, query = data.get("title") or "", _body_text(data), (query or "").strip().lower()
+    try:
+        connection = _connection()
+        with connection:
+            connection.execute(
+                "INSERT INTO media (path, platform, item_id, type, title, url, filename, size_bytes, query, body, item, downloaded_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(path) DO UPDATE SET platform=excluded.platform, item_id=excluded.item_id, type=excluded.type,"
+                " title=excluded.title, url=excluded.url, filename=excluded.filename, size_bytes=excluded.size_bytes,"
+                " query=excluded.query, body=excluded.body, item=excluded.item, downloaded_at=excluded.downloaded_at",
+                (relative_path, data.get("platform"), None if data.get("id") is None else str(data.get("id")),
+                 data.get("type"), title, data.get("url"), data.get("filename") or os.path.basename(path),
+                 data.get("size_bytes"), query, body, json_backend.dumps(data), time.time()),
+            )
+            if _fts:
+                # After the upsert this transaction holds the write lock, so a concurrent record of the same path can't interleave
+                media_id = connection.execute("SELECT id FROM media WHERE path = ?", (relative_path,)).fetchone()[0]
+                connection.execute("DELETE FROM media_fts WHERE rowid = ?", (media_id,))
+                connection.execute("INSERT INTO media_fts (rowid, title, body, query) VALUES (?, ?, ?, ?)",
+                                   (media_id, title, body, query))
+    except (sqlite3.Error, TypeError, ValueError) as e:
+        print(f"Library: could not index {path}: {e}")
+
+
+def _fts_expression(query):
+    """Every word of the query as a quoted prefix term, ANDed (so user input can't inject FTS syntax)."""
+    words = [word.replace('"', '""') for word in query.split()]
+    return " ".join(f'"{word}"*' for word in words if word)
+
+
+def search_library(query, platforms=None, media_type="all", limit=20):
+    """
+    Downloaded items matching query (title, subtitles, descriptions, or the search that found
+    them), best matches first, as MediaItems with an extra `local_path`. Only files still on disk
+    are returned.
+    """
+    if _db_path is None or not query or not query.strip():
+        return []
+    filters, params = [], []
+    if platforms:
+        filters.append(f"m.platform IN ({', '.join('?' for _ in platforms)})")
+        params.extend(platforms)
+    if media_type and media_type != "all":
+        filters.append("m.type = ?")
+        params.append(media_type)
+    where = "".join(f" AND {condition}" for condition in filters)
+    if _fts:
+        sql = ("SELECT m.id, m.path, m.item FROM media_fts JOIN media m ON m.id = media_fts.rowid"
+               f" WHERE media_fts MATCH ?{where} ORDER BY bm25(media_fts) LIMIT ?")
+        params = [_fts_expression(query)] + params
+    else:
+        words = query.lower().split()
+        sql = ("SELECT m.id, m.path, m.item FROM media m WHERE "
+               + " AND ".join("lower(m.title || ' ' || m.body || ' ' || m.query) LIKE ?" for _ in words)
+               + f"{where} ORDER BY m.downloaded_at DESC LIMIT ?")
+        params = [f"%{word}%" for word in words] + params
+    # Ask for a few extra rows in case some files are gone
+    params.append(limit * 2 + 5)
+
+    items, missing = [], []
+    try:
+        rows = _connection().execute(sql, params).fetchall()
+    except sqlite3.Error as e:
+        print(f"Library: search failed: {e}")
+        return []
+    for media_id, relative_path, raw_item in rows:
+        path = os.path.join(_root(), relative_path)
+        if not os.path.exists(path):
+            missing.append(media_id)
+            continue
+        try:
+            data = json_backend.loads(raw_item)
+        except ValueError:
+            continue
+        if any(data.get(key) is None for key in ("title", "url", "type", "filename", "platform")):
+            continue
+        items.append(MediaItem.from_dict({**data, "local_path": path}))
+        if len(items) >= limit:
+            break
+    if missing:
+        forget(missing)
+    return items
+
+
+def forget(media_ids):
+    """Drops library rows (files that no longer exist)."""
+    try:
+        connection = _connection()
+        with connection:
+            for media_id in media_ids:
+                connection.execute("DELETE FROM media WHERE id = ?", (media_id,))
+                if _fts:
+                    connection.execute("DELETE FROM media_fts WHERE rowid = ?", (media_id,))
+    except sqlite3.Error as e:
+        print(f"Library: could not drop stale rows: {e}")
+
+
+def known_item_ids(platform, item_ids):
+    """The subset of a platform's item ids that the library already has a file for."""
+    if _db_path is None or not item_ids:
+        return set()
+    item_ids = [str(item_id) for item_id in item_ids if item_id is not None]
+    known = set()
+    try:
+        connection = _connection()
+        for start in range(0, len(item_ids), 500):  # Stay under SQLite's bound-parameter limit
+            chunk = item_ids[start:start + 500]
+            rows = connection.execute(
+                f"SELECT item_id, path FROM media WHERE platform = ? AND item_id IN ({', '.join('?' for _ in chunk)})",
+                [platform] + chunk,
+            ).fetchall()
+            known.update(item_id for item_id, relative_path in rows if os.path.exists(os.path.join(_root(), relative_path)))
+    except sqlite3.Error as e:
+        print(f"Library: lookup failed: {e}")
+    return known
+
+
+def item_locations(platform, item_ids):
+    """
+    {item_id: (absolute path, filename, query)} of the latest recorded download of each of a
+    platform's item ids that the library knows (whether the file is still on disk or not).
+    """
+    if _db_path is None or not item_ids:
+        return {}
+    item_ids = [str(item_id) for item_id in item_ids if item_id is not None]
+    locations = {}
+    try:
+        connection = _connection()
+        for start in range(0, len(item_ids), 500):  # Stay under SQLite's bound-parameter limit
+            chunk = item_ids[start:start + 500]
+            rows = connection.execute(
+                f"SELECT item_id, path, filename, query FROM media WHERE platform = ? AND item_id IN ({', '.join('?' for _ in chunk)})"
+                " ORDER BY downloaded_at",
+                [platform] + chunk,
+            ).fetchall()
+            for item_id, relative_path, filename, query in rows:  # Later downloads overwrite earlier ones
+                locations[item_id] = (os.path.join(_root(), relative_path), filename or os.path.basename(relative_path), query)
+    except sqlite3.Error as e:
+        print(f"Library: lookup failed: {e}")
+    return locations
+
+
+def platform_item_ids(platform):
+    """Every item id the library has recorded for a platform (files on disk or not), oldest download first."""
+    if _db_path is None:
+        return []
+    try:
+        rows = _connection().execute(
+            "SELECT item_id FROM media WHERE platform = ? AND item_id IS NOT NULL GROUP BY item_id ORDER BY MIN(downloaded_at)",
+            (platform,),
+        ).fetchall()
+    except sqlite3.Error as e:
+        print(f"Library: lookup failed: {e}")
+        return []
+    return [row[0] for row in rows]
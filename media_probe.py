@@ -0,0 +1,423 @@
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+import singleflight
+from deadline import clamp_timeout, deadline_expired
+
+# Metadata of a remote image or video from the first bytes of the file.
+# Listers used to send a HEAD request per item, which only tells the Content-Length. A probe
+# sends one ranged GET (Range: bytes=0-<probe_bytes - 1>) instead and reads:
+#   - the total size from Content-Range (or Content-Length if the server ignores the range),
+#   - width/height from the JPEG SOF, PNG IHDR, GIF screen descriptor or WebP header,
+#   - duration and width/height from an MP4/MOV `moov` box or the WebM/Matroska Info and Tracks.
+# When the header lies beyond the first range (a JPEG with a large EXIF block, an MP4 whose
+# moov comes after the media data), a few more ranged reads fetch just that part, never more
+# than MAX_EXTRA_BYTES in total. Results are cached per URL (in-process, LRU with a TTL), and
+# concurrent probes of the same URL share one request, so filtering on resolution or duration
+# costs one small request per item.
+#
+# probe_media() returns {"size_bytes", "format", "width", "height", "duration"} (None where
+# unknown), or None if the request failed or the active deadline has run out.
+
+DEFAULT_PROBE_BYTES = 64 * 1024
+DEFAULT_PROBE_CACHE_ENTRIES = 4096
+DEFAULT_PROBE_CACHE_TTL = 3600  # seconds
+MAX_EXTRA_READS = 3  # Ranged reads after the first one, per probe
+MAX_EXTRA_BYTES = 4 * 1024 * 1024  # Largest moov/header part fetched after the first range
+MAX_EBML_ELEMENTS = 512  # Elements visited in a WebM header before giving up
+
+_probe_bytes = DEFAULT_PROBE_BYTES
+_cache_entries = DEFAULT_PROBE_CACHE_ENTRIES
+_cache_ttl = DEFAULT_PROBE_CACHE_TTL
+_cache = OrderedDict()  # url -> (expires_at, result)
+_cache_lock = threading.Lock()
+
+
+def configure_media_probe(probe_bytes=DEFAULT_PROBE_BYTES, cache_entries=DEFAULT_PROBE_CACHE_ENTRIES,
+                          cache_ttl=DEFAULT_PROBE_CACHE_TTL):
+    """Sets the size of the first range and the probe cache limits (0 entries disables the cache)."""
+    global _probe_bytes, _cache_entries, _cache_ttl
+    _probe_bytes = max(1024, int(probe_bytes))
+    _cache_entries = max(0, int(cache_entries))
+    _cache_ttl = cache_ttl
+    with _cache_lock:
+        _cache.clear()
+
+
+def _cached(url):
+    with _cache_lock:
+        entry = _cache.get(url)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del _cache[url]
+            return None
+        _cache.move_to_end(url)
+        return entry[1]
+
+
+def _store(url, result):
+    if not _cache_entries:
+        return
+    with _cache_lock:
+        _cache[url] = (time.monotonic() + _cache_ttl, result)
+        _cache.move_to_end(url)
+        while len(_cache) > _cache_entries:
+            _cache.popitem(last=False)
+
+
+def _content_range(response):
+    """(first byte, total size or None) from a 206 response's Content-Range, or None."""
+    value = response.headers.get("Content-Range", "")
+    try:
+        unit, _, spec = value.partition(" ")
+        span, _, total = spec.partition("/")
+        if unit.strip().lower() != "bytes":
+            return None
+        return int(span.partition("-")[0]), (int(total) if total.strip() != "*" else None)
+    except ValueError:
+        return None
+
+
+def _read_body(response, limit):
+    body = bytearray()
+    for chunk in response.iter_content(chunk_size=min(limit, 16384)):
+        body += chunk
+        if len(body) >= limit:
+            break
+    return bytes(body[:limit])
+
+
+def _get_range(url, start, length, headers, timeout):
+    """(status, bytes, first byte offset, total size) of one ranged GET; the body is cut off at length."""
+    request_headers = dict(headers or {})
+    request_headers["Range"] = f"bytes={start}-{start + length - 1}"
+    with requests.get(url, headers=request_headers, stream=True, timeout=clamp_timeout(timeout),
+                      allow_redirects=True) as response:
+        if response.status_code == 416:  # Range past the end (an empty file, for the first range)
+            span = _content_range(response)
+            return 416, b"", start, span[1] if span else None
+        response.raise_for_status()
+        if response.status_code == 206:
+            span = _content_range(response)
+            if span is None:
+                return 206, b"", start, None
+            return 206, _read_body(response, length), span[0], span[1]
+        # The server ignored the range and sends the whole file
+        total = response.headers.get("Content-Length")
+        encoding = response.headers.get("Content-Encoding", "identity").lower()
+        total = int(total) if total and total.isdigit() and encoding in ("", "identity") else None
+        return response.status_code, (_read_body(response, length) if start == 0 else b""), 0, total
+
+
+class _RangeReader:
+    """Random access to the start of a remote file, fetching further ranges on demand (bounded)."""
+
+    def __init__(self, data, total_size, fetch):
+        self.windows = [(0, data)]
+        self.total_size = total_size
+        self.fetch = fetch  # fetch(start, length) -> bytes starting at start, or b""
+        self.extra_reads = 0
+        self.extra_bytes = 0
+
+    def read(self, offset, length):
+        """length bytes at offset, or None if they can't be had within the limits."""
+        for start, window in self.windows:
+            if start <= offset and offset + length <= start + len(window):
+                return window[offset - start:offset - start + length]
+        if self.total_size is not None and offset + length > self.total_size:
+            return None
+        fetch_length = max(length, _probe_bytes)
+        if (self.fetch is None or self.extra_reads >= MAX_EXTRA_READS
+                or self.extra_bytes + length > MAX_EXTRA_BYTES):
+            return None
+        fetch_length = min(fetch_length, MAX_EXTRA_BYTES - self.extra_bytes)
+        self.extra_reads += 1
+        window = self.fetch(offset, fetch_length)
+        self.extra_bytes += len(window)
+        if len(window) < length:
+            return None
+        self.windows.append((offset, window))
+        return window[:length]
+
+
+def _jpeg_dimensions(reader):
+    offset = 2
+    while True:
+        marker = reader.read(offset, 4)
+        if marker is None or marker[0] != 0xFF:
+            return None
+        kind = marker[1]
+        if kind == 0xFF:  # Fill byte
+            offset += 1
+            continue
+        if kind == 0xD8 or 0xD0 <= kind <= 0xD7 or kind == 0x01:  # Markers without a length
+            offset += 2
+            continue
+        if kind in (0xD9, 0xDA):  # End of image, start of scan: no frame header before it
+            return None
+        if 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+            frame = reader.read(offset + 5, 4)
+            if frame is None:
+                return None
+            height, width = struct.unpack(">HH", frame)
+            return width, height
+        offset += 2 + struct.unpack(">H", marker[2:4])[0]
+
+
+def _webp_dimensions(header):
+    chunk = header[12:16]
+    if chunk == b"VP8X" and len(header) >= 30:
+        return (int.from_bytes(header[24:27], "little") + 1, int.from_bytes(header[27:30], "little") + 1)
+    if chunk == b"VP8 " and len(header) >= 30:
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L" and len(header) >= 25:
+        b0, b1, b2, b3 = header[21:25]
+        return 1 + (((b1 & 0x3F) << 8) | b0), 1 + (((b3 & 0x0F) << 10) | (b2 << 2) | ((b1 & 0xC0) >> 6))
+    return None
+
+
+def _mp4_boxes(data, start=0, end=None):
+    """(type, payload start, payload end) of the boxes in data[start:end]."""
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[start:start + 8])
+        header = 8
+        if size == 1:
+            if start + 16 > end:
+                return
+            size = struct.unpack(">Q", data[start + 8:start + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            return
+        yield kind, start + header, start + size
+        start += size
+
+
+def _mp4_moov(reader):
+    """Duration and the largest track's width/height from the moov box, walking the top-level boxes."""
+    offset = 0
+    while True:
+        head = reader.read(offset, 16) or reader.read(offset, 8)
+        if head is None:
+            return None
+        size, kind = struct.unpack(">I4s", head[:8])
+        header = 8
+        if size == 1:
+            if len(head) < 16:
+                return None
+            size, header = struct.unpack(">Q", head[8:16])[0], 16
+        elif size == 0:
+            if reader.total_size is None:
+                return None
+            size = reader.total_size - offset
+        if size < header:
+            return None
+        if kind == b"moov":
+            moov = reader.read(offset, size)
+            return _parse_moov(moov, header) if moov is not None else None
+        offset += size
+
+
+def _parse_moov(moov, header):
+    duration = width = height = None
+    for kind, start, end in _mp4_boxes(moov, header):
+        if kind == b"mvhd" and end - start >= 32:
+            if moov[start] == 1:
+                timescale, length = struct.unpack(">IQ", moov[start + 20:start + 32])
+            else:
+                timescale, length = struct.unpack(">II", moov[start + 12:start + 20])
+            if timescale and length not in (0, 0xFFFFFFFF, 0xFFFFFFFFFFFFFFFF):
+                duration = length / timescale
+        elif kind == b"trak":
+            for child, child_start, child_end in _mp4_boxes(moov, start, end):
+                if child != b"tkhd":
+                    continue
+                size_at = child_start + (88 if moov[child_start] == 1 else 76)
+                if size_at + 8 > child_end:
+                    continue
+                track_width, track_height = (value >> 16 for value in struct.unpack(">II", moov[size_at:size_at + 8]))
+                if track_width * track_height > (width or 0) * (height or 0):  # Audio tracks are 0x0
+                    width, height = track_width, track_height
+    return {"duration": duration, "width": width, "height": height}
+
+
+def _ebml_vint(reader, offset, keep_marker=False):
+    """(value, length) of the variable-size integer at offset; value is None for an unknown size."""
+    first = reader.read(offset, 1)
+    if first is None or first[0] == 0:
+        return None
+    length = 9 - first[0].bit_length()
+    data = reader.read(offset, length)
+    if data is None:
+        return None
+    value = int.from_bytes(data, "big")
+    if keep_marker:
+        return value, length
+    value &= (1 << (7 * length)) - 1
+    return (None if value == (1 << (7 * length)) - 1 else value), length
+
+
+def _ebml_children(reader, start, end, budget):
+    """(id, payload offset, payload size) of the elements from start to end (None: the rest of the file)."""
+    offset = start
+    while (end is None or offset < end) and budget[0] > 0:
+        budget[0] -= 1
+        element = _ebml_vint(reader, offset, keep_marker=True)
+        if element is None:
+            return
+        size = _ebml_vint(reader, offset + element[1])
+        if size is None:
+            return
+        payload = offset + element[1] + size[1]
+        yield element[0], payload, size[0]
+        if size[0] is None:  # Unknown size: only the caller descending into it can go on
+            return
+        offset = payload + size[0]
+
+
+def _ebml_uint(reader, offset, size):
+    data = reader.read(offset, size) if size and size <= 8 else None
+    return int.from_bytes(data, "big") if data else None
+
+
+def _webm_metadata(reader):
+    budget = [MAX_EBML_ELEMENTS]
+    result = {"duration": None, "width": None, "height": None}
+    for element, offset, size in _ebml_children(reader, 0, None, budget):
+        if element != 0x18538067:  # Segment
+            continue
+        timecode_scale, duration = 1000000, None
+        segment_end = offset + size if size is not None else None
+        for child, child_offset, child_size in _ebml_children(reader, offset, segment_end, budget):
+            if child == 0x1F43B675 or child_size is None:  # Cluster: the media data begins
+                break
+            if child == 0x1549A966:  # Info
+                for field, field_offset, field_size in _ebml_children(reader, child_offset, child_offset + child_size, budget):
+                    if field == 0x2AD7B1:
+                        timecode_scale = _ebml_uint(reader, field_offset, field_size) or timecode_scale
+                    elif field == 0x4489 and field_size in (4, 8):
+                        data = reader.read(field_offset, field_size)
+                        if data is not None:
+                            duration = struct.unpack(">f" if field_size == 4 else ">d", data)[0]
+            elif child == 0x1654AE6B:  # Tracks
+                for entry, entry_offset, entry_size in _ebml_children(reader, child_offset, child_offset + child_size, budget):
+                    if entry != 0xAE or entry_size is None:
+                        continue
+                    for field, field_offset, field_size in _ebml_children(reader, entry_offset, entry_offset + entry_size, budget):
+                        if field != 0xE0 or field_size is None:  # Video settings
+                            continue
+                        for video, video_offset, video_size in _ebml_children(reader, field_offset, field_offset + field_size, budget):
+                            if video == 0xB0:
+                                result["width"] = _ebml_uint(reader, video_offset, video_size)
+                            elif video == 0xBA:
+                                result["height"] = _ebml_uint(reader, video_offset, video_size)
+            if duration is not None and result["width"]:
+                break
+        if duration:
+            result["duration"] = duration * timecode_scale / 1e9
+        return result
+    return result
+
+
+def parse_media_header(data, total_size=None, fetch=None):
+    """
+    {"format", "width", "height", "duration"} from the first bytes of a file. fetch(start, length),
+    if given, supplies later parts of the file when the header continues past data.
+    """
+    result = {"format": None, "width": None, "height": None, "duration": None}
+    reader = _RangeReader(data, total_size, fetch)
+    dimensions = None
+    if data[:3] == b"\xff\xd8\xff":
+        result["format"] = "jpeg"
+        dimensions = _jpeg_dimensions(reader)
+    elif data[:8] == b"\x89PNG\r\n\x1a\n":
+        result["format"] = "png"
+        if data[12:16] == b"IHDR":
+            dimensions = struct.unpack(">II", data[16:24])
+    elif data[:6] in (b"GIF87a", b"GIF89a"):
+        result["format"] = "gif"
+        dimensions = struct.unpack("<HH", data[6:10])
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        result["format"] = "webp"
+        dimensions = _webp_dimensions(data)
+    elif data[4:8] in (b"ftyp", b"moov", b"wide", b"free", b"mdat"):
+        result["format"] = "mp4"
+        result.update(_mp4_moov(reader) or {})
+    elif data[:4] == b"\x1a\x45\xdf\xa3":
+        result["format"] = "webm"
+        result.update(_webm_metadata(reader))
+    if dimensions:
+        result["width"], result["height"] = dimensions
+    return result
+
+
+def _parse_into(result, data, total, fetch=None):
+    """Adds what the header tells to result; a truncated or malformed header leaves it as it is (size included)."""
+    try:
+        result.update(parse_media_header(data, total, fetch))
+    except (struct.error, ValueError, IndexError, OverflowError):
+        pass
+
+
+def _probe(url, headers, timeout):
+    status, data, _, total = _get_range(url, 0, _probe_bytes, headers, timeout)
+    result = {"size_bytes": total, "format": None, "width": None, "height": None, "duration": None}
+    if status == 416:
+        return result
+    if status != 206 or not data:
+        # Without range support only what the first _probe_bytes hold can be read
+        _parse_into(result, data, total)
+        return result
+
+    def fetch(start, length):
+        if deadline_expired():
+            return b""
+        try:
+            status, window, first, _ = _get_range(url, start, length, headers, timeout)
+        except requests.exceptions.RequestException:
+            return b""
+        return window if status == 206 and first == start else b""
+
+    _parse_into(result, data, total, fetch)
+    return result
+
+
+def probe_media(url, timeout=5, headers=None):
+    """
+    Size and media metadata of a remote file (see the module comment), cached per URL.
+    Returns None if the probe failed or the active request deadline has run out.
+    """
+    if not url:
+        return None
+    cached = _cached(url)
+    if cached is not None:
+        return cached
+    if deadline_expired():  # The metadata is optional; don't spend time the search doesn't have
+        return None
+    try:
+        result, _ = singleflight.do(("media_probe", url), lambda: _probe(url, headers, timeout))
+    except (requests.exceptions.RequestException, ValueError):  # ValueError: a malformed Content-Length
+        return None
+    _store(url, result)
+    return result
+
+
+def remote_file_size(url, timeout=5, headers=None):
+    """Size in bytes of a remote file, or None if it can't be determined (probe_media's size_bytes)."""
+    probe = probe_media(url, timeout=timeout, headers=headers)
+    return probe["size_bytes"] if probe else None
+
+
+def probe_metadata(probe):
+    """The width/height/duration of a probe that are known, as MediaItem extras."""
+    if not probe:
+        return {}
+    return {key: probe[key] for key in ("width", "height", "duration") if probe.get(key)}
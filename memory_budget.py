@@ -0,0 +1,169 @@
+import gc
+import os
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource  # POSIX only
+except ImportError:
+    resource = None
+
+# Memory instrumentation and a soft memory budget for long batch runs.
+# MemoryTracker takes a tracemalloc snapshot around each stage and reports which source lines
+# grew the most; it is opt-in (--trace_memory) because tracing slows Python down noticeably.
+# MemoryBudget watches the process RSS and tells the batch runner how many listings it may
+# run at once: full concurrency well under the budget, fewer as RSS approaches it, and one
+# at a time (after a gc pass) once it is reached. On a 512 MB instance that keeps a long run
+# from stacking several large responses in memory at the moment it is closest to the limit.
+# Direct-mode runs bracket each (sequential) platform search with it too, which gets them the
+# RSS check and the gc pass once over budget.
+
+DEFAULT_SOFT_FRACTION = 0.8  # Start throttling at this fraction of the budget
+TRACEMALLOC_FRAMES = 1
+REPORT_TOP_LINES = 10
+THROTTLE_POLL_SECONDS = 0.2
+GC_MIN_INTERVAL = 5  # seconds between forced collections while over budget
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss_bytes():
+    """Resident set size of this process in bytes, or None where it can't be read cheaply."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        return peak_rss_bytes()  # Best available approximation (macOS and other non-Linux POSIX)
+    return None
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process in bytes, or None on platforms without `resource`."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+def format_mb(size_bytes):
+    return "n/a" if size_bytes is None else f"{size_bytes / (1024 * 1024):.1f} MB"
+
+
+class MemoryTracker:
+    """Per-stage tracemalloc snapshots; a disabled tracker makes stage() a no-op."""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._stages = {}  # stage -> [calls, net bytes, peak traced bytes, Counter-like {line: bytes}]
+        if enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def stage(self, name):
+        return _TrackedStage(self, name)
+
+    def _record(self, name, before, after, peak):
+        entry = self._stages.setdefault(name, [0, 0, 0, {}])
+        entry[0] += 1
+        entry[2] = max(entry[2], peak)
+        for stat in after.compare_to(before, "lineno"):
+            entry[1] += stat.size_diff
+            if stat.size_diff > 0:
+                key = str(stat.traceback[0])
+                entry[3][key] = entry[3].get(key, 0) + stat.size_diff
+
+    def report(self):
+        """Text report: net allocation growth and peak traced memory per stage, with the top lines."""
+        if not self.enabled:
+            return ""
+        lines = []
+        for name, (calls, net, peak, by_line) in sorted(self._stages.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"{name}: {calls} call(s), net {net / 1024:+.1f} KiB, peak traced {format_mb(peak)}")
+            for where, size in sorted(by_line.items(), key=lambda kv: -kv[1])[:REPORT_TOP_LINES]:
+                lines.append(f"    {size / 1024:+10.1f} KiB  {where}")
+        return "\n".join(lines)
+
+
+class _TrackedStage:
+    def __init__(self, tracker, name):
+        self.tracker = tracker
+        self.name = name
+        self.before = None
+
+    def __enter__(self):
+        if self.tracker.enabled:
+            tracemalloc.reset_peak()
+            self.before = tracemalloc.take_snapshot()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.tracker.enabled:
+            _, peak = tracemalloc.get_traced_memory()
+            self.tracker._record(self.name, self.before, tracemalloc.take_snapshot(), peak)
+            self.before = None
+        return False
+
+
+class MemoryBudget:
+    """
+    Soft RSS budget for a batch run. acquire()/release() bracket one unit of concurrent work
+    (a platform listing); acquire() blocks while the allowed concurrency is used up.
+    """
+
+    def __init__(self, limit_bytes=None, max_concurrency=4, soft_fraction=DEFAULT_SOFT_FRACTION):
+        self.limit_bytes = limit_bytes
+        self.max_concurrency = max(1, max_concurrency)
+        self.soft_fraction = soft_fraction
+        self._active = 0
+        self._cond = threading.Condition()
+        self._throttled = False
+        self._last_gc = 0
+
+    def allowed_concurrency(self):
+        if not self.limit_bytes:
+            return self.max_concurrency
+        rss = current_rss_bytes()
+        if rss is None:
+            return self.max_concurrency
+        soft_limit = self.limit_bytes * self.soft_fraction
+        if rss < soft_limit:
+            allowed = self.max_concurrency
+        elif rss >= self.limit_bytes:
+            allowed = 1
+        else:
+            headroom = (self.limit_bytes - rss) / (self.limit_bytes - soft_limit)
+            allowed = max(1, int(self.max_concurrency * headroom))
+        throttled = allowed < self.max_concurrency
+        if throttled != self._throttled:
+            self._throttled = throttled
+            if throttled:
+                print(f"Memory: RSS {format_mb(rss)} close to the {format_mb(self.limit_bytes)} budget, "
+                      f"running at most {allowed} listing(s) at once")
+            else:
+                print(f"Memory: RSS back to {format_mb(rss)}, full listing concurrency restored")
+        if rss >= self.limit_bytes and time.monotonic() - self._last_gc >= GC_MIN_INTERVAL:
+            self._last_gc = time.monotonic()
+            gc.collect()
+        return allowed
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self.allowed_concurrency():
+                self._cond.wait(THROTTLE_POLL_SECONDS)
+            self._active += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
@@ -2,23 +2,14 @@ import requests
 from bs4 import BeautifulSoup
 import os
 import argparse
-import json
+import json_backend
 import re # For extracting JSON from script tags
-
-# Attempt to import the helper function. If this script is run standalone, this might fail.
-try:
-    from media_downloader_tool import get_remote_file_size
-except ImportError:
-    # Fallback for standalone execution or if media_downloader_tool is not in PYTHONPATH
-    def get_remote_file_size(url, timeout=5):
-        # print(f"Warning: Using fallback get_remote_file_size for {url}")
-        try:
-            response = requests.head(url, timeout=timeout, allow_redirects=True)
-            response.raise_for_status()
-            content_length = response.headers.get('Content-Length')
-            return int(content_length) if content_length else None
-        except Exception: # Broad exception for fallback
-            return None
+from media_item import MediaItem
+from profiling import add_profile_arguments, profiler_from_args
+from download_utils import save_response
+from output_layout import output_path
+from media_library import record_item as record_library_item
+from media_probe import probe_media, probe_metadata
 
 MIXKIT_BASE_URL = "https://mixkit.co"
 # Search URL structure: https://mixkit.co/free-stock-video/search/?q=nature
@@ -26,21 +17,20 @@ MIXKIT_BASE_URL = "https://mixkit.co"
 DEFAULT_DOWNLOAD_TIMEOUT = 20  # seconds
 DEFAULT_REQUEST_TIMEOUT = 15 # seconds
 
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z',
+    'Referer': MIXKIT_BASE_URL
+}
+
 def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT):
     """Downloads a file from a URL into a specified folder with a timeout."""
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
-    headers = {
-        'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z',
-        'Referer': MIXKIT_BASE_URL
-    }
     try:
-        response = requests.get(url, stream=True, headers=headers, timeout=timeout)
+        response = requests.get(url, stream=True, headers=DOWNLOAD_HEADERS, timeout=timeout)
         response.raise_for_status()
-        file_path = os.path.join(folder_name, file_name)
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        file_path = output_path(folder_name, file_name)
+        save_response(response, file_path, "mixkit")
         print(f"Downloaded {file_name} to {folder_name}")
         return file_path
     except requests.exceptions.Timeout:
@@ -85,17 +75,17 @@ def list_mixkit_videos(query, list_limit=25, request_timeout=DEFAULT_REQUEST_TIM
     # Mixkit (Oct 2023) uses a <script id="__NEXT_DATA__" type="application/json"> tag
     # which contains a lot of page data, including items for lists.
 
+    items_list = None
     next_data_script = soup.find('script', id='__NEXT_DATA__', type='application/json')
     if next_data_script:
         try:
-            page_data = json.loads(next_data_script.string)
+            page_data = json_backend.loads(next_data_script.string)
             # The exact path to items can be deeply nested and might change.
             # Example path: page_data['props']['pageProps']['initialItems']['data'] (if on a search results page)
             # or page_data['props']['pageProps']['items']['data']
             # or page_data['props']['pageProps']['tag']['items']['data'] (if on a tag page)
             # Need to find the right path. Let's try a few common ones or look for a list of items.
 
-            items_list = None
             if 'props' in page_data and 'pageProps' in page_data['props']:
                 page_props = page_data['props']['pageProps']
                 if 'initialItems' in page_props and isinstance(page_props['initialItems'], dict) and 'data' in page_props['initialItems']:
@@ -149,21 +139,24 @@ def list_mixkit_videos(query, list_limit=25, request_timeout=DEFAULT_REQUEST_TIM
                     if size_bytes is None and 'metadata' in item_data and item_data['metadata'].get('size_bytes'):
                         size_bytes = item_data['metadata']['size_bytes']
 
-                    if size_bytes is None: # Fallback to HEAD request if not in JSON
-                        size_bytes = get_remote_file_size(video_url, timeout=request_timeout)
-
-                    found_items.append({
-                        "id": item_id,
-                        "title": title,
-                        "url": video_url,
-                        "type": "video",
-                        "filename": final_filename,
-                        "platform": "mixkit",
-                        "preview_image_url": preview_image_url,
-                        "description": item_data.get("description_text", item_data.get("description", "")),
-                        "size_bytes": size_bytes
-                    })
-        except (json.JSONDecodeError, KeyError, TypeError) as e:
+                    probe = None
+                    if size_bytes is None: # Fallback to a ranged probe if not in JSON (also gives duration and resolution)
+                        probe = probe_media(video_url, timeout=request_timeout, headers=DOWNLOAD_HEADERS)
+                        size_bytes = probe["size_bytes"] if probe else None
+
+                    found_items.append(MediaItem(
+                        id=item_id,
+                        title=title,
+                        url=video_url,
+                        type="video",
+                        filename=final_filename,
+                        platform="mixkit",
+                        preview_image_url=preview_image_url,
+                        description=item_data.get("description_text", item_data.get("description", "")),
+                        size_bytes=size_bytes,
+                        **probe_metadata(probe)
+                    ))
+        except (json_backend.JSONDecodeError, KeyError, TypeError) as e:
             print(f"Error parsing Mixkit JSON data from <script id='__NEXT_DATA__'>: {e}")
             # Fallback to HTML parsing if JSON fails or doesn't yield results
             found_items = [] # Clear items if JSON parsing failed partway
@@ -185,14 +178,17 @@ def list_mixkit_videos(query, list_limit=25, request_timeout=DEFAULT_REQUEST_TIM
 
 
     status_msg = None
+    structure_changed = False # Tells the circuit breaker the page no longer looks like we expect
     if not next_data_script:
         status_msg = f"Mixkit: Could not find __NEXT_DATA__ script tag for '{query[:50]}'. Site structure may have changed."
+        structure_changed = True
     elif not items_list: # If next_data_script was found, but items_list remained None
         status_msg = f"Mixkit: Found __NEXT_DATA__ but failed to locate items list within it for '{query[:50]}'."
+        structure_changed = True
     elif not found_items: # If items_list was processed but no valid items were extracted
         status_msg = f"Mixkit: No suitable video items extracted from __NEXT_DATA__ for '{query[:50]}'."
 
-    return {"items": found_items[:list_limit], "error": None, "status_message": status_msg}
+    return {"items": found_items[:list_limit], "error": None, "status_message": status_msg, "structure_changed": structure_changed}
 
 
 def search_mixkit_videos(query, limit=5, output_dir="mixkit_media", request_timeout=DEFAULT_REQUEST_TIMEOUT, download_timeout=DEFAULT_DOWNLOAD_TIMEOUT, **kwargs):
@@ -221,6 +217,7 @@ def search_mixkit_videos(query, limit=5, output_dir="mixkit_media", request_time
         download_path = download_file(item['url'], output_dir, item['filename'], timeout=download_timeout)
         if download_path:
             downloaded_files.append(download_path)
+            record_library_item(item, download_path, query)
 
     return downloaded_files
 
@@ -233,18 +230,22 @@ if __name__ == "__main__":
     parser.add_argument("--request_timeout", type=int, default=DEFAULT_REQUEST_TIMEOUT, help="Timeout for fetching HTML page in seconds.")
     parser.add_argument("--download_timeout", type=int, default=DEFAULT_DOWNLOAD_TIMEOUT, help="Timeout for file downloads in seconds.")
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
 
     print(f"Searching Mixkit (scraping) for '{args.query}' videos and downloading up to {args.limit} items to '{args.output_dir}'...")
-    downloaded = search_mixkit_videos(
-        args.query,
-        args.limit,
-        args.output_dir,
-        request_timeout=args.request_timeout,
-        download_timeout=args.download_timeout
-    )
+    with profiler.stage("search+download"):
+        downloaded = search_mixkit_videos(
+            args.query,
+            args.limit,
+            args.output_dir,
+            request_timeout=args.request_timeout,
+            download_timeout=args.download_timeout
+        )
     if downloaded:
         print(f"Mixkit: Successfully downloaded {len(downloaded)} videos via scraping.")
     else:
         print("Mixkit: No videos downloaded via scraping.")
     print("Mixkit video download process complete.")
+    profiler.write_report()
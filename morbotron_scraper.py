@@ -1,43 +1,35 @@
 import requests
 import os
 import argparse
-import json
-# Attempt to import the helper function. If this script is run standalone, this might fail.
-try:
-    from media_downloader_tool import get_remote_file_size
-except ImportError:
-    # Fallback for standalone execution or if media_downloader_tool is not in PYTHONPATH
-    def get_remote_file_size(url, timeout=5):
-        # print(f"Warning: Using fallback get_remote_file_size for {url}")
-        try:
-            response = requests.head(url, timeout=timeout, allow_redirects=True)
-            response.raise_for_status()
-            content_length = response.headers.get('Content-Length')
-            return int(content_length) if content_length else None
-        except Exception: # Broad exception for fallback
-            return None
+from hedging import hedged_get
+from media_item import MediaItem
+from profiling import add_profile_arguments, profiler_from_args
+from json_backend import JSONDecodeError, response_json
+from download_utils import save_response
+from output_layout import output_path
+from media_library import record_item as record_library_item
+from media_probe import probe_media, probe_metadata
 
 MORBOTRON_SEARCH_API_URL = "https://morbotron.com/api/search"
 MORBOTRON_IMAGE_URL_TEMPLATE = "https://morbotron.com/img/{episode}/{timestamp}.jpg"
 DEFAULT_DOWNLOAD_TIMEOUT = 10 # seconds
 
+DOWNLOAD_HEADERS = { # Morbotron might require a common User-Agent
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
 def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT):
     """Downloads a file from a URL into a specified folder with a timeout."""
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
 
-    headers = { # Morbotron might require a common User-Agent
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
     try:
-        response = requests.get(url, stream=True, headers=headers, timeout=timeout)
+        response = requests.get(url, stream=True, headers=DOWNLOAD_HEADERS, timeout=timeout)
         response.raise_for_status()
 
-        file_path = os.path.join(folder_name, file_name)
+        file_path = output_path(folder_name, file_name)
 
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        save_response(response, file_path, "morbotron")
         print(f"Downloaded {file_name} to {folder_name}")
         return file_path
     except requests.exceptions.Timeout:
@@ -80,6 +72,7 @@ def search_morbotron(query, limit=5, output_dir="morbotron_media", media_type="i
         dl_path = download_file(item_to_dl['url'], output_dir, item_to_dl['filename'], timeout=download_timeout)
         if dl_path:
             downloaded_paths.append(dl_path)
+            record_library_item(item_to_dl, dl_path, query)
     return downloaded_paths
 
 
@@ -101,16 +94,16 @@ def list_morbotron_media(query, limit=25, media_type="image", api_timeout=DEFAUL
     }
 
     try:
-        response = requests.get(MORBOTRON_SEARCH_API_URL, params=params, headers=headers, timeout=api_timeout)
+        response = hedged_get("morbotron", MORBOTRON_SEARCH_API_URL, params=params, headers=headers, timeout=api_timeout)
         response.raise_for_status()
-        results = response.json()
+        results = response_json(response)
     except requests.exceptions.Timeout:
-        print(f"Timeout during Morbotron API request for query: {query}")
-        return []
+        # print(f"Timeout during Morbotron API request for query: {query}")
+        return {"items": [], "error": f"Morbotron: API timeout for '{query[:50]}'", "status_message": None}
     except requests.exceptions.RequestException as e:
         # print(f"API request error for Morbotron query '{query}': {e}")
         return {"items": [], "error": f"Morbotron: API request error for '{query[:50]}': {e}", "status_message": None}
-    except json.JSONDecodeError:
+    except JSONDecodeError:
         # print(f"Error decoding JSON from Morbotron: {response.text if 'response' in locals() else 'No response text'}")
         return {"items": [], "error": f"Morbotron: Error decoding API response for '{query[:50]}'", "status_message": None}
     except Exception as e: # Catch other potential errors
@@ -138,20 +131,21 @@ def list_morbotron_media(query, limit=25, media_type="image", api_timeout=DEFAUL
 
         image_url = MORBOTRON_IMAGE_URL_TEMPLATE.format(episode=episode, timestamp=timestamp)
         file_extension = ".jpg"
-        size_bytes = get_remote_file_size(image_url, timeout=api_timeout) # Use api_timeout for HEAD request
+        probe = probe_media(image_url, timeout=api_timeout, headers=DOWNLOAD_HEADERS) # Size and dimensions from the first bytes
 
         title = f"Morbotron Screencap - S{episode} T{timestamp}" # Example title
         file_name = f"morbotron_{smart_query_name_base}_{episode}_{timestamp}{file_extension}"
 
-        found_items.append({
-            "id": f"{episode}_{timestamp}", # Unique ID for Morbotron item
-            "title": title,
-            "url": image_url,
-            "type": "image", # Morbotron is always image
-            "filename": file_name,
-            "platform": "morbotron",
-            "size_bytes": size_bytes
-        })
+        found_items.append(MediaItem(
+            id=f"{episode}_{timestamp}", # Unique ID for Morbotron item
+            title=title,
+            url=image_url,
+            type="image", # Morbotron is always image
+            filename=file_name,
+            platform="morbotron",
+            size_bytes=probe["size_bytes"] if probe else None,
+            **probe_metadata(probe)
+        ))
 
     return {"items": found_items, "error": None, "status_message": None if found_items else f"Morbotron: No items extracted for '{query[:50]}'"}
 
@@ -165,12 +159,15 @@ if __name__ == "__main__":
     parser.add_argument("--api_timeout", type=int, default=DEFAULT_API_TIMEOUT, help="Timeout for API calls in seconds.")
     parser.add_argument("--download_timeout", type=int, default=DEFAULT_DOWNLOAD_TIMEOUT, help="Timeout for file downloads in seconds.")
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
 
     # Test listing
     print(f"\n--- Listing Morbotron for '{args.query}' (limit: {args.limit}) ---")
     # Note: list_morbotron_media's media_type param is mainly for the check, actual API doesn't filter by it.
-    list_result = list_morbotron_media(args.query, args.limit, args.media_type, args.api_timeout)
+    with profiler.stage("list"):
+        list_result = list_morbotron_media(args.query, args.limit, args.media_type, args.api_timeout)
     if list_result.get("error"):
         print(f"Error listing: {list_result['error']}")
     elif not list_result.get("items") and list_result.get("status_message"):
@@ -214,17 +211,19 @@ if __name__ == "__main__":
         return downloaded_paths_list
 
     # Now call the refactored version for testing
-    downloaded_paths = search_morbotron_refactored(
-        args.query,
-        args.limit,
-        args.output_dir,
-        args.media_type,
-        api_timeout_param=args.api_timeout,
-        download_timeout_param=args.download_timeout
-    )
+    with profiler.stage("search+download"):
+        downloaded_paths = search_morbotron_refactored(
+            args.query,
+            args.limit,
+            args.output_dir,
+            args.media_type,
+            api_timeout_param=args.api_timeout,
+            download_timeout_param=args.download_timeout
+        )
 
     if downloaded_paths:
         print(f"Morbotron: Successfully downloaded {len(downloaded_paths)} files.")
     # else: search_morbotron_refactored prints its own status/errors.
 
     print("\nMorbotron CLI test process complete.")
+    profiler.write_report()
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import json_backend
+
+# Where a download goes inside its platform directory.
+# The default "flat" layout puts every file of a query/platform straight into that directory,
+# which a long-running harvest turns into hundreds of thousands of entries; lookups, listings
+# and os.path.exists() checks then get slow. With the "sharded" layout a file goes two levels
+# down, under the first hex digits of the SHA-1 of its filename:
+#   downloaded_media/cats/giphy/3f/a2/giphy_cats_abc123.mp4
+# (256 x 256 directories, a few dozen files each at a million files). The mapping depends on
+# the filename only, so it is stable across runs and processes.
+#
+# A directory's layout is fixed by the .layout.json written next to its files when the first
+# sharded download lands there; later runs keep to it whatever --layout they use. Complete files
+# are recorded by save_response() in an index (.layout_index.sqlite3: directory and filename ->
+# relative path and size). There is one index for the whole output root passed to
+# configure_output_layout(), so a harvest with thousands of query folders doesn't hold a
+# database open per folder; sharded directories outside the root get their own index. Each
+# thread keeps at most MAX_OPEN_INDEXES connections. locate() looks a filename up in the index,
+# then at the computed shard path, then at the flat path (files from before the switch), so the
+# skip-existing check and the web app's /downloads route never list a directory.
+
+LAYOUTS = ("flat", "sharded")
+DEFAULT_LAYOUT = "flat"
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2  # Hex digits per level
+LAYOUT_FILE = ".layout.json"
+INDEX_NAME = ".layout_index.sqlite3"
+MAX_OPEN_INDEXES = 4  # Per thread; the least recently used connection is closed beyond this
+
+_layout = DEFAULT_LAYOUT
+_index_root = None  # Directory holding the shared index, see configure_output_layout()
+_descriptors = {}  # abs directory -> its .layout.json contents (only sharded ones are cached)
+_descriptor_lock = threading.Lock()
+_local = threading.local()
+
+
+def configure_output_layout(layout=DEFAULT_LAYOUT, root=None):
+    """Sets the layout for directories that don't have one yet, and the output root whose index they share."""
+    global _layout, _index_root
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown output layout '{layout}' (expected one of {', '.join(LAYOUTS)})")
+    _layout = layout
+    _index_root = os.path.abspath(root) if root else None
+
+
+def is_layout_file(name):
+    """True for the layout's bookkeeping files (descriptor, index and its WAL/SHM files)."""
+    return name == LAYOUT_FILE or name.startswith(INDEX_NAME)
+
+
+def shard_subdir(filename, levels=SHARD_LEVELS, width=SHARD_WIDTH):
+    """Relative shard directory of a filename, e.g. '3f/a2'."""
+    digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()
+    return "/".join(digest[level * width:(level + 1) * width] for level in range(levels))
+
+
+def _descriptor(directory):
+    """The directory's .layout.json, or None if it has none (flat)."""
+    directory = os.path.abspath(directory)
+    descriptor = _descriptors.get(directory)
+    if descriptor is not None:
+        return descriptor
+    try:
+        with open(os.path.join(directory, LAYOUT_FILE), "r", encoding="utf-8") as f:
+            descriptor = json_backend.loads(f.read())
+    except (OSError, ValueError):
+        return None  # Not cached: another process may shard the directory later
+    if not isinstance(descriptor, dict) or descriptor.get("layout") != "sharded":
+        return None
+    _descriptors[directory] = descriptor
+    return descriptor
+
+
+def _create_descriptor(directory):
+    directory = os.path.abspath(directory)
+    with _descriptor_lock:
+        descriptor = _descriptor(directory)
+        if descriptor is not None:
+            return descriptor
+        descriptor = {"layout": "sharded", "levels": SHARD_LEVELS, "width": SHARD_WIDTH, "hash": "sha1"}
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f"{LAYOUT_FILE}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json_backend.dumps(descriptor))
+        try:
+            os.link(tmp_path, os.path.join(directory, LAYOUT_FILE))  # Fails if another process got there first
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    return _descriptor(directory)
+
+
+def _sharded_path(directory, filename, descriptor):
+    return os.path.join(directory, *shard_subdir(filename, descriptor["levels"], descriptor["width"]).split("/"), filename)
+
+
+def output_path(directory, filename):
+    """Path a download of filename into directory should be written to (shard directories are created)."""
+    descriptor = _descriptor(directory)
+    if descriptor is None and _layout == "sharded":
+        descriptor = _create_descriptor(directory)
+    if descriptor is None:
+        return os.path.join(directory, filename)
+    path = _sharded_path(directory, filename, descriptor)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def _layout_root(path):
+    """(sharded directory, filename) that path belongs to, or (None, filename) for a flat file."""
+    directory, filename = os.path.split(os.path.abspath(path))
+    if _descriptor(directory) is not None:
+        return directory, filename  # A flat file inside a sharded directory
+    root = directory
+    for _ in range(SHARD_LEVELS):
+        root = os.path.dirname(root)
+    descriptor = _descriptor(root)
+    if descriptor is not None and os.path.abspath(_sharded_path(root, filename, descriptor)) == os.path.abspath(path):
+        return root, filename
+    return None, filename
+
+
+def _index_dir(directory):
+    """Directory whose index covers a sharded directory: the output root if it is inside it, else itself."""
+    directory = os.path.abspath(directory)
+    if _index_root is not None:
+        try:
+            if os.path.commonpath([_index_root, directory]) == _index_root:
+                return _index_root
+        except ValueError:  # Different drives
+            pass
+    return directory
+
+
+def _index(index_dir):
+    """This thread's connection to the index in index_dir (created on first use)."""
+    connections = getattr(_local, "connections", None)
+    if connections is None or getattr(_local, "pid", None) != os.getpid():
+        connections = _local.connections = OrderedDict()
+        _local.pid = os.getpid()
+    connection = connections.get(index_dir)
+    if connection is not None:
+        connections.move_to_end(index_dir)
+        return connection
+    connection = sqlite3.connect(os.path.join(index_dir, INDEX_NAME), timeout=10)
+    try:
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS layout_files (directory TEXT NOT NULL, name TEXT NOT NULL,"
+                           " path TEXT NOT NULL, size INTEGER, indexed_at REAL, PRIMARY KEY (directory, name))")
+    except sqlite3.Error:
+        connection.close()
+        raise
+    connections[index_dir] = connection
+    while len(connections) > MAX_OPEN_INDEXES:
+        connections.popitem(last=False)[1].close()
+    return connection
+
+
+def _relative(path, index_dir):
+    return os.path.relpath(os.path.abspath(path), index_dir).replace(os.sep, "/")
+
+
+def index_file(path, size=None):
+    """Records a completed file in its sharded directory's index (no-op for flat directories)."""
+    root, filename = _layout_root(path)
+    if root is None:
+        return
+    try:
+        if size is None:
+            size = os.path.getsize(path)
+        index_dir = _index_dir(root)
+        connection = _index(index_dir)
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO layout_files (directory, name, path, size, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                               (_relative(root, index_dir), filename, _relative(path, index_dir), size, time.time()))
+    except (OSError, sqlite3.Error) as e:
+        print(f"Layout: could not index {path}: {e}")
+
+
+def locate(directory, filename):
+    """Path of filename under directory if it has been downloaded there (whatever the layout), else None."""
+    if not filename or filename in (".", "..") or os.path.basename(filename) != filename:
+        return None
+    descriptor = _descriptor(directory)
+    flat_path = os.path.join(directory, filename)
+    if descriptor is None:
+        return flat_path if os.path.exists(flat_path) else None
+    index_dir = _index_dir(directory)
+    key = (_relative(directory, index_dir), filename)
+    try:
+        connection = _index(index_dir)
+        row = connection.execute("SELECT path FROM layout_files WHERE directory = ? AND name = ?", key).fetchone()
+        if row:
+            path = os.path.join(index_dir, *row[0].split("/"))
+            if os.path.exists(path):
+                return path
+            with connection:  # Evicted or deleted since
+                connection.execute("DELETE FROM layout_files WHERE directory = ? AND name = ?", key)
+    except sqlite3.Error as e:
+        print(f"Layout: index lookup failed in {directory}: {e}")
+    for path in (_sharded_path(directory, filename, descriptor), flat_path):
+        if os.path.exists(path):
+            index_file(path)
+            return path
+    return None
@@ -1,28 +1,37 @@
 import requests
 import os
 import argparse
-import json
+from hedging import hedged_get
+from media_item import MediaItem
+from profiling import add_profile_arguments, profiler_from_args
+from json_backend import JSONDecodeError, response_json
+from renditions import add_size_limit_arguments, rendition, rendition_suffix, select_rendition, size_limits_from_args
+from download_utils import save_response
+from output_layout import output_path
+from media_library import record_item as record_library_item
 
 PIXABAY_API_URL = "https://pixabay.com/api/videos/"
 # Attempt to get API key from environment variable, otherwise use placeholder
 PIXABAY_API_KEY = os.environ.get("PIXABAY_API_KEY", "YOUR_PIXABAY_API_KEY_HERE")
+# Poster frame for a video, built from the hit's picture_id (used when renditions carry no thumbnail)
+PIXABAY_POSTER_URL_TEMPLATE = "https://i.vimeocdn.com/video/{picture_id}_295x166.jpg"
 DEFAULT_DOWNLOAD_TIMEOUT = 15  # seconds
+PIXABAY_VIDEO_RENDITIONS = ("medium", "large", "small", "tiny")  # Order of preference when no size limits are given
+
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z'
+}
 
 def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT):
     """Downloads a file from a URL into a specified folder with a timeout."""
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
 
-    headers = {
-        'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z'
-    }
     try:
-        response = requests.get(url, stream=True, headers=headers, timeout=timeout)
+        response = requests.get(url, stream=True, headers=DOWNLOAD_HEADERS, timeout=timeout)
         response.raise_for_status()
-        file_path = os.path.join(folder_name, file_name)
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        file_path = output_path(folder_name, file_name)
+        save_response(response, file_path, "pixabay")
         print(f"Downloaded {file_name} to {folder_name}")
         return file_path
     except requests.exceptions.Timeout:
@@ -32,10 +41,12 @@ def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT)
         print(f"Error downloading {url} to {file_name}: {e}")
         return None
 
-def list_pixabay_videos(query, list_limit=25, api_timeout=10, **kwargs):
+def list_pixabay_videos(query, list_limit=25, api_timeout=10, size_limits=None, **kwargs):
     """
     Searches Pixabay for videos and returns a list of item details.
     kwargs may include 'media_type' but Pixabay video endpoint is specific.
+    size_limits (renditions.make_size_limits) choose among large/medium/small/tiny per video;
+    the one used is recorded as the item's 'rendition'.
     """
     if PIXABAY_API_KEY == "YOUR_PIXABAY_API_KEY_HERE":
         print("Pixabay API key is not set. Please set it in pixabay_downloader.py.")
@@ -51,16 +62,16 @@ def list_pixabay_videos(query, list_limit=25, api_timeout=10, **kwargs):
     }
 
     try:
-        response = requests.get(PIXABAY_API_URL, params=params, timeout=api_timeout)
+        response = hedged_get("pixabay", PIXABAY_API_URL, params=params, timeout=api_timeout)
         response.raise_for_status()
-        data = response.json()
+        data = response_json(response)
     except requests.exceptions.Timeout:
-        print(f"Timeout during Pixabay API request for query: {query}")
-        return []
+        # print(f"Timeout during Pixabay API request for query: {query}")
+        return {"items": [], "error": f"Pixabay: API timeout for '{query[:50]}'", "status_message": None}
     except requests.exceptions.RequestException as e:
         # print(f"API request error for Pixabay query '{query}': {e}")
         return {"items": [], "error": f"Pixabay: API request error for '{query[:50]}': {e}", "status_message": None}
-    except json.JSONDecodeError:
+    except JSONDecodeError:
         # print(f"Error decoding JSON from Pixabay: {response.text if 'response' in locals() else 'No response text'}")
         return {"items": [], "error": f"Pixabay: Error decoding API response for '{query[:50]}'", "status_message": None}
     except Exception as e: # Catch other potential errors
@@ -77,24 +88,21 @@ def list_pixabay_videos(query, list_limit=25, api_timeout=10, **kwargs):
 
     for hit in data["hits"][:list_limit]: # Apply overall list_limit after fetching per_page
         videos_data = hit.get("videos", {})
-        chosen_video_rendition = None
-        size_bytes = None
         video_thumbnail_url = None
 
-        # Prefer medium quality, fallback to large, then small, then tiny, and get its size and thumbnail.
-        preferred_renditions = ["medium", "large", "small", "tiny"]
-        for rendition_key in preferred_renditions:
-            rendition_data = videos_data.get(rendition_key)
-            if rendition_data and rendition_data.get("url"):
-                chosen_video_rendition = rendition_data
-                break
-
-        if not chosen_video_rendition:
+        # Without size limits: medium quality, falling back to large, then small, then tiny.
+        candidates = [rendition(name, info.get("url"), info.get("width"), info.get("height"), info.get("size"))
+                      for name in PIXABAY_VIDEO_RENDITIONS for info in [videos_data.get(name) or {}]]
+        chosen = select_rendition(candidates, **(size_limits or {}))
+        if not chosen:
             continue
 
-        video_url = chosen_video_rendition.get("url")
-        size_bytes = chosen_video_rendition.get("size")
-        video_thumbnail_url = chosen_video_rendition.get("thumbnail") # Get thumbnail from the chosen rendition
+        video_url = chosen["url"]
+        size_bytes = chosen["size_bytes"]
+        # Smallest rendition's thumbnail is plenty for a preview; fall back to the chosen rendition's
+        video_thumbnail_url = (videos_data.get("tiny") or {}).get("thumbnail") or videos_data[chosen["name"]].get("thumbnail")
+        if not video_thumbnail_url and hit.get("picture_id"):
+            video_thumbnail_url = PIXABAY_POSTER_URL_TEMPLATE.format(picture_id=hit["picture_id"])
 
         if not video_url: # Should not happen if chosen_video_rendition is set by now
             continue
@@ -107,26 +115,30 @@ def list_pixabay_videos(query, list_limit=25, api_timeout=10, **kwargs):
         url_filename_part = video_url.split('/')[-1].split('?')[0] # Get filename from URL
         file_extension = os.path.splitext(url_filename_part)[1] or ".mp4" # Default to .mp4 if no ext
 
-        final_filename = f"pixabay_{smart_query_name_base}_{item_id}{file_extension}"
+        # Another rendition than the default gets its own filename (see renditions.rendition_suffix)
+        suffix = rendition_suffix(chosen, select_rendition(candidates)) if size_limits else ""
+        final_filename = f"pixabay_{smart_query_name_base}_{item_id}{suffix}{file_extension}"
         final_filename = "_".join(filter(None, final_filename.split('_')))
 
-        found_items.append({
-            "id": item_id,
-            "title": title,
-            "url": video_url,
-            "type": "video", # Pixabay video endpoint returns videos
-            "filename": final_filename,
-            "platform": "pixabay",
-            "size_bytes": size_bytes, # Add the size
-            "preview_image_url": video_thumbnail_url # Use the correct thumbnail URL
-        })
+        found_items.append(MediaItem(
+            id=item_id,
+            title=title,
+            url=video_url,
+            type="video", # Pixabay video endpoint returns videos
+            filename=final_filename,
+            platform="pixabay",
+            size_bytes=size_bytes, # Add the size
+            preview_image_url=video_thumbnail_url, # Use the correct thumbnail URL
+            rendition=chosen["name"]
+        ))
     return {"items": found_items, "error": None, "status_message": None if found_items else f"Pixabay: No items extracted after processing hits for '{query[:50]}'"}
 
-def search_pixabay_videos(query, limit=5, output_dir="pixabay_media", api_timeout=10, download_timeout=DEFAULT_DOWNLOAD_TIMEOUT, **kwargs):
+def search_pixabay_videos(query, limit=5, output_dir="pixabay_media", api_timeout=10, download_timeout=DEFAULT_DOWNLOAD_TIMEOUT,
+                          size_limits=None, **kwargs):
     """
     Searches Pixabay for videos and downloads them.
     """
-    listed_items_data = list_pixabay_videos(query, list_limit=limit, api_timeout=api_timeout)
+    listed_items_data = list_pixabay_videos(query, list_limit=limit, api_timeout=api_timeout, size_limits=size_limits)
 
     if isinstance(listed_items_data, dict): # Check if it's a dict (success or error dict)
         listed_items = listed_items_data.get("items", [])
@@ -156,6 +168,7 @@ def search_pixabay_videos(query, limit=5, output_dir="pixabay_media", api_timeou
         download_path = download_file(item['url'], output_dir, item['filename'], timeout=download_timeout)
         if download_path:
             downloaded_files.append(download_path)
+            record_library_item(item, download_path, query)
 
     return downloaded_files
 
@@ -167,22 +180,28 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", type=str, default="pixabay_media", help="Directory to save downloaded videos.")
     parser.add_argument("--api_timeout", type=int, default=10, help="Timeout for API calls in seconds.")
     parser.add_argument("--download_timeout", type=int, default=DEFAULT_DOWNLOAD_TIMEOUT, help="Timeout for file downloads in seconds.")
+    add_size_limit_arguments(parser)
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
 
     if PIXABAY_API_KEY == "YOUR_PIXABAY_API_KEY_HERE":
         print("Please set your PIXABAY_API_KEY in pixabay_downloader.py to run this script.")
     else:
         print(f"Searching Pixabay for '{args.query}' videos and downloading up to {args.limit} items to '{args.output_dir}'...")
-        downloaded = search_pixabay_videos(
-            args.query,
-            args.limit,
-            args.output_dir,
-            api_timeout=args.api_timeout,
-            download_timeout=args.download_timeout
-        )
+        with profiler.stage("search+download"):
+            downloaded = search_pixabay_videos(
+                args.query,
+                args.limit,
+                args.output_dir,
+                api_timeout=args.api_timeout,
+                download_timeout=args.download_timeout,
+                size_limits=size_limits_from_args(args)
+            )
         if downloaded:
             print(f"Pixabay: Successfully downloaded {len(downloaded)} videos.")
         else:
             print("Pixabay: No videos downloaded.")
         print("Pixabay video download process complete.")
+        profiler.write_report()
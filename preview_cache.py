@@ -0,0 +1,136 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from urllib.parse import urlparse
+
+import requests
+
+from storage_manager import StorageManager
+
+# Small on-disk cache for the thumbnails/renditions shown on the results page.
+# Files are stored as <sha256(url)><ext> inside the cache directory; a StorageManager
+# evicts least-recently-used ones once the total size goes over the byte cap.
+
+DEFAULT_PREVIEW_CACHE_MAX_BYTES = 200 * 1024 * 1024  # 200 MB
+DEFAULT_PREVIEW_FETCH_TIMEOUT = 10  # seconds
+MAX_PREVIEW_BYTES = 8 * 1024 * 1024  # Refuse to cache anything bigger than this; previews should be small
+PREVIEW_SERVE_GRACE_SECONDS = 60  # Previews are tiny and served in one go
+
+# Only media CDNs used by the scrapers may be proxied, so /preview can't be used as an open proxy.
+PREVIEW_ALLOWED_HOST_SUFFIXES = (
+    "giphy.com",
+    "upload.wikimedia.org",
+    "pixabay.com",
+    "vimeocdn.com",  # Pixabay picture_id posters
+    "morbotron.com",
+    "frinkiac.com",
+    "mixkit.co",
+)
+
+# Content types we are willing to store, mapped to the extension used on disk.
+PREVIEW_CONTENT_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/svg+xml": ".svg",
+    "video/mp4": ".mp4",
+}
+
+PREVIEW_HEADERS = {'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z'}
+
+_cache_dir = None
+_storage = None  # StorageManager enforcing the byte cap
+
+
+def init_preview_cache(cache_dir, max_bytes=DEFAULT_PREVIEW_CACHE_MAX_BYTES):
+    """Sets the cache directory and size cap, and indexes whatever is already on disk."""
+    global _cache_dir, _storage
+    _storage = StorageManager(cache_dir, max_bytes, serve_grace_seconds=PREVIEW_SERVE_GRACE_SECONDS)
+    _cache_dir = _storage.root_dir
+    _storage.evict()
+    return _storage
+
+
+def is_allowed_preview_url(url):
+    """True if the URL points at one of the media hosts the scrapers use."""
+    try:
+        parsed = urlparse(url)
+    except ValueError:
+        return False
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        return False
+    host = parsed.hostname.lower()
+    return any(host == suffix or host.endswith("." + suffix) for suffix in PREVIEW_ALLOWED_HOST_SUFFIXES)
+
+
+def _cache_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def get_cached_preview(url):
+    """Returns (path, mimetype) for a cached preview, or None on a miss."""
+    key = _cache_key(url)
+    # One stat per known extension; another gunicorn worker may have fetched it.
+    for ext in set(PREVIEW_CONTENT_TYPES.values()):
+        path = os.path.join(_cache_dir, key + ext)
+        if os.path.exists(path):
+            if not _storage.contains(path):
+                _storage.record(path)
+            _storage.touch(path)
+            return path, mimetypes.guess_type(path)[0]
+    return None
+
+
+def fetch_preview(url, timeout=DEFAULT_PREVIEW_FETCH_TIMEOUT):
+    """
+    Returns (path, mimetype) for the preview at `url`, downloading it into the cache on a miss.
+    Returns None if the URL is not allowed, the upstream fails, or the content is unsuitable.
+    """
+    if _cache_dir is None or not is_allowed_preview_url(url):
+        return None
+
+    cached = get_cached_preview(url)
+    if cached:
+        return cached
+
+    key = _cache_key(url)
+    try:
+        response = requests.get(url, stream=True, headers=PREVIEW_HEADERS, timeout=timeout)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print(f"Preview fetch failed for {url}: {e}")
+        return None
+
+    with response:
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        ext = PREVIEW_CONTENT_TYPES.get(content_type)
+        if not ext:
+            return None
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_PREVIEW_BYTES:
+            return None
+
+        path = os.path.join(_cache_dir, key + ext)
+        # Write to a per-process temp file and rename, so concurrent workers never serve a partial file.
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+        size = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=8192):
+                    size += len(chunk)
+                    if size > MAX_PREVIEW_BYTES:
+                        raise ValueError("preview too large")
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except (OSError, ValueError, requests.exceptions.RequestException) as e:
+            print(f"Preview caching failed for {url}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return None
+
+    _storage.record(path)
+    return path, content_type
@@ -0,0 +1,178 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Opt-in profiling for batch runs and live workers.
+# Profiler.stage(name) wraps one phase of work (listing a platform, downloading, ...). With
+# mode "cprofile" each stage gets its own cProfile.Profile (calling thread only), dumped as
+# <stage>.pstats plus a text summary; with mode "sample" a background thread samples every
+# thread's stack and the result is written as collapsed stacks ("a;b;c count" lines) for
+# flamegraph.pl / speedscope. Both modes record wall vs CPU time per stage, which is usually
+# enough to tell network waits from parsing or disk work.
+#
+# A disabled Profiler (no --profile flag) makes stage() a no-op.
+
+PROFILE_MODES = ("cprofile", "sample")
+DEFAULT_PROFILE_DIR = "profile_reports"
+DEFAULT_SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+MAX_STACK_DEPTH = 64
+REPORT_TOP_FUNCTIONS = 25
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _collapse(frame):
+    """Root-first 'file:func;file:func' string for a frame's stack."""
+    labels = []
+    while frame is not None and len(labels) < MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+def sample_stacks(seconds, interval=DEFAULT_SAMPLE_INTERVAL, skip_thread_ids=(), label_fn=None, stop_event=None):
+    """
+    Samples all threads' stacks for `seconds` (or until stop_event is set) and returns a Counter
+    of collapsed stacks. label_fn(thread_id) may return a prefix (e.g. the current stage) for
+    that thread's stacks; otherwise the thread name is used.
+    """
+    counts = Counter()
+    skip = set(skip_thread_ids) | {threading.get_ident()}
+    names = {}
+    end = time.monotonic() + seconds
+    while time.monotonic() < end and not (stop_event is not None and stop_event.is_set()):
+        if not names or len(names) != threading.active_count():
+            names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in skip:
+                continue
+            stack = _collapse(frame)
+            prefix = label_fn(thread_id) if label_fn else None
+            counts[f"{prefix or names.get(thread_id, thread_id)};{stack}"] += 1
+        time.sleep(interval)
+    return counts
+
+
+def format_collapsed(counts):
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class Profiler:
+    """Per-stage profiler for one run; see the module comment."""
+
+    def __init__(self, mode=None, output_dir=DEFAULT_PROFILE_DIR, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        if mode is not None and mode not in PROFILE_MODES:
+            raise ValueError(f"Unknown profile mode '{mode}' (expected one of {', '.join(PROFILE_MODES)})")
+        self.mode = mode
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self._profiles = {}  # stage -> cProfile.Profile
+        self._timings = {}  # stage -> [calls, wall seconds, cpu seconds]
+        self._thread_stage = {}  # thread id -> current stage (sample mode)
+        self._samples = Counter()
+        self._sampler = None
+        self._stop = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.mode is not None
+
+    @contextmanager
+    def stage(self, name):
+        """Profiles the enclosed block as part of stage `name` (stages may repeat; results add up)."""
+        if not self.enabled:
+            yield
+            return
+        if self.mode == "sample":
+            self._ensure_sampler()
+        thread_id = threading.get_ident()
+        previous_stage = self._thread_stage.get(thread_id)
+        self._thread_stage[thread_id] = name
+        profile = None
+        if self.mode == "cprofile" and previous_stage is None:  # cProfile can't nest; inner stages fold into the outer one
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += time.perf_counter() - wall_start
+            timing[2] += time.thread_time() - cpu_start
+            if previous_stage is None:
+                self._thread_stage.pop(thread_id, None)
+            else:
+                self._thread_stage[thread_id] = previous_stage
+
+    def _ensure_sampler(self):
+        if self._sampler is None:
+            self._sampler = threading.Thread(target=self._sample_loop, name="profile-sampler", daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self):
+        while not self._stop.is_set():
+            self._samples.update(sample_stacks(0.5, self.sample_interval, label_fn=self._thread_stage.get,
+                                               stop_event=self._stop))
+
+    def summary(self):
+        """Text table of wall/CPU time per stage."""
+        lines = [f"{'stage':<40} {'calls':>6} {'wall s':>9} {'cpu s':>9} {'waiting':>8}"]
+        for name, (calls, wall, cpu) in sorted(self._timings.items(), key=lambda kv: -kv[1][1]):
+            waiting = 100 * (1 - cpu / wall) if wall > 0 else 0.0
+            lines.append(f"{name[:40]:<40} {calls:>6} {wall:>9.3f} {cpu:>9.3f} {waiting:>7.1f}%")
+        return "\n".join(lines)
+
+    def write_report(self):
+        """Stops sampling and writes the report files. Returns the report directory (None if disabled)."""
+        if not self.enabled:
+            return None
+        if self._sampler is not None:
+            self._stop.set()
+            self._sampler.join()
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+
+        report = io.StringIO()
+        report.write(self.summary() + "\n")
+        if self.mode == "cprofile":
+            for name, profile in self._profiles.items():
+                safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+                profile.dump_stats(os.path.join(self.output_dir, f"{safe_name}.pstats"))
+                report.write(f"\n=== {name} (top {REPORT_TOP_FUNCTIONS} by cumulative time) ===\n")
+                pstats.Stats(profile, stream=report).sort_stats("cumulative").print_stats(REPORT_TOP_FUNCTIONS)
+        else:
+            with open(os.path.join(self.output_dir, "profile.collapsed"), "w", encoding="utf-8") as f:
+                f.write(format_collapsed(self._samples))
+
+        with open(os.path.join(self.output_dir, "profile_report.txt"), "w", encoding="utf-8") as f:
+            f.write(report.getvalue())
+        print(f"\n--- Profile ({self.mode}) ---\n{self.summary()}\nReport written to {self.output_dir}")
+        return self.output_dir
+
+
+def add_profile_arguments(parser):
+    """Adds --profile [cprofile|sample] and --profile_dir to an argparse parser."""
+    parser.add_argument(
+        "--profile", nargs="?", const="cprofile", choices=PROFILE_MODES, default=None,
+        help="Profile the run per stage: 'cprofile' (default, pstats files) or 'sample' (collapsed stacks for flame graphs)."
+    )
+    parser.add_argument(
+        "--profile_dir", type=str, default=DEFAULT_PROFILE_DIR,
+        help=f"Directory for profile reports (default: {DEFAULT_PROFILE_DIR})."
+    )
+
+
+def profiler_from_args(args):
+    return Profiler(args.profile, args.profile_dir)
@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+import json_backend
+import singleflight
+
+# Log of the searches people run, so popular ones can be kept warm in the listing cache.
+# app.search() (and the first page of /api/search) append one line per platform searched:
+#   {"t": 1700000000.0, "platform": "giphy", "query": "cats", "limit": 10, "media_type": "all",
+#    "display": 5, "size_limits": null}
+# "limit" is the listing size asked of the platform (the listing cache key), "display" the
+# number of results shown, i.e. the first page whose previews are worth fetching.
+# Workers append to the same file; once it grows past MAX_LOG_BYTES it is rotated to .1,
+# and top_searches() reads both. Rotation holds a cross-process lock and re-checks the size,
+# so two workers seeing the same full log don't rotate twice (the second rename would
+# overwrite the .1 the first one just made with a nearly empty log).
+
+DEFAULT_WINDOW_SECONDS = 24 * 3600  # Only searches this recent count towards popularity
+MAX_LOG_BYTES = 4 * 1024 * 1024
+
+_log_path = None
+_lock = threading.Lock()
+
+
+def configure_query_log(path):
+    """Enables logging searches to `path` (a JSONL file)."""
+    global _log_path
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    _log_path = path
+
+
+def _normalize(query):
+    return query.strip().lower()  # As listing_cache_key() does, so logged searches map onto cache entries
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def record_search(query, platforms, media_type, limit, display_limit=None, size_limits=None):
+    """Appends one line per platform for a search; a no-op unless configure_query_log() was called."""
+    if _log_path is None or not query or not query.strip():
+        return
+    now = time.time()
+    lines = "".join(json_backend.dumps({
+        "t": now, "platform": platform, "query": _normalize(query), "limit": limit, "media_type": media_type,
+        "display": display_limit or limit, "size_limits": size_limits,
+    }) + "\n" for platform in platforms)
+    try:
+        with _lock:
+            if _size(_log_path) > MAX_LOG_BYTES:
+                with singleflight.file_lock("query-log:" + os.path.abspath(_log_path)):
+                    if _size(_log_path) > MAX_LOG_BYTES:  # Not rotated by another worker meanwhile
+                        os.replace(_log_path, _log_path + ".1")
+            with open(_log_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+    except OSError as e:
+        print(f"Query log: could not record search: {e}")
+
+
+def _read_lines(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json_backend.loads(line)
+                except ValueError:
+                    continue
+    except OSError:
+        return
+
+
+def top_searches(top_n, window_seconds=DEFAULT_WINDOW_SECONDS, path=None):
+    """
+    The `top_n` most frequent searches per platform within the window, most frequent first, as
+    dicts {"platform", "query", "limit", "media_type", "display", "size_limits", "count", "last_seen"}.
+    """
+    path = path or _log_path
+    if path is None:
+        return []
+    since = time.time() - window_seconds
+    counts = {}
+    for entry in list(_read_lines(path + ".1")) + list(_read_lines(path)):
+        if not isinstance(entry, dict) or entry.get("t", 0) < since or not entry.get("platform"):
+            continue
+        key = json_backend.dumps([entry["platform"], entry.get("query"), entry.get("limit"), entry.get("media_type"),
+                                  entry.get("size_limits")])
+        search = counts.get(key)
+        if search is None:
+            search = counts[key] = {
+                "platform": entry["platform"], "query": entry.get("query"), "limit": entry.get("limit"),
+                "media_type": entry.get("media_type", "all"), "display": entry.get("display"),
+                "size_limits": entry.get("size_limits"), "count": 0, "last_seen": 0,
+            }
+        search["count"] += 1
+        search["last_seen"] = max(search["last_seen"], entry.get("t", 0))
+        search["display"] = max(search["display"] or 0, entry.get("display") or 0) or None
+
+    per_platform = {}
+    for search in sorted(counts.values(), key=lambda s: (-s["count"], -s["last_seen"])):
+        ranked = per_platform.setdefault(search["platform"], [])
+        if len(ranked) < top_n:
+            ranked.append(search)
+    return [search for ranked in per_platform.values() for search in ranked]
@@ -0,0 +1,105 @@
+# Rendition selection for platforms that offer several encodings of the same item.
+# Giphy returns a dozen renditions per GIF (original, downsized, fixed_height, preview, ...)
+# and Pixabay four per video (large/medium/small/tiny), each with its dimensions and byte size.
+# Listers describe them as candidate dicts and let select_rendition() pick one under the run's
+# size limits:
+#   max_bytes               per-item byte budget (ceiling)
+#   max_width / max_height  resolution box (ceiling), the same --max_width/--max_height that
+#                           make Wikimedia serve scaled images
+#   target_height           resolution actually needed, e.g. 480 for "480p" (floor)
+# The choice is the smallest rendition that reaches target_height within the ceilings, or
+# without a target the largest one within them. When nothing fits, the smallest rendition
+# is used. Without any limits the lister's preferred (first) rendition is kept, so default
+# runs download what they always did.
+# A rendition other than that default gets its name into the item's filename (rendition_suffix()),
+# so a capped copy and the original never share a filename and can't be served in place of each other.
+
+SIZE_LIMIT_KEYS = ("max_width", "max_height", "max_bytes", "target_height")
+
+
+def make_size_limits(max_width=None, max_height=None, max_bytes=None, target_height=None):
+    """Dict of the limits that are set (for passing through listing layers), or None if there are none."""
+    limits = {"max_width": max_width, "max_height": max_height, "max_bytes": max_bytes, "target_height": target_height}
+    limits = {key: value for key, value in limits.items() if value}
+    return limits or None
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def rendition(name, url, width=None, height=None, size_bytes=None):
+    """Candidate dict for select_rendition(); APIs often send numbers as strings, so they are converted here."""
+    return {"name": name, "url": url, "width": _to_int(width), "height": _to_int(height), "size_bytes": _to_int(size_bytes)}
+
+
+def _fits(candidate, max_width, max_height, max_bytes):
+    # Unknown sizes don't count as fitting a limit that is set
+    if max_bytes and (candidate["size_bytes"] is None or candidate["size_bytes"] > max_bytes):
+        return False
+    if max_width and (candidate["width"] is None or candidate["width"] > max_width):
+        return False
+    if max_height and (candidate["height"] is None or candidate["height"] > max_height):
+        return False
+    return True
+
+
+def _magnitude(candidate):
+    """Sort key from smallest to largest: pixels first, bytes to break ties."""
+    return ((candidate["width"] or 0) * (candidate["height"] or 0), candidate["size_bytes"] or 0)
+
+
+def select_rendition(candidates, max_width=None, max_height=None, max_bytes=None, target_height=None):
+    """
+    Picks one candidate (see rendition()) under the given limits; candidates are in the lister's
+    order of preference. Returns None if no candidate has a URL.
+    """
+    candidates = [candidate for candidate in candidates if candidate.get("url")]
+    if not candidates:
+        return None
+    if not (max_width or max_height or max_bytes or target_height):
+        return candidates[0]
+
+    fitting = [candidate for candidate in candidates if _fits(candidate, max_width, max_height, max_bytes)]
+    if not fitting:
+        return min(candidates, key=_magnitude)
+    if target_height:
+        sufficient = [candidate for candidate in fitting if (candidate["height"] or 0) >= target_height]
+        if sufficient:
+            return min(sufficient, key=_magnitude)
+    return max(fitting, key=_magnitude)
+
+
+def rendition_suffix(chosen, default):
+    """'_<name>' for the filename when the chosen rendition isn't the one downloaded without limits, else ''."""
+    if not chosen or not default or chosen["name"] == default["name"]:
+        return ""
+    return f"_{chosen['name']}"
+
+
+def add_size_limit_arguments(parser):
+    """Adds --max_width, --max_height, --max_item_mb and --target_height to an argparse parser."""
+    parser.add_argument(
+        "--max_width", type=int, default=None,
+        help="Largest image/video width (px) to download: a smaller rendition is picked (Giphy, Pixabay) or Wikimedia scales the image."
+    )
+    parser.add_argument(
+        "--max_height", type=int, default=None,
+        help="Largest image/video height (px) to download (see --max_width)."
+    )
+    parser.add_argument(
+        "--max_item_mb", type=float, default=None,
+        help="Per-item size budget in MB: the best rendition within it is downloaded (Giphy, Pixabay)."
+    )
+    parser.add_argument(
+        "--target_height", type=int, default=None,
+        help="Resolution you need, e.g. 480: the smallest rendition at least this tall is downloaded (Giphy, Pixabay)."
+    )
+
+
+def size_limits_from_args(args):
+    max_bytes = int(args.max_item_mb * 1024 * 1024) if args.max_item_mb else None
+    return make_size_limits(args.max_width, args.max_height, max_bytes, args.target_height)
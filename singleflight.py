@@ -0,0 +1,90 @@
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl  # POSIX only; on Windows we fall back to in-process coalescing
+except ImportError:
+    fcntl = None
+
+# Single-flight helpers: concurrent callers asking for the same key share one execution.
+# `do()` coalesces within a process (threads); `file_lock()` serialises the same key across
+# processes (gunicorn workers, a CLI batch next to the web app), so the second process can
+# pick up the first one's result (a cache entry, a downloaded file) instead of repeating it.
+
+LOCK_DIR = os.path.join(tempfile.gettempdir(), "media_downloader_locks")
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def do(key, fn):
+    """
+    Runs fn() once for all concurrent callers with the same key and returns its result to each
+    of them (exceptions are re-raised in every caller). Returns (result, shared) where shared is
+    True for callers that waited on someone else's call.
+    """
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _Call()
+            _inflight[key] = call
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    try:
+        call.result = fn()
+    except BaseException as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        call.done.set()
+    return call.result, False
+
+
+def lock_path_for(key):
+    """Path of the cross-process lock file for a key (kept out of the output directories)."""
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    return os.path.join(LOCK_DIR, digest + ".lock")
+
+
+@contextmanager
+def file_lock(key, blocking=True):
+    """
+    Exclusive cross-process lock for `key`; a no-op where fcntl is unavailable. Yields whether the
+    lock is held: with blocking=False it yields False at once if another process holds it.
+    """
+    if fcntl is None:
+        yield True
+        return
+    if not os.path.exists(LOCK_DIR):
+        os.makedirs(LOCK_DIR, exist_ok=True)
+    with open(lock_path_for(key), "a") as lock_file:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,252 @@
+import os
+import threading
+import time
+from collections import Counter
+
+from integrity import MANIFEST_NAME, record_deletions
+from output_layout import is_layout_file
+
+# Keeps a directory of cached files under a byte quota.
+# The manager holds an in-memory index of every file's size and last access time, built by
+# a single walk at startup and kept current by record()/touch(), so requests never list the
+# directory. Eviction drops files older than max_age first, then least-recently-used ones
+# until the total fits the quota. It runs in a background thread when one is started, and
+# inline otherwise.
+#
+# Files that are being served are never evicted: callers pin() a file while they open it
+# (after that an open handle keeps the data readable even if the name is unlinked), and
+# anything accessed within `serve_grace_seconds` is skipped too, which covers transfers
+# handed off to a proxy (X-Accel-Redirect) or running in another gunicorn worker.
+# Last access is stored in the file's atime (not mtime, which feeds ETags), so other
+# workers and restarts see the same LRU order.
+#
+# Files written speculatively (record(path, speculative=True), i.e. prefetched before anyone
+# asked for them) are evicted before anything else once over quota, and regardless of the
+# quota after speculative_max_age. The first real access (record() or touch()) makes them
+# ordinary files; a touch from another worker is noticed through the atime before evicting.
+# The marks live in this process's memory, so after a restart leftover prefetches are
+# ordinary LRU files.
+
+DEFAULT_EVICTION_INTERVAL = 60  # seconds between background eviction passes
+DEFAULT_RESCAN_INTERVAL = 15 * 60  # seconds; re-walk to pick up files written by other workers
+DEFAULT_SERVE_GRACE_SECONDS = 10 * 60  # recently accessed files are treated as possibly in use
+DEFAULT_SPECULATIVE_MAX_AGE = 30 * 60  # seconds an unclaimed prefetched file is kept
+
+
+class StorageManager:
+    """Byte quota plus LRU/age eviction for one directory tree."""
+
+    def __init__(self, root_dir, quota_bytes, max_age_seconds=None,
+                 serve_grace_seconds=DEFAULT_SERVE_GRACE_SECONDS,
+                 eviction_interval=DEFAULT_EVICTION_INTERVAL,
+                 rescan_interval=DEFAULT_RESCAN_INTERVAL,
+                 speculative_max_age=DEFAULT_SPECULATIVE_MAX_AGE):
+        self.root_dir = os.path.abspath(root_dir)
+        self.quota_bytes = quota_bytes
+        self.max_age_seconds = max_age_seconds
+        self.serve_grace_seconds = serve_grace_seconds
+        self.eviction_interval = eviction_interval
+        self.rescan_interval = rescan_interval
+        self.speculative_max_age = speculative_max_age
+
+        self._entries = {}  # abs path -> [size, last_access]
+        self._speculative = {}  # abs path -> time it was recorded, for unclaimed prefetched files
+        self._total_bytes = 0
+        self._pins = Counter()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._last_scan = 0
+
+        if not os.path.exists(self.root_dir):
+            os.makedirs(self.root_dir)
+        self.scan()
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+    @property
+    def speculative_bytes(self):
+        """Bytes held by prefetched files nobody has asked for yet."""
+        with self._lock:
+            return sum(self._entries[path][0] for path in self._speculative if path in self._entries)
+
+    def scan(self):
+        """Rebuilds the index with one walk of the directory tree (startup and periodic resync only)."""
+        entries = {}
+        total = 0
+        for dirpath, _, filenames in os.walk(self.root_dir):
+            for name in filenames:
+                if name.endswith(".part") or name == MANIFEST_NAME or is_layout_file(name):
+                    continue  # In-flight temp files belong to whoever is writing them; manifests and layout indexes aren't media
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries[path] = [stat.st_size, max(stat.st_atime, stat.st_mtime)]
+                total += stat.st_size
+        with self._lock:
+            # Keep fresher in-memory access times for files we already know about
+            for path, entry in entries.items():
+                known = self._entries.get(path)
+                if known and known[1] > entry[1]:
+                    entry[1] = known[1]
+            self._entries = entries
+            self._total_bytes = total
+            self._speculative = {path: marked for path, marked in self._speculative.items() if path in entries}
+            self._last_scan = time.time()
+
+    def record(self, path, speculative=False):
+        """
+        Adds (or refreshes) a file that was just written under root_dir. speculative: it was
+        prefetched, not requested; a later record() without it claims the file.
+        """
+        path = os.path.abspath(path)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._entries.get(path)
+            if old:
+                self._total_bytes -= old[0]
+            self._entries[path] = [size, now]
+            self._total_bytes += size
+            if speculative:
+                self._speculative[path] = now
+            else:
+                self._speculative.pop(path, None)
+            over_quota = self._total_bytes > self.quota_bytes
+        if over_quota:
+            self._request_eviction()
+
+    def touch(self, path):
+        """Marks a file as just accessed."""
+        path = os.path.abspath(path)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry:
+                entry[1] = now
+            self._speculative.pop(path, None)
+        try:
+            stat = os.stat(path)
+            os.utime(path, (now, stat.st_mtime))  # atime only; mtime stays stable for ETag/Last-Modified
+        except OSError:
+            pass
+
+    def contains(self, path):
+        with self._lock:
+            return os.path.abspath(path) in self._entries
+
+    def pin(self, path):
+        """Protects a file from eviction until unpin() is called (calls nest)."""
+        with self._lock:
+            self._pins[os.path.abspath(path)] += 1
+
+    def unpin(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            self._pins[path] -= 1
+            if self._pins[path] <= 0:
+                del self._pins[path]
+
+    def forget(self, path):
+        """Drops a file from the index (e.g. it was deleted by someone else)."""
+        path = os.path.abspath(path)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry:
+                self._total_bytes -= entry[0]
+            self._speculative.pop(path, None)
+
+    def _claimed_elsewhere_locked(self, path, marked_at):
+        """Whether another worker touched a prefetched file (touch() moves its atime past the mark)."""
+        try:
+            return os.stat(path).st_atime > marked_at + 1
+        except OSError:
+            return False
+
+    def _evictable_locked(self, path, last_access, now):
+        return path not in self._pins and now - last_access >= self.serve_grace_seconds
+
+    def evict(self):
+        """
+        Removes unclaimed prefetched files (all of them past speculative_max_age, the oldest first while
+        over quota), then expired files, then LRU files until under quota. Returns the list of removed paths.
+        """
+        now = time.time()
+        to_remove = []
+        with self._lock:
+            projected = self._total_bytes
+            for path, marked_at in sorted(self._speculative.items(), key=lambda kv: kv[1]):
+                entry = self._entries.get(path)
+                if entry is None or self._claimed_elsewhere_locked(path, marked_at):
+                    del self._speculative[path]  # Gone, or now an ordinary file
+                    continue
+                stale = self.speculative_max_age is not None and now - marked_at > self.speculative_max_age
+                if (stale or projected > self.quota_bytes) and path not in self._pins:
+                    to_remove.append(path)
+                    projected -= entry[0]
+
+            speculative_removals = set(to_remove)
+            by_age = sorted(self._entries.items(), key=lambda kv: kv[1][1])  # Oldest access first
+            for path, (size, last_access) in by_age:
+                if path in speculative_removals:
+                    continue
+                expired = self.max_age_seconds is not None and now - last_access > self.max_age_seconds
+                if not expired and projected <= self.quota_bytes:
+                    break  # Everything after this is newer and we're under quota
+                if not self._evictable_locked(path, last_access, now):
+                    continue
+                to_remove.append(path)
+                projected -= size
+            for path in to_remove:
+                size, _ = self._entries.pop(path)
+                self._total_bytes -= size
+                self._speculative.pop(path, None)
+
+        removed = []
+        for path in to_remove:
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                removed.append(path)  # Another worker got there first
+            except OSError as e:
+                print(f"Storage: could not evict {path}: {e}")
+        if removed:
+            record_deletions(removed)  # So `verify` doesn't report evicted files as missing
+        return removed
+
+    def _request_eviction(self):
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            self._wake.set()
+        else:
+            self.evict()
+
+    def start_background_eviction(self):
+        """Starts the eviction thread for this process (safe to call repeatedly, and again after fork)."""
+        if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+            return
+        self._thread_pid = os.getpid()
+        self._thread = threading.Thread(target=self._eviction_loop, name="storage-eviction", daemon=True)
+        self._thread.start()
+
+    def _eviction_loop(self):
+        while True:
+            self._wake.wait(self.eviction_interval)
+            self._wake.clear()
+            try:
+                if time.time() - self._last_scan >= self.rescan_interval:
+                    self.scan()
+                removed = self.evict()
+                if removed:
+                    print(f"Storage: evicted {len(removed)} file(s) from {self.root_dir}, "
+                          f"{self._total_bytes} bytes in use of {self.quota_bytes}")
+            except Exception as e:  # Never let the eviction thread die
+                print(f"Storage: eviction pass failed for {self.root_dir}: {e}")
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+import requests
+
+# The modules live at the top level of the repository, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import circuit_breaker
+import giphy_downloader
+import hedging
+import listing_cache
+import media_downloader_tool
+import pixabay_scraper
+
+
+@pytest.fixture
+def listing_env(monkeypatch, tmp_path):
+    """A listing cache in tmp_path, fresh circuit breakers and API keys set, so listers reach the network."""
+    monkeypatch.setattr(listing_cache, "_cache_dir", None)
+    listing_cache.configure_listing_cache(str(tmp_path / "listings"))
+    monkeypatch.setattr(circuit_breaker, "_breakers", {})
+    monkeypatch.setattr(hedging, "_trackers", {})
+    for module in (giphy_downloader, media_downloader_tool):
+        monkeypatch.setattr(module, "GIPHY_API_KEY", "test-key")
+    for module in (pixabay_scraper, media_downloader_tool):
+        monkeypatch.setattr(module, "PIXABAY_API_KEY", "test-key")
+    return tmp_path
+
+
+@pytest.fixture
+def timing_out_upstream(monkeypatch):
+    """Every listing request times out; yields the list of URLs requested."""
+    requested = []
+
+    def get(url, **kwargs):
+        requested.append(url)
+        raise requests.exceptions.Timeout("read timed out")
+
+    monkeypatch.setattr(hedging.requests, "get", get)
+    return requested
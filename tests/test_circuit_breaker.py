@@ -0,0 +1,46 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CLOSED, OPEN, CircuitBreaker, DEFAULT_FAILURE_THRESHOLD
+from media_downloader_tool import list_platform_media
+
+FAILED = {"items": [], "error": "Giphy: API request error for 'cats': 503", "status_message": None}
+EMPTY = {"items": [], "error": None, "status_message": "Giphy: No results found for 'cats'"}
+
+
+def test_opens_after_consecutive_failures_and_short_circuits():
+    breaker = CircuitBreaker("giphy", failure_threshold=2, reset_timeout=60)
+    calls = []
+    fetch = lambda: calls.append(1) or FAILED
+    breaker.call(fetch)
+    assert breaker.state == CLOSED
+    breaker.call(fetch)
+    assert breaker.state == OPEN
+    result = breaker.call(fetch)
+    assert result["circuit_open"] and len(calls) == 2
+
+
+def test_empty_results_and_deadline_cut_offs_are_not_failures():
+    breaker = CircuitBreaker("giphy", failure_threshold=1)
+    breaker.call(lambda: EMPTY)
+    breaker.call(lambda: dict(FAILED, deadline_exceeded=True))
+    assert breaker.state == CLOSED and breaker.consecutive_failures == 0
+
+
+def test_a_success_resets_the_count():
+    breaker = CircuitBreaker("giphy", failure_threshold=2)
+    breaker.call(lambda: FAILED)
+    breaker.call(lambda: EMPTY)
+    breaker.call(lambda: FAILED)
+    assert breaker.state == CLOSED and breaker.consecutive_failures == 1
+
+
+@pytest.mark.parametrize("platform, media_type", [("giphy", "gif"), ("pixabay", "video"), ("morbotron", "image")])
+def test_listing_timeouts_open_the_breaker(listing_env, timing_out_upstream, platform, media_type):
+    for _ in range(DEFAULT_FAILURE_THRESHOLD):
+        list_platform_media(platform, "cats", 5, media_type, api_timeout=1)
+    assert circuit_breaker.breaker_state(platform)["state"] == OPEN
+    requested = len(timing_out_upstream)
+    result = list_platform_media(platform, "cats", 5, media_type, api_timeout=1)
+    assert result.get("circuit_open") and "timeout" in result["error"].lower()
+    assert len(timing_out_upstream) == requested
@@ -0,0 +1,76 @@
+import pytest
+
+from download_planner import assumed_unknown_size, make_job, order_jobs, run_plan
+
+
+def jobs(*specs):
+    """Jobs from (item id, query, size) tuples."""
+    return [make_job({"id": item_id, "size_bytes": size}, query, "out") for item_id, query, size in specs]
+
+
+def ids(ordered):
+    return [job["item"]["id"] for job in ordered]
+
+
+JOBS = jobs(("a", "cats", 500), ("b", "cats", 100), ("c", "dogs", 300), ("d", "cats", None), ("e", "dogs", 100))
+
+
+class FixedDeadline:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def remaining(self):
+        return self.seconds
+
+
+def test_unknown_sizes_are_assumed_the_median():
+    assert assumed_unknown_size(JOBS) == 200
+    assert assumed_unknown_size(jobs(("x", "q", None))) > 0
+
+
+def test_listing_order():
+    assert ids(order_jobs(JOBS)) == ["a", "b", "c", "d", "e"]
+
+
+def test_shortest_first_is_stable():
+    assert ids(order_jobs(JOBS, "shortest")) == ["b", "e", "d", "c", "a"]
+
+
+def test_fair_alternates_queries():
+    assert ids(order_jobs(JOBS, "fair")) == ["b", "e", "d", "c", "a"]
+    assert ids(order_jobs(jobs(("a", "cats", 1), ("b", "cats", 2), ("c", "cats", 3), ("d", "dogs", 9)), "fair")) == ["a", "d", "b", "c"]
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        order_jobs(JOBS, "largest")
+
+
+def test_run_plan_completes_and_fails():
+    result = run_plan(JOBS, lambda job: None if job["item"]["id"] == "c" else f"out/{job['item']['id']}",
+                      policy="shortest", workers=2)
+    assert sorted(ids(job for job, _ in result["completed"])) == ["a", "b", "d", "e"]
+    assert ids(result["failed"]) == ["c"]
+    assert result["deferred"] == []
+
+
+def test_run_plan_defers_oversized_items_before_starting():
+    started = []
+    result = run_plan(JOBS, lambda job: started.append(job["item"]["id"]) or "path", max_item_bytes=300)
+    assert [(job["item"]["id"], reason) for job, reason in result["deferred"]] == [("a", "oversized")]
+    assert "a" not in started and len(started) == 4
+
+
+def test_run_plan_defers_what_cannot_finish_before_the_deadline():
+    planned = jobs(("small", "q", 100 * 1024), ("huge", "q", 50 * 1024 * 1024), ("unsized", "q", None), ("medium", "q", 200 * 1024))
+    started = []
+    # measure() reporting 0 bytes keeps the assumed 1 MB/s: "huge" needs ~50 s, the rest under 1 s
+    result = run_plan(planned, lambda job: started.append(job["item"]["id"]) or "path",
+                      deadline=FixedDeadline(5), measure=lambda path: 0)
+    assert [(job["item"]["id"], reason) for job, reason in result["deferred"]] == [("huge", "deadline")]
+    assert started == ["small", "unsized", "medium"]
+
+
+def test_run_plan_learns_the_throughput():
+    result = run_plan(jobs(("a", "q", 4 * 1024 * 1024)), lambda job: "path", assumed_bytes_per_sec=1)
+    assert result["bytes_per_sec"] > 1
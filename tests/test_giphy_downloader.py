@@ -0,0 +1,39 @@
+import giphy_downloader
+from giphy_downloader import giphy_media_item, list_giphy_media, search_giphy
+
+
+def giphy_item(item_id):
+    images = {
+        "original": {"url": f"https://media.giphy.com/{item_id}/giphy.gif", "width": "480", "height": "480",
+                     "size": "4000000", "mp4": f"https://media.giphy.com/{item_id}/giphy.mp4", "mp4_size": "900000"},
+        "downsized": {"url": f"https://media.giphy.com/{item_id}/downsized.gif", "width": "240", "height": "240", "size": "900000"},
+        "fixed_height": {"url": f"https://media.giphy.com/{item_id}/200.gif", "width": "200", "height": "200",
+                         "size": "500000", "mp4": f"https://media.giphy.com/{item_id}/200.mp4", "mp4_size": "90000"},
+    }
+    return {"id": item_id, "type": "gif", "title": f"Cat {item_id}", "images": images}
+
+
+PAYLOAD = {"data": [giphy_item("abc"), giphy_item("def")]}
+
+
+def test_default_rendition_has_no_suffix():
+    item = giphy_media_item(giphy_item("abc"), "gif", None, "cats")
+    assert item.filename == "giphy_cats_abc.gif" and item.rendition == "original"
+
+
+def test_capped_rendition_is_named():
+    item = giphy_media_item(giphy_item("abc"), "gif", {"max_bytes": 1000000}, "cats")
+    assert item.rendition != "original"
+    assert item.filename == f"giphy_cats_abc_{item.rendition}.gif"
+
+
+def test_search_saves_under_the_listed_filenames(listing_env, monkeypatch):
+    saved = []
+    monkeypatch.setattr(giphy_downloader, "fetch_giphy_search", lambda *args, **kwargs: PAYLOAD)
+    monkeypatch.setattr(giphy_downloader, "download_file",
+                        lambda url, folder, name, timeout=None: saved.append((url, name)) or f"{folder}/{name}")
+    size_limits = {"max_bytes": 1000000}
+    search_giphy("cats", 2, str(listing_env / "out"), "gif", size_limits=size_limits)
+    listed = list_giphy_media("cats", 2, "gif", size_limits=size_limits)["items"]
+    assert saved == [(item.url, item.filename) for item in listed]
+    assert all(name != f"giphy_cats_{item_id}.gif" for (_, name), item_id in zip(saved, ("abc", "def")))
@@ -0,0 +1,69 @@
+import time
+
+import pytest
+import requests
+
+import circuit_breaker
+import hedging
+import listing_cache
+import media_downloader_tool
+from deadline import Deadline
+from listing_cache import ERROR_TTLS, classify_error, entry_ttl, listing_cache_key
+from media_downloader_tool import get_platform_listing
+
+
+def stored_entry(platform, query, limit, media_type):
+    return listing_cache._read_entry(listing_cache_key(platform, query, limit, media_type))
+
+
+def test_entry_ttl():
+    assert entry_ttl({"items": [{"id": 1}], "error": None}) == listing_cache._ttl
+    assert entry_ttl({"items": [], "error": None}) == listing_cache._empty_ttl
+    assert entry_ttl({"items": [], "error": "Giphy: API timeout for 'cats'"}) == min(ERROR_TTLS["timeout"], listing_cache._error_ttl)
+    assert entry_ttl({"items": [], "error": "x", "deadline_exceeded": True}) == 0
+
+
+def test_classify_error():
+    assert classify_error("Pixabay: API timeout for 'cats'") == "timeout"
+    assert classify_error("Giphy: API request error for 'cats': 429 Too Many Requests") == "rate_limited"
+    assert classify_error("Frinkiac: Error processing page for 'cats'") == "parse"
+
+
+@pytest.mark.parametrize("platform, media_type", [("giphy", "gif"), ("pixabay", "video"), ("morbotron", "image")])
+def test_timed_out_listing_is_not_cached_as_empty(listing_env, timing_out_upstream, platform, media_type):
+    result = get_platform_listing(platform, "cats", 5, media_type, api_timeout=1)
+    assert result["items"] == []
+    assert "timeout" in result["error"].lower()
+    entry = stored_entry(platform, "cats", 5, media_type)
+    assert entry is None or entry["ttl"] == min(ERROR_TTLS["timeout"], listing_cache._error_ttl)
+    assert entry is None or entry["result"]["error"]
+
+
+def test_listing_cut_off_by_the_deadline_is_not_cached(listing_env, monkeypatch):
+    timeouts = []
+
+    def slow_get(url, timeout=None, **kwargs):
+        timeouts.append(timeout)
+        time.sleep(timeout)  # The upstream doesn't answer before the clamped timeout
+        raise requests.exceptions.Timeout("read timed out")
+
+    monkeypatch.setattr(hedging.requests, "get", slow_get)
+    result = get_platform_listing("giphy", "cats", 5, "gif", api_timeout=10, deadline=Deadline(0.8))
+    assert timeouts and max(timeouts) <= 0.8
+    assert result["deadline_exceeded"]
+    assert stored_entry("giphy", "cats", 5, "gif") is None
+    assert circuit_breaker.breaker_state("giphy")["consecutive_failures"] == 0
+
+
+def test_empty_listing_after_the_deadline_is_not_cached(listing_env, monkeypatch):
+    calls = []
+
+    def slow_lister(*args, **kwargs):
+        calls.append(args)
+        time.sleep(0.6)  # Leaves less than MIN_REQUEST_TIMEOUT of the deadline
+        return {"items": [], "error": None, "status_message": "Giphy: No results found for 'cats'"}
+
+    monkeypatch.setattr(media_downloader_tool, "list_giphy_media", slow_lister)
+    result = get_platform_listing("giphy", "cats", 5, "gif", deadline=Deadline(0.8))
+    assert calls and result["deadline_exceeded"]
+    assert stored_entry("giphy", "cats", 5, "gif") is None
@@ -0,0 +1,141 @@
+import struct
+
+import pytest
+
+import media_probe
+from media_probe import MAX_EXTRA_BYTES, MAX_EXTRA_READS, _RangeReader, parse_media_header
+
+# Headers are built here rather than recorded: each is just enough of the format for the parser.
+
+
+def box(kind, payload):
+    return struct.pack(">I4s", 8 + len(payload), kind) + payload
+
+
+def jpeg(width, height, app1_length=100):
+    app1 = b"\xff\xe1" + struct.pack(">H", app1_length + 2) + b"\0" * app1_length
+    sof = b"\xff\xc0" + struct.pack(">HBHHB", 17, 8, height, width, 3) + b"\0" * 9
+    return b"\xff\xd8" + app1 + sof + b"\xff\xda" + b"\0" * 1000
+
+
+def mp4(width, height, seconds, moov_last, mdat_bytes=200000):
+    mvhd = box(b"mvhd", b"\0\0\0\0" + struct.pack(">IIII", 0, 0, 1000, int(seconds * 1000)) + b"\0" * 80)
+    audio = box(b"trak", box(b"tkhd", b"\0\0\0\0" + b"\0" * 72 + struct.pack(">II", 0, 0)))
+    video = box(b"trak", box(b"tkhd", b"\0\0\0\0" + b"\0" * 72 + struct.pack(">II", width << 16, height << 16)))
+    ftyp, moov, mdat = box(b"ftyp", b"isom\0\0\0\0"), box(b"moov", mvhd + audio + video), box(b"mdat", b"\0" * mdat_bytes)
+    return ftyp + mdat + moov if moov_last else ftyp + moov + mdat
+
+
+def ebml(element_id, payload):
+    return element_id + b"\x01" + len(payload).to_bytes(7, "big") + payload
+
+
+def webm(width, height, seconds):
+    info = ebml(b"\x2a\xd7\xb1", (1000000).to_bytes(3, "big")) + ebml(b"\x44\x89", struct.pack(">d", seconds * 1000))
+    video = ebml(b"\xb0", width.to_bytes(2, "big")) + ebml(b"\xba", height.to_bytes(2, "big"))
+    tracks = ebml(b"\xae", ebml(b"\xd7", b"\x01") + ebml(b"\xe0", video))
+    segment = ebml(b"\x15\x49\xa9\x66", info) + ebml(b"\x16\x54\xae\x6b", tracks) + ebml(b"\x1f\x43\xb6\x75", b"\0" * 5000)
+    return ebml(b"\x1a\x45\xdf\xa3", ebml(b"\x42\x82", b"webm")) + ebml(b"\x18\x53\x80\x67", segment)
+
+
+PNG = b"\x89PNG\r\n\x1a\n" + struct.pack(">I4sII", 13, b"IHDR", 640, 480) + b"\0" * 100
+GIF = b"GIF89a" + struct.pack("<HH", 320, 200) + b"\0" * 100
+WEBP = b"RIFF\0\0\0\0WEBPVP8X" + b"\0" * 8 + (799).to_bytes(3, "little") + (599).to_bytes(3, "little") + b"\0" * 20
+
+
+class Remote:
+    """fetch(start, length) over an in-memory file, counting the calls."""
+
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+
+    def __call__(self, start, length):
+        self.calls.append((start, length))
+        return self.data[start:start + length]
+
+
+def parse(data, first_bytes=1024):
+    remote = Remote(data)
+    return parse_media_header(data[:first_bytes], len(data), remote), remote
+
+
+@pytest.mark.parametrize("data, expected", [
+    (PNG, ("png", 640, 480)),
+    (GIF, ("gif", 320, 200)),
+    (WEBP, ("webp", 800, 600)),
+    (jpeg(1920, 1080), ("jpeg", 1920, 1080)),
+])
+def test_image_dimensions_from_first_range(data, expected):
+    result, remote = parse(data)
+    assert (result["format"], result["width"], result["height"]) == expected
+    assert result["duration"] is None
+    assert remote.calls == []
+
+
+def test_jpeg_frame_header_after_large_app1_takes_one_more_read():
+    result, remote = parse(jpeg(800, 600, app1_length=65000) + b"\0" * 100000)
+    assert (result["width"], result["height"]) == (800, 600)
+    assert len(remote.calls) == 1
+
+
+def test_mp4_faststart():
+    result, remote = parse(mp4(1280, 720, 12.5, moov_last=False), first_bytes=64 * 1024)
+    assert result == {"format": "mp4", "width": 1280, "height": 720, "duration": 12.5}
+    assert remote.calls == []
+
+
+def test_mp4_moov_at_end_is_fetched_past_the_media_data():
+    data = mp4(854, 480, 61.25, moov_last=True)
+    result, remote = parse(data)
+    assert result == {"format": "mp4", "width": 854, "height": 480, "duration": 61.25}
+    assert remote.calls and sum(length for _, length in remote.calls) < len(data) // 2
+
+
+def test_webm():
+    result, _ = parse(webm(1024, 576, 9.5))
+    assert result == {"format": "webm", "width": 1024, "height": 576, "duration": 9.5}
+
+
+def test_unknown_format():
+    result, _ = parse(b"<html>" + b"\0" * 100)
+    assert result == {"format": None, "width": None, "height": None, "duration": None}
+
+
+def test_range_reader_stops_after_max_extra_reads():
+    remote = Remote(b"\0" * (100 * 1024 * 1024))
+    reader = _RangeReader(b"\0" * 16, len(remote.data), remote)
+    step = 10 * 1024 * 1024  # Each read lies outside every window fetched so far
+    for i in range(MAX_EXTRA_READS):
+        assert reader.read((i + 1) * step, 8) is not None
+    assert reader.read((MAX_EXTRA_READS + 1) * step, 8) is None
+    assert len(remote.calls) == MAX_EXTRA_READS
+
+
+def test_range_reader_caps_extra_bytes():
+    remote = Remote(b"\0" * (3 * MAX_EXTRA_BYTES))
+    reader = _RangeReader(b"\0" * 16, len(remote.data), remote)
+    assert reader.read(1024, MAX_EXTRA_BYTES + 1) is None
+    assert remote.calls == []
+    assert reader.read(1024, MAX_EXTRA_BYTES - 4096) is not None
+    assert reader.read(2 * MAX_EXTRA_BYTES, 8192) is None
+    assert reader.extra_bytes <= MAX_EXTRA_BYTES
+
+
+def test_range_reader_does_not_read_past_the_end():
+    remote = Remote(b"\0" * 1000)
+    reader = _RangeReader(b"\0" * 16, 1000, remote)
+    assert reader.read(990, 20) is None
+    assert remote.calls == []
+
+
+def test_unparsable_header_keeps_the_size(monkeypatch):
+    # A PNG cut off inside its IHDR chunk
+    monkeypatch.setattr(media_probe, "_get_range", lambda url, start, length, headers, timeout: (206, PNG[:20], 0, 123456))
+    media_probe.configure_media_probe(cache_entries=0)
+    try:
+        result = media_probe.probe_media("http://example.invalid/cut.png")
+    finally:
+        media_probe.configure_media_probe()
+    assert result["size_bytes"] == 123456
+    assert result["width"] is None
@@ -0,0 +1,54 @@
+import sys
+
+import media_downloader_tool
+import memory_budget
+from memory_budget import MemoryBudget
+
+MB = 1024 * 1024
+
+
+def test_concurrency_shrinks_towards_the_budget(monkeypatch):
+    budget = MemoryBudget(100 * MB, max_concurrency=4)
+    for rss, allowed in ((50 * MB, 4), (90 * MB, 2), (100 * MB, 1), (150 * MB, 1)):
+        monkeypatch.setattr(memory_budget, "current_rss_bytes", lambda: rss)
+        assert budget.allowed_concurrency() == allowed
+
+
+def test_no_budget_means_full_concurrency(monkeypatch):
+    monkeypatch.setattr(memory_budget, "current_rss_bytes", lambda: 10 ** 12)
+    assert MemoryBudget(None, max_concurrency=3).allowed_concurrency() == 3
+
+
+def test_over_budget_forces_a_gc_pass(monkeypatch):
+    collections = []
+    monkeypatch.setattr(memory_budget, "current_rss_bytes", lambda: 200 * MB)
+    monkeypatch.setattr(memory_budget.gc, "collect", lambda: collections.append(1))
+    with MemoryBudget(100 * MB, max_concurrency=1):
+        pass
+    assert collections == [1]
+
+
+def test_direct_mode_searches_go_through_the_budget(monkeypatch, tmp_path):
+    events = []
+
+    class RecordingBudget(MemoryBudget):
+        def acquire(self):
+            events.append(("acquire", self.limit_bytes))
+            super().acquire()
+
+        def release(self):
+            events.append(("release", self.limit_bytes))
+            super().release()
+
+    def fake_search(platform):
+        return lambda *args, **kwargs: events.append(("search", platform)) or []
+
+    monkeypatch.setattr(media_downloader_tool, "MemoryBudget", RecordingBudget)
+    monkeypatch.setattr(media_downloader_tool, "search_giphy", fake_search("giphy"))
+    monkeypatch.setattr(media_downloader_tool, "search_frinkiac_media", fake_search("frinkiac"))
+    monkeypatch.setattr(media_downloader_tool.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(sys, "argv", ["media_downloader_tool.py", "cats", "--platforms", "giphy", "frinkiac",
+                                      "--output_dir", str(tmp_path), "--memory_budget_mb", "256"])
+    media_downloader_tool.main()
+    assert events == [("acquire", 256 * MB), ("search", "giphy"), ("release", 256 * MB),
+                      ("acquire", 256 * MB), ("search", "frinkiac"), ("release", 256 * MB)]
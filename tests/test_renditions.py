@@ -0,0 +1,59 @@
+from renditions import make_size_limits, rendition, rendition_suffix, select_rendition
+
+CANDIDATES = [
+    rendition("original", "https://example.com/o.mp4", 1920, 1080, 8000000),
+    rendition("large", "https://example.com/l.mp4", 1280, 720, 4000000),
+    rendition("medium", "https://example.com/m.mp4", "960", "540", "2000000"),
+    rendition("small", "https://example.com/s.mp4", 640, 360, 900000),
+    rendition("no_url", None, 320, 180, 100000),
+]
+
+
+def name(candidate):
+    return candidate["name"] if candidate else None
+
+
+def test_numbers_from_strings():
+    assert CANDIDATES[2]["width"] == 960 and CANDIDATES[2]["size_bytes"] == 2000000
+    assert rendition("x", "u", "n/a")["width"] is None
+
+
+def test_without_limits_the_first_candidate_is_kept():
+    assert name(select_rendition(CANDIDATES)) == "original"
+
+
+def test_largest_within_the_ceilings():
+    assert name(select_rendition(CANDIDATES, max_width=1000)) == "medium"
+    assert name(select_rendition(CANDIDATES, max_bytes=3000000)) == "medium"
+    assert name(select_rendition(CANDIDATES, max_width=1500, max_height=600)) == "medium"
+
+
+def test_smallest_that_reaches_the_target_height():
+    assert name(select_rendition(CANDIDATES, target_height=500)) == "medium"
+    assert name(select_rendition(CANDIDATES, target_height=2000)) == "original"
+    assert name(select_rendition(CANDIDATES, target_height=700, max_bytes=3000000)) == "medium"
+
+
+def test_smallest_when_nothing_fits():
+    assert name(select_rendition(CANDIDATES, max_bytes=10)) == "small"
+
+
+def test_unknown_sizes_do_not_fit_a_set_limit():
+    candidates = [rendition("unsized", "u1"), rendition("sized", "u2", 200, 200, 5000)]
+    assert name(select_rendition(candidates, max_bytes=10000)) == "sized"
+
+
+def test_no_candidate_with_a_url():
+    assert select_rendition([rendition("a", None), rendition("b", "")]) is None
+
+
+def test_rendition_suffix():
+    default = select_rendition(CANDIDATES)
+    assert rendition_suffix(default, default) == ""
+    assert rendition_suffix(select_rendition(CANDIDATES, max_width=1000), default) == "_medium"
+    assert rendition_suffix(None, default) == ""
+
+
+def test_make_size_limits():
+    assert make_size_limits() is None
+    assert make_size_limits(max_width=640, max_bytes=0) == {"max_width": 640}
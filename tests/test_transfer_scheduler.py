@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+import transfer_scheduler
+from transfer_scheduler import TokenBucket
+
+
+class FakeClock:
+    """Stands in for the time module: sleep() advances monotonic() instead of waiting."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(transfer_scheduler, "time", clock)
+    return clock
+
+
+def test_burst_is_available_at_once(clock):
+    bucket = TokenBucket(1000, burst=5000)
+    bucket.consume(5000)
+    assert clock.sleeps == []
+
+
+def test_burst_defaults_to_one_second(clock):
+    bucket = TokenBucket(1000)
+    bucket.consume(1000)
+    bucket.consume(500)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_debt_makes_the_next_caller_wait_for_it(clock):
+    bucket = TokenBucket(1000)
+    bucket.consume(3000)  # 2000 bytes into debt
+    assert clock.sleeps == [pytest.approx(2.0)]
+    bucket.consume(1000)  # The debt was slept off, the bucket is empty
+    assert clock.sleeps[-1] == pytest.approx(1.0)
+
+
+def test_refill_is_capped_at_the_burst(clock):
+    bucket = TokenBucket(1000, burst=2000)
+    bucket.consume(2000)
+    clock.now += 60
+    bucket.consume(3000)
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_rate_over_time():
+    # Real clock: 20 KB at 100 KB/s with a 5 KB burst takes about 0.15 s
+    bucket = TokenBucket(100 * 1024, burst=5 * 1024)
+    threads = [threading.Thread(target=lambda: [bucket.consume(1024) for _ in range(5)]) for _ in range(4)]
+    started = transfer_scheduler.time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 0.1 <= transfer_scheduler.time.monotonic() - started < 1.0
@@ -0,0 +1,233 @@
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+# Bandwidth shaping for file downloads.
+# The web app and batch runs share one host and one uplink; without shaping a batch of large
+# videos saturates the link and an interactive /download crawls. Every download loop passes
+# its chunks through throttle() of a Transfer, which draws on token buckets:
+#   - a global bytes/sec cap for the process,
+#   - optional per-platform caps,
+#   - a small "yield" bucket that lower-priority transfers must also draw on while a
+#     higher-priority transfer is running,
+#   - an optional cap shared by all BACKGROUND transfers (prefetching), so speculative
+#     downloads never take more than their share of the link.
+# Priorities: INTERACTIVE (a user waiting in the browser) > BATCH (CLI runs) > BACKGROUND
+# (prefetching). Interactive transfers also touch a marker file, so a batch run in another
+# process yields to the web app too. Buckets are per process; only the marker is shared.
+#
+# The priority of a transfer comes from use_transfer_priority() in the calling thread (like
+# deadline.use_deadline()), so download_file() signatures stay unchanged. Default: BATCH.
+# promote() raises the priority of a transfer already running in another thread, e.g. a
+# prefetch that a user has just clicked on and is now waiting for. A user in another process
+# can't reach that thread, so a transfer may also carry a promote_check (set with
+# use_transfer_priority()) that its throttle polls every PROMOTE_CHECK_INTERVAL, e.g. a claim
+# marker file.
+
+INTERACTIVE = 0
+BATCH = 1
+BACKGROUND = 2
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch", BACKGROUND: "background"}
+
+DEFAULT_YIELD_BYTES_PER_SEC = 256 * 1024  # What lower-priority transfers share while they yield
+DEFAULT_MARKER_PATH = os.path.join(tempfile.gettempdir(), "media_downloader_interactive.marker")
+MARKER_FRESH_SECONDS = 3  # An interactive transfer touched the marker this recently: it is still running
+MARKER_TOUCH_INTERVAL = 1
+PROMOTE_CHECK_INTERVAL = 0.5  # seconds between a transfer's promote_check() calls
+
+
+class TokenBucket:
+    """Thread-safe token bucket; consume() blocks (outside the lock) until the bytes are covered."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)  # One second's worth by default
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Going into debt keeps callers in arrival order: each one waits for what it took
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class TransferScheduler:
+    """Token buckets and priority bookkeeping shared by all transfers in this process."""
+
+    def __init__(self, max_bytes_per_sec=None, platform_limits=None, yield_bytes_per_sec=DEFAULT_YIELD_BYTES_PER_SEC,
+                 marker_path=DEFAULT_MARKER_PATH, background_bytes_per_sec=None):
+        self.global_bucket = TokenBucket(max_bytes_per_sec) if max_bytes_per_sec else None
+        self.platform_buckets = {platform: TokenBucket(rate) for platform, rate in (platform_limits or {}).items() if rate}
+        self.yield_bucket = TokenBucket(yield_bytes_per_sec) if yield_bytes_per_sec else None
+        self.background_bucket = TokenBucket(background_bytes_per_sec) if background_bytes_per_sec else None
+        self.marker_path = marker_path
+        self._active = {INTERACTIVE: 0, BATCH: 0, BACKGROUND: 0}
+        self._transfers = {}  # thread id -> the Transfer running in it
+        self._lock = threading.Lock()
+        self._marker_touched = 0
+
+    def _touch_marker(self):
+        now = time.monotonic()
+        if not self.marker_path or now - self._marker_touched < MARKER_TOUCH_INTERVAL:
+            return
+        self._marker_touched = now
+        try:
+            with open(self.marker_path, "a"):
+                os.utime(self.marker_path, None)
+        except OSError:
+            pass
+
+    def interactive_elsewhere(self):
+        """True if another process (the web app) has an interactive transfer running."""
+        if not self.marker_path:
+            return False
+        try:
+            return time.time() - os.path.getmtime(self.marker_path) < MARKER_FRESH_SECONDS
+        except OSError:
+            return False
+
+    def should_yield(self, priority):
+        """Whether a transfer of this priority should step aside for a higher-priority one."""
+        if priority == INTERACTIVE:
+            return False
+        with self._lock:
+            if any(self._active[higher] for higher in range(priority)):
+                return True
+        return self.interactive_elsewhere()
+
+    def throttle(self, amount, platform, priority):
+        """Blocks until `amount` bytes of the given platform and priority may be transferred."""
+        if priority == INTERACTIVE:
+            self._touch_marker()
+        elif self.yield_bucket is not None and self.should_yield(priority):
+            self.yield_bucket.consume(amount)
+        if priority == BACKGROUND and self.background_bucket is not None:
+            self.background_bucket.consume(amount)
+        bucket = self.platform_buckets.get(platform)
+        if bucket is not None:
+            bucket.consume(amount)
+        if self.global_bucket is not None:
+            self.global_bucket.consume(amount)
+
+    @contextmanager
+    def transfer(self, platform, priority=None):
+        """One download: `with scheduler.transfer("pixabay") as t: ... t.throttle(len(chunk))`."""
+        priority = current_priority() if priority is None else priority
+        transfer = Transfer(self, platform, priority, current_promote_check())
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[priority] += 1
+            self._transfers[thread_id] = transfer
+        try:
+            yield transfer
+        finally:
+            with self._lock:
+                self._active[transfer.priority] -= 1
+                self._transfers.pop(thread_id, None)
+
+    def promote(self, thread_id, priority=INTERACTIVE):
+        """
+        Raises the priority of the transfer running in thread `thread_id` (never lowers it).
+        Returns False if that thread has no transfer running (it hasn't started or is done).
+        """
+        with self._lock:
+            transfer = self._transfers.get(thread_id)
+            if transfer is None:
+                return False
+            self._raise_locked(transfer, priority)
+            return True
+
+    def _raise_locked(self, transfer, priority):
+        if priority < transfer.priority:
+            self._active[transfer.priority] -= 1
+            self._active[priority] += 1
+            transfer.priority = priority
+
+    def promote_transfer(self, transfer, priority=INTERACTIVE):
+        """Raises the priority of a running Transfer (never lowers it)."""
+        with self._lock:
+            self._raise_locked(transfer, priority)
+
+
+class Transfer:
+    __slots__ = ("scheduler", "platform", "priority", "promote_check", "checked_at")
+
+    def __init__(self, scheduler, platform, priority, promote_check=None):
+        self.scheduler = scheduler
+        self.platform = platform
+        self.priority = priority
+        self.promote_check = promote_check  # () -> True once someone is waiting for this transfer
+        self.checked_at = time.monotonic()
+
+    def throttle(self, amount):
+        if self.promote_check is not None and self.priority != INTERACTIVE:
+            now = time.monotonic()
+            if now - self.checked_at >= PROMOTE_CHECK_INTERVAL:
+                self.checked_at = now
+                if self.promote_check():
+                    self.scheduler.promote_transfer(self, INTERACTIVE)
+        self.scheduler.throttle(amount, self.platform, self.priority)
+
+
+_scheduler = TransferScheduler()
+_local = threading.local()
+
+
+def configure_transfer_scheduler(max_bytes_per_sec=None, platform_limits=None,
+                                 yield_bytes_per_sec=DEFAULT_YIELD_BYTES_PER_SEC, marker_path=DEFAULT_MARKER_PATH,
+                                 background_bytes_per_sec=None):
+    """Replaces the process-wide scheduler (call before downloads start)."""
+    global _scheduler
+    _scheduler = TransferScheduler(max_bytes_per_sec, platform_limits, yield_bytes_per_sec, marker_path, background_bytes_per_sec)
+    return _scheduler
+
+
+def get_transfer_scheduler():
+    return _scheduler
+
+
+def current_priority():
+    """The transfer priority active in this thread (BATCH unless set)."""
+    return getattr(_local, "priority", BATCH)
+
+
+def current_promote_check():
+    return getattr(_local, "promote_check", None)
+
+
+@contextmanager
+def use_transfer_priority(priority, promote_check=None):
+    """
+    Downloads started in this thread during the block get `priority`; with promote_check, they
+    switch to INTERACTIVE once promote_check() returns True.
+    """
+    previous = current_priority(), current_promote_check()
+    _local.priority, _local.promote_check = priority, promote_check
+    try:
+        yield priority
+    finally:
+        _local.priority, _local.promote_check = previous
+
+
+def parse_platform_limits(value, unit=1024):
+    """'pixabay=500,mixkit=200' (or a list of such items) -> {platform: rate * unit}. Raises ValueError."""
+    items = value.split(",") if isinstance(value, str) else (value or [])
+    limits = {}
+    for entry in items:
+        entry = entry.strip()
+        if not entry:
+            continue
+        platform, _, rate = entry.partition("=")
+        if not rate:
+            raise ValueError(f"Expected platform=rate, got '{entry}'")
+        limits[platform.strip()] = int(float(rate) * unit)
+    return limits
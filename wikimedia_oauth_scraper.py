@@ -1,11 +1,20 @@
 import requests
 import os
 import argparse
-import json
+from hedging import hedged_get
+from media_item import MediaItem
+from profiling import add_profile_arguments, profiler_from_args
+from json_backend import JSONDecodeError, response_json
+from wikimedia_scraper import scaled_thumb_url
+from download_utils import save_response
+from output_layout import output_path
+from media_library import record_item as record_library_item
 
 WIKIMEDIA_API_URL = "https://commons.wikimedia.org/w/api.php" # Same API URL
 DEFAULT_DOWNLOAD_TIMEOUT = 15
 DEFAULT_API_TIMEOUT = 10 # Default for API calls
+PREVIEW_THUMB_WIDTH = 320  # px, width of the thumbnail requested for web previews
+SCALABLE_MEDIA_TYPES = ("image", "gif")  # Types whose scaled thumbnail is a usable download (not a video poster)
 
 # Provided OAuth 2.0 Access Token
 WIKIMEDIA_ACCESS_TOKEN = "YOUR_ACCESS_TOKEN_HERE"
@@ -26,22 +35,21 @@ def _get_auth_headers():
 # as file downloads themselves don't typically require auth once the URL is obtained.
 # If they did, this would need to use _get_auth_headers too.
 # For now, we assume public URLs are returned by the API.
+# Use a generic User-Agent for downloads, auth is for API metadata calls
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z'
+}
+
 def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT):
     """Downloads a file from a URL into a specified folder with a timeout."""
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
 
-    # Use a generic User-Agent for downloads, auth is for API metadata calls
-    headers = {
-        'User-Agent': 'MediaDownloaderTool/1.0 Python-requests/X.Y.Z'
-    }
     try:
-        response = requests.get(url, stream=True, headers=headers, timeout=timeout)
+        response = requests.get(url, stream=True, headers=DOWNLOAD_HEADERS, timeout=timeout)
         response.raise_for_status()
-        file_path = os.path.join(folder_name, file_name)
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        file_path = output_path(folder_name, file_name)
+        save_response(response, file_path, "wikimedia_oauth")
         print(f"Downloaded {file_name} to {folder_name} (OAuth Scraper)")
         return file_path
     except requests.exceptions.Timeout:
@@ -51,9 +59,10 @@ def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT)
         print(f"Error downloading {url} (OAuth Scraper) to {file_name}: {e}")
         return None
 
-def list_wikimedia_oauth_media(query, list_limit=25, media_type="all", api_timeout=DEFAULT_API_TIMEOUT):
+def list_wikimedia_oauth_media(query, list_limit=25, media_type="all", api_timeout=DEFAULT_API_TIMEOUT, max_width=None, max_height=None):
     """
     Searches Wikimedia Commons using OAuth and returns a dictionary with 'items', 'error', 'status_message'.
+    With max_width/max_height, images point at a server-side scaled rendition (see list_wikimedia_media).
     """
     params = {
         "action": "query", "format": "json", "generator": "search",
@@ -61,14 +70,20 @@ def list_wikimedia_oauth_media(query, list_limit=25, media_type="all", api_timeo
         "gsrlimit": list_limit * 3 if media_type != "all" else list_limit,
         "prop": "imageinfo", "iiprop": "url|mediatype|size|extmetadata",
         "iilimit": 1, "utf8": 1,
+        "iiurlwidth": PREVIEW_THUMB_WIDTH, # Server-side scaled thumbnail (thumburl) for the results page
     }
+    if max_width or max_height:
+        # One thumbnail size per request: ask for the download size and derive the preview from it
+        params.pop("iiurlwidth")
+        if max_width: params["iiurlwidth"] = max_width
+        if max_height: params["iiurlheight"] = max_height
 
     auth_headers = _get_auth_headers()
 
     try:
-        response = requests.get(WIKIMEDIA_API_URL, params=params, headers=auth_headers, timeout=api_timeout)
+        response = hedged_get("wikimedia_oauth", WIKIMEDIA_API_URL, params=params, headers=auth_headers, timeout=api_timeout)
         response.raise_for_status()
-        data = response.json()
+        data = response_json(response)
     except requests.exceptions.Timeout:
         return {"items": [], "error": f"Wikimedia OAuth: API timeout for '{query[:50]}'", "status_message": None}
     except requests.exceptions.HTTPError as e:
@@ -77,7 +92,7 @@ def list_wikimedia_oauth_media(query, list_limit=25, media_type="all", api_timeo
         return {"items": [], "error": f"Wikimedia OAuth: API HTTP error for '{query[:50]}': {e}. Response: {e.response.text[:200]}", "status_message": None}
     except requests.exceptions.RequestException as e:
         return {"items": [], "error": f"Wikimedia OAuth: API request error for '{query[:50]}': {e}", "status_message": None}
-    except json.JSONDecodeError:
+    except JSONDecodeError:
         return {"items": [], "error": f"Wikimedia OAuth: Error decoding API response for '{query[:50]}'", "status_message": None}
     except Exception as e:
         return {"items": [], "error": f"Wikimedia OAuth: Unexpected error for '{query[:50]}': {e}", "status_message": None}
@@ -131,8 +146,21 @@ def list_wikimedia_oauth_media(query, list_limit=25, media_type="all", api_timeo
             elif media_type == "video" and item_actual_media_type != "video": continue
             elif media_type == "audio" and item_actual_media_type != "audio": continue
 
+        preview_image_url = img_info.get("thumburl")
+        scale_suffix = ""
+        if max_width or max_height:
+            thumb_url = img_info.get("thumburl")
+            if item_actual_media_type in SCALABLE_MEDIA_TYPES and file_extension != ".svg" and thumb_url and thumb_url != file_url:
+                file_url = thumb_url
+                # The scaled copy gets its own filename, so it is never served in place of the original (or the reverse)
+                scale_suffix = f"_w{img_info['thumbwidth']}" if img_info.get("thumbwidth") else f"_{max_width or 0}x{max_height or 0}"
+                size_bytes = None # imageinfo only reports the original's size
+                thumb_extension = os.path.splitext(thumb_url.split('/')[-1])[1].lower()
+                if thumb_extension: file_extension = thumb_extension # e.g. TIFFs are scaled to JPEG
+            preview_image_url = scaled_thumb_url(thumb_url, img_info.get("thumbwidth"), PREVIEW_THUMB_WIDTH)
+
         clean_original_filename = "".join(c if c.isalnum() else "_" for c in os.path.splitext(filename_part)[0])[:50]
-        final_filename = f"wikimedia_oauth_{smart_query_name_base}_{clean_original_filename}{file_extension}"
+        final_filename = f"wikimedia_oauth_{smart_query_name_base}_{clean_original_filename}{scale_suffix}{file_extension}"
         final_filename = "_".join(filter(None, final_filename.split('_')))
 
         description = ""
@@ -143,24 +171,27 @@ def list_wikimedia_oauth_media(query, list_limit=25, media_type="all", api_timeo
                 description = img_info["extmetadata"]["ImageDescription"]["value"]
         title_for_display = description or original_filename_title
 
-        found_items.append({
-            "id": page_id,
-            "title": title_for_display,
-            "url": file_url,
-            "type": item_actual_media_type,
-            "filename": final_filename,
-            "platform": "wikimedia_oauth", # Differentiate platform name
-            "size_bytes": size_bytes # Add the size
-        })
+        found_items.append(MediaItem(
+            id=page_id,
+            title=title_for_display,
+            url=file_url,
+            type=item_actual_media_type,
+            filename=final_filename,
+            platform="wikimedia_oauth", # Differentiate platform name
+            size_bytes=size_bytes, # Add the size
+            preview_image_url=preview_image_url if item_actual_media_type != "audio" else None # Audio keeps its player
+        ))
     return {"items": found_items, "error": None, "status_message": None if found_items else f"Wikimedia OAuth: No items extracted for '{query[:50]}'"}
 
 
 def search_wikimedia_oauth_media(query, limit=5, output_dir="wikimedia_oauth_media", media_type="all",
-                                 api_timeout=DEFAULT_API_TIMEOUT, download_timeout=DEFAULT_DOWNLOAD_TIMEOUT):
+                                 api_timeout=DEFAULT_API_TIMEOUT, download_timeout=DEFAULT_DOWNLOAD_TIMEOUT,
+                                 max_width=None, max_height=None):
     """
     Searches Wikimedia Commons (OAuth) and downloads them.
     """
-    listed_items_data = list_wikimedia_oauth_media(query, list_limit=limit, media_type=media_type, api_timeout=api_timeout)
+    listed_items_data = list_wikimedia_oauth_media(query, list_limit=limit, media_type=media_type, api_timeout=api_timeout,
+                                                   max_width=max_width, max_height=max_height)
     listed_items = []
 
     if isinstance(listed_items_data, dict):
@@ -185,6 +216,7 @@ def search_wikimedia_oauth_media(query, limit=5, output_dir="wikimedia_oauth_med
         download_path = download_file(item_to_dl['url'], output_dir, item_to_dl['filename'], timeout=download_timeout)
         if download_path:
             downloaded_files_list.append(download_path)
+            record_library_item(item_to_dl, download_path, query)
     return downloaded_files_list
 
 
@@ -196,10 +228,15 @@ if __name__ == "__main__":
     parser.add_argument("--media_type", type=str, default="all", choices=["image", "video", "audio", "all", "gif"], help="Media type.")
     parser.add_argument("--api_timeout", type=int, default=DEFAULT_API_TIMEOUT, help="API call timeout.")
     parser.add_argument("--download_timeout", type=int, default=DEFAULT_DOWNLOAD_TIMEOUT, help="File download timeout.")
+    parser.add_argument("--max_width", type=int, default=None, help="Download images scaled to at most this width (px).")
+    parser.add_argument("--max_height", type=int, default=None, help="Download images scaled to at most this height (px).")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
 
     print(f"\n--- Listing Wikimedia OAuth for '{args.query}' (type: {args.media_type}, limit: {args.limit}) ---")
-    list_result = list_wikimedia_oauth_media(args.query, args.limit, args.media_type, args.api_timeout)
+    with profiler.stage("list"):
+        list_result = list_wikimedia_oauth_media(args.query, args.limit, args.media_type, args.api_timeout, args.max_width, args.max_height)
 
     if list_result.get("error"):
         print(f"Error listing: {list_result['error']}")
@@ -213,9 +250,12 @@ if __name__ == "__main__":
         print("No items found or an unknown issue occurred during listing (OAuth).")
 
     print(f"\n--- Downloading from Wikimedia OAuth for '{args.query}' (type: {args.media_type}, limit: {args.limit}) ---")
-    downloaded_paths = search_wikimedia_oauth_media(
-        args.query, args.limit, args.output_dir, args.media_type, args.api_timeout, args.download_timeout
-    )
+    with profiler.stage("search+download"):
+        downloaded_paths = search_wikimedia_oauth_media(
+            args.query, args.limit, args.output_dir, args.media_type, args.api_timeout, args.download_timeout,
+            args.max_width, args.max_height
+        )
     if downloaded_paths:
         print(f"Wikimedia OAuth: Successfully downloaded {len(downloaded_paths)} files.")
     print("\nWikimedia OAuth CLI test process complete.")
+    profiler.write_report()
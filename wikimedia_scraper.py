@@ -1,29 +1,61 @@
 import requests
 import os
 import argparse
-import json
+from hedging import hedged_get
+from media_item import MediaItem
+from profiling import add_profile_arguments, profiler_from_args
+from json_backend import JSONDecodeError, response_json
+from download_utils import save_response
+from output_layout import output_path
+from media_library import record_item as record_library_item
 
 WIKIMEDIA_API_URL = "https://commons.wikimedia.org/w/api.php"
 DEFAULT_DOWNLOAD_TIMEOUT = 15  # seconds, slightly longer for potentially larger files
+PREVIEW_THUMB_WIDTH = 320  # px, width of the thumbnail requested for web previews
+WIKIMEDIA_TITLES_PER_REQUEST = 50  # Most titles/page ids the API takes per query (without bot rights)
+SCALABLE_MEDIA_TYPES = ("image", "gif")  # Types whose scaled thumbnail is a usable download (not a video poster)
+
+DOWNLOAD_HEADERS = {
+    'User-Agent': 'MediaDownloaderTool/1.0 (https://github.com/user/repo; user@example.com) Python-requests/X.Y.Z'
+    # It's good practice to set a specific User-Agent for Wikimedia APIs
+}
+
+def scaled_thumb_url(thumb_url, thumb_width, width):
+    """
+    Rewrites a Commons thumbnail URL (.../thumb/a/ab/Name.jpg/1280px-Name.jpg) to another width.
+    Returns thumb_url unchanged if it isn't a thumbnail URL or is already no wider.
+    """
+    if not thumb_url or not thumb_width or thumb_width <= width or "/thumb/" not in thumb_url:
+        return thumb_url
+    return thumb_url.replace(f"/{thumb_width}px-", f"/{width}px-")
+
+def imageinfo_params(max_width=None, max_height=None):
+    """The query parameters asking for each page's file info (URL, type, size, description, thumbnail)."""
+    params = {
+        "action": "query", "format": "json",
+        "prop": "imageinfo", "iiprop": "url|mediatype|size|extmetadata",
+        "iilimit": 1, "utf8": 1,
+        "iiurlwidth": PREVIEW_THUMB_WIDTH, # Server-side scaled thumbnail (thumburl) for the results page
+    }
+    if max_width or max_height:
+        # One thumbnail size per request: ask for the download size and derive the preview from it
+        params.pop("iiurlwidth")
+        if max_width: params["iiurlwidth"] = max_width
+        if max_height: params["iiurlheight"] = max_height
+    return params
 
 def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT):
     """Downloads a file from a URL into a specified folder with a timeout."""
     if not os.path.exists(folder_name):
         os.makedirs(folder_name)
 
-    headers = {
-        'User-Agent': 'MediaDownloaderTool/1.0 (https://github.com/user/repo; user@example.com) Python-requests/X.Y.Z'
-        # It's good practice to set a specific User-Agent for Wikimedia APIs
-    }
     try:
-        response = requests.get(url, stream=True, headers=headers, timeout=timeout)
+        response = requests.get(url, stream=True, headers=DOWNLOAD_HEADERS, timeout=timeout)
         response.raise_for_status()
 
-        file_path = os.path.join(folder_name, file_name)
+        file_path = output_path(folder_name, file_name)
 
-        with open(file_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        save_response(response, file_path, "wikimedia")
         print(f"Downloaded {file_name} to {folder_name}")
         return file_path
     except requests.exceptions.Timeout:
@@ -33,10 +65,12 @@ def download_file(url, folder_name, file_name, timeout=DEFAULT_DOWNLOAD_TIMEOUT)
         print(f"Error downloading {url} to {file_name}: {e}")
         return None
 
-def search_wikimedia(query, limit=5, output_dir="wikimedia_media", media_type="all", timeout=DEFAULT_DOWNLOAD_TIMEOUT):
+def search_wikimedia(query, limit=5, output_dir="wikimedia_media", media_type="all", timeout=DEFAULT_DOWNLOAD_TIMEOUT,
+                     max_width=None, max_height=None):
     """
     Searches Wikimedia Commons for media based on a query and downloads them.
     Supports media types: 'image', 'video', 'audio', 'all'.
+    max_width/max_height cap the resolution of downloaded images (see list_wikimedia_media).
     """
     # Determine generator and file type filters based on media_type
     # Wikimedia API uses `generator=search` (gsrsearch) for general search
@@ -82,7 +116,7 @@ def search_wikimedia(query, limit=5, output_dir="wikimedia_media", media_type="a
     # `download_timeout` is a new parameter for the actual file downloads.
 
     # The 5th argument passed to search_wikimedia is 'timeout', which is intended for the API call.
-    listed_items_data = list_wikimedia_media(query, limit, media_type, timeout)
+    listed_items_data = list_wikimedia_media(query, limit, media_type, timeout, max_width, max_height)
     listed_items = listed_items_data.get("items", [])
 
     if listed_items_data.get("error"):
@@ -108,6 +142,7 @@ def search_wikimedia(query, limit=5, output_dir="wikimedia_media", media_type="a
         download_path = download_file(item_to_dl['url'], output_dir, item_to_dl['filename'], timeout=DEFAULT_DOWNLOAD_TIMEOUT)
         if download_path:
             downloaded_files_list.append(download_path)
+            record_library_item(item_to_dl, download_path, query)
 
     if not downloaded_files_list and not listed_items_data.get("error") and not (not listed_items and listed_items_data.get("status_message")):
         # This message is if items were listed but none downloaded successfully, and no prior error/status message was more specific
@@ -116,32 +151,116 @@ def search_wikimedia(query, limit=5, output_dir="wikimedia_media", media_type="a
     return downloaded_files_list
 
 
+def wikimedia_media_item(page_id, page_data, media_type="all", max_width=None, max_height=None, name_base=""):
+    """
+    The MediaItem for one page of an imageinfo query (search or lookup by title/page id), or None
+    if it isn't a file of the requested media_type. name_base goes into the filename.
+    With max_width/max_height, images point at the scaled rendition (see list_wikimedia_media).
+    """
+    if "imageinfo" not in page_data or not page_data["imageinfo"]:
+        return None
+
+    img_info = page_data["imageinfo"][0]
+    api_media_type = img_info.get("mediatype", "UNKNOWN").lower()
+    file_url = img_info.get("url")
+    size_bytes = img_info.get("size") # Get the size in bytes
+    original_filename_title = page_data.get("title", f"File_{page_id}")
+
+    filename_part = original_filename_title
+    if filename_part.startswith("File:"):
+        filename_part = filename_part[5:]
+
+    file_extension = os.path.splitext(filename_part)[1].lower()
+    if not file_extension and api_media_type == "drawing" and "svg" in img_info.get("mime", ""):
+        file_extension = ".svg" # Try to infer for SVG if not in filename
+    elif not file_extension: # if still no extension, try to get from URL (less reliable)
+        file_extension = os.path.splitext(file_url.split('/')[-1])[1].lower()
+
+
+    if not file_url:
+        return None
+
+    item_actual_media_type = "unknown"
+    if api_media_type in ["bitmap", "drawing"] or file_extension in [".jpg", ".jpeg", ".png", ".gif", ".svg", ".tiff", ".webp"]:
+        item_actual_media_type = "image"
+        if file_extension == ".gif": item_actual_media_type = "gif" # more specific
+    elif api_media_type == "video" or file_extension in [".ogv", ".webm", ".mp4", ".mov", ".mpeg", ".mpg"]:
+        item_actual_media_type = "video"
+    elif api_media_type == "audio" or file_extension in [".ogg", ".oga", ".wav", ".mp3", ".flac", ".opus", ".mid"]:
+        item_actual_media_type = "audio"
+
+    # Filter by requested media_type
+    if media_type != "all":
+        if media_type == "image" and item_actual_media_type not in ["image", "gif"]: return None
+        elif media_type == "gif" and item_actual_media_type != "gif": return None
+        elif media_type == "video" and item_actual_media_type != "video": return None
+        elif media_type == "audio" and item_actual_media_type != "audio": return None
+        # Note: "sticker" type is not applicable to wikimedia in this context
+
+    preview_image_url = img_info.get("thumburl")
+    scale_suffix = ""
+    if max_width or max_height:
+        thumb_url = img_info.get("thumburl")
+        if item_actual_media_type in SCALABLE_MEDIA_TYPES and file_extension != ".svg" and thumb_url and thumb_url != file_url:
+            file_url = thumb_url
+            # The scaled copy gets its own filename, so it is never served in place of the original (or the reverse)
+            scale_suffix = f"_w{img_info['thumbwidth']}" if img_info.get("thumbwidth") else f"_{max_width or 0}x{max_height or 0}"
+            size_bytes = None # imageinfo only reports the original's size
+            thumb_extension = os.path.splitext(thumb_url.split('/')[-1])[1].lower()
+            if thumb_extension: file_extension = thumb_extension # e.g. TIFFs are scaled to JPEG
+        preview_image_url = scaled_thumb_url(thumb_url, img_info.get("thumbwidth"), PREVIEW_THUMB_WIDTH)
+
+    clean_original_filename = "".join(c if c.isalnum() else "_" for c in os.path.splitext(filename_part)[0])[:50]
+    final_filename = f"wikimedia_{name_base}_{clean_original_filename}{scale_suffix}{file_extension}"
+    final_filename = "_".join(filter(None, final_filename.split('_')))
+
+    description = ""
+    if img_info.get("extmetadata"):
+        if img_info["extmetadata"].get("ObjectName", {}).get("value"):
+            description = img_info["extmetadata"]["ObjectName"]["value"]
+        elif img_info["extmetadata"].get("ImageDescription", {}).get("value"):
+            description = img_info["extmetadata"]["ImageDescription"]["value"]
+
+    title_for_display = description or original_filename_title
+
+    return MediaItem(
+        id=page_id,
+        title=title_for_display,
+        url=file_url,
+        type=item_actual_media_type,
+        filename=final_filename,
+        platform="wikimedia",
+        size_bytes=size_bytes, # Add the size
+        preview_image_url=preview_image_url if item_actual_media_type != "audio" else None # Audio keeps its player
+    )
+
+
 # Renamed 'timeout' to 'api_timeout' for clarity
-def list_wikimedia_media(query, list_limit=25, media_type="all", api_timeout=DEFAULT_DOWNLOAD_TIMEOUT):
+def list_wikimedia_media(query, list_limit=25, media_type="all", api_timeout=DEFAULT_DOWNLOAD_TIMEOUT, max_width=None, max_height=None):
     """
     Searches Wikimedia Commons for media and returns a dictionary
     with 'items', 'error', and 'status_message'.
+    With max_width/max_height (px), image items point at Wikimedia's scaled rendition that fits
+    the box instead of the original (originals already within it are kept as they are).
     """
     params = {
-        "action": "query", "format": "json", "generator": "search",
-        "gsrsearch": query, "gsrnamespace": 6,
+        "generator": "search", "gsrsearch": query, "gsrnamespace": 6,
         # Fetch more for listing to allow client-side filtering up to list_limit effectively
         "gsrlimit": list_limit * 3 if media_type != "all" else list_limit,
-        "prop": "imageinfo", "iiprop": "url|mediatype|size|extmetadata",
-        "iilimit": 1, "utf8": 1,
+        **imageinfo_params(max_width, max_height),
     }
 
     try:
-        response = requests.get(WIKIMEDIA_API_URL, params=params, timeout=api_timeout) # Use api_timeout
+        response = hedged_get("wikimedia", WIKIMEDIA_API_URL, params=params, timeout=api_timeout) # Use api_timeout
         response.raise_for_status()
-        data = response.json()
+        data = response_json(response)
     except requests.exceptions.Timeout:
         #print(f"Timeout during Wikimedia API (list) request for query: {query}")
         return {"items": [], "error": f"Wikimedia: API timeout for '{query[:50]}'", "status_message": None}
     except requests.exceptions.RequestException as e:
         # print(f"API request error for Wikimedia (list) query '{query}': {e}")
         return {"items": [], "error": f"Wikimedia: API request error for '{query[:50]}': {e}", "status_message": None}
-    except json.JSONDecodeError:
+    except JSONDecodeError:
         # print(f"Error decoding JSON from Wikimedia (list): {response.text if 'response' in locals() else 'No response text'}")
         return {"items": [], "error": f"Wikimedia: Error decoding API response for '{query[:50]}'", "status_message": None}
     except Exception as e: # Catch other potential errors
@@ -161,72 +280,81 @@ def list_wikimedia_media(query, list_limit=25, media_type="all", api_timeout=DEF
     smart_query_name_base = "".join(c if c.isalnum() else "_" for c in smart_query_name_base).strip('_')
 
     for page_id, page_data in data["query"]["pages"].items():
-        if "imageinfo" not in page_data or not page_data["imageinfo"]:
-            continue
-
-        img_info = page_data["imageinfo"][0]
-        api_media_type = img_info.get("mediatype", "UNKNOWN").lower()
-        file_url = img_info.get("url")
-        size_bytes = img_info.get("size") # Get the size in bytes
-        original_filename_title = page_data.get("title", f"File_{page_id}")
-
-        filename_part = original_filename_title
-        if filename_part.startswith("File:"):
-            filename_part = filename_part[5:]
-
-        file_extension = os.path.splitext(filename_part)[1].lower()
-        if not file_extension and api_media_type == "drawing" and "svg" in img_info.get("mime", ""):
-            file_extension = ".svg" # Try to infer for SVG if not in filename
-        elif not file_extension: # if still no extension, try to get from URL (less reliable)
-            file_extension = os.path.splitext(file_url.split('/')[-1])[1].lower()
-
-
-        if not file_url:
-            continue
-
-        item_actual_media_type = "unknown"
-        if api_media_type in ["bitmap", "drawing"] or file_extension in [".jpg", ".jpeg", ".png", ".gif", ".svg", ".tiff", ".webp"]:
-            item_actual_media_type = "image"
-            if file_extension == ".gif": item_actual_media_type = "gif" # more specific
-        elif api_media_type == "video" or file_extension in [".ogv", ".webm", ".mp4", ".mov", ".mpeg", ".mpg"]:
-            item_actual_media_type = "video"
-        elif api_media_type == "audio" or file_extension in [".ogg", ".oga", ".wav", ".mp3", ".flac", ".opus", ".mid"]:
-            item_actual_media_type = "audio"
-
-        # Filter by requested media_type
-        if media_type != "all":
-            if media_type == "image" and item_actual_media_type not in ["image", "gif"]: continue
-            elif media_type == "gif" and item_actual_media_type != "gif": continue
-            elif media_type == "video" and item_actual_media_type != "video": continue
-            elif media_type == "audio" and item_actual_media_type != "audio": continue
-            # Note: "sticker" type is not applicable to wikimedia in this context
-
-        clean_original_filename = "".join(c if c.isalnum() else "_" for c in os.path.splitext(filename_part)[0])[:50]
-        final_filename = f"wikimedia_{smart_query_name_base}_{clean_original_filename}{file_extension}"
-        final_filename = "_".join(filter(None, final_filename.split('_')))
-
-        description = ""
-        if img_info.get("extmetadata"):
-            if img_info["extmetadata"].get("ObjectName", {}).get("value"):
-                description = img_info["extmetadata"]["ObjectName"]["value"]
-            elif img_info["extmetadata"].get("ImageDescription", {}).get("value"):
-                description = img_info["extmetadata"]["ImageDescription"]["value"]
-
-        title_for_display = description or original_filename_title
-
-        found_items.append({
-            "id": page_id,
-            "title": title_for_display,
-            "url": file_url,
-            "type": item_actual_media_type,
-            "filename": final_filename,
-            "platform": "wikimedia",
-            "size_bytes": size_bytes # Add the size
-        })
+        media_item = wikimedia_media_item(page_id, page_data, media_type, max_width, max_height, smart_query_name_base)
+        if media_item:
+            found_items.append(media_item)
 
     return {"items": found_items, "error": None, "status_message": None if found_items else f"Wikimedia: No items extracted for '{query[:50]}'"}
 
 
+def _query_pages(params, api_timeout):
+    """
+    Runs an imageinfo query to completion (following `continue`, which large batches with
+    extmetadata need) and returns (pages by page id, {requested title: normalized title}).
+    Raises requests exceptions, JSONDecodeError, and RuntimeError for API errors.
+    """
+    pages, normalized = {}, {}
+    request_params = dict(params)
+    while True:
+        response = hedged_get("wikimedia", WIKIMEDIA_API_URL, params=request_params, headers=DOWNLOAD_HEADERS, timeout=api_timeout)
+        response.raise_for_status()
+        data = response_json(response)
+        if "error" in data:
+            raise RuntimeError(data["error"].get("info", "Unknown error"))
+        query = data.get("query", {})
+        for entry in query.get("normalized", []):
+            normalized[entry.get("from")] = entry.get("to")
+        for page_id, page_data in query.get("pages", {}).items():
+            merged = pages.setdefault(page_id, page_data)
+            if page_data.get("imageinfo") and not merged.get("imageinfo"):
+                merged["imageinfo"] = page_data["imageinfo"]
+        if "continue" not in data:
+            return pages, normalized
+        request_params = {**params, **data["continue"]}
+
+
+def resolve_wikimedia_media(titles=None, pageids=None, media_type="all", api_timeout=DEFAULT_DOWNLOAD_TIMEOUT,
+                            max_width=None, max_height=None, name_base=""):
+    """
+    Looks known Commons files up again by title ("File:Name.jpg"; the prefix is added if missing)
+    and/or page id, WIKIMEDIA_TITLES_PER_REQUEST per call, instead of searching. Returns the
+    listing dict ('items' in request order, page ids first, 'error', 'status_message') plus
+    'missing': the titles/page ids that no longer resolve to a file of media_type. A failed batch
+    sets 'error' and its entries count as missing; the other batches are still resolved.
+    """
+    titles = list(dict.fromkeys(title if title.startswith("File:") else f"File:{title}" for title in titles or [] if title))
+    pageids = list(dict.fromkeys(str(page_id) for page_id in pageids or [] if page_id))
+    resolved, errors = {}, []  # ("pageids" or "titles", requested value) -> MediaItem
+
+    for key, values in (("pageids", pageids), ("titles", titles)):
+        for start in range(0, len(values), WIKIMEDIA_TITLES_PER_REQUEST):
+            batch = values[start:start + WIKIMEDIA_TITLES_PER_REQUEST]
+            try:
+                pages, normalized = _query_pages({**imageinfo_params(max_width, max_height), key: "|".join(batch)}, api_timeout)
+            except (requests.exceptions.RequestException, RuntimeError) as e:
+                errors.append(f"Wikimedia: lookup by {key} failed for {len(batch)} entr{'y' if len(batch) == 1 else 'ies'}: {e}")
+                continue
+            except JSONDecodeError:
+                errors.append(f"Wikimedia: Error decoding the lookup response for {len(batch)} {key}")
+                continue
+            by_title = {page_data.get("title"): page_id for page_id, page_data in pages.items()}
+            for value in batch:
+                page_id = value if key == "pageids" else by_title.get(normalized.get(value, value))
+                page_data = pages.get(page_id)
+                if page_data is None or "missing" in page_data or "invalid" in page_data:
+                    continue
+                media_item = wikimedia_media_item(page_id, page_data, media_type, max_width, max_height, name_base)
+                if media_item:
+                    resolved[(key, value)] = media_item
+
+    requested = [("pageids", page_id) for page_id in pageids] + [("titles", title) for title in titles]
+    items = [resolved[entry] for entry in requested if entry in resolved]
+    missing = [value for key, value in requested if (key, value) not in resolved]
+    return {"items": items, "error": "; ".join(errors) or None,
+            "status_message": f"Wikimedia: {len(missing)} of {len(requested)} file(s) not found." if missing else None,
+            "missing": missing}
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Download media from Wikimedia Commons.")
     parser.add_argument("query", type=str, help="Search query for Wikimedia Commons.")
@@ -240,14 +368,19 @@ if __name__ == "__main__":
     # Renamed --timeout to --api_timeout and added --download_timeout
     parser.add_argument("--api_timeout", type=int, default=DEFAULT_DOWNLOAD_TIMEOUT, help="API call timeout in seconds. (Note: Wikimedia uses one timeout for both in search_wikimedia)") # DEFAULT_DOWNLOAD_TIMEOUT was the old default here
     parser.add_argument("--download_timeout", type=int, default=DEFAULT_DOWNLOAD_TIMEOUT, help="File download timeout in seconds.")
+    parser.add_argument("--max_width", type=int, default=None, help="Download images scaled to at most this width (px).")
+    parser.add_argument("--max_height", type=int, default=None, help="Download images scaled to at most this height (px).")
 
 
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = profiler_from_args(args)
 
     # Test listing
     print(f"\n--- Listing Wikimedia for '{args.query}' (type: {args.media_type}, limit: {args.limit}) ---")
     # list_wikimedia_media uses 'timeout' for its API call.
-    list_result = list_wikimedia_media(args.query, args.limit, args.media_type, args.api_timeout)
+    with profiler.stage("list"):
+        list_result = list_wikimedia_media(args.query, args.limit, args.media_type, args.api_timeout, args.max_width, args.max_height)
     if list_result.get("error"):
         print(f"Error listing: {list_result['error']}")
     elif not list_result.get("items") and list_result.get("status_message"):
@@ -266,9 +399,10 @@ if __name__ == "__main__":
     # Let's refactor search_wikimedia.
 
     def search_wikimedia_refactored(query, limit=5, output_dir="wikimedia_media", media_type="all",
-                                   api_timeout_param=DEFAULT_DOWNLOAD_TIMEOUT, download_timeout_param=DEFAULT_DOWNLOAD_TIMEOUT):
+                                   api_timeout_param=DEFAULT_DOWNLOAD_TIMEOUT, download_timeout_param=DEFAULT_DOWNLOAD_TIMEOUT,
+                                   max_width=None, max_height=None):
         # list_wikimedia_media expects a single 'timeout' for its API call. We'll use api_timeout_param for that.
-        listed_items_data = list_wikimedia_media(query, limit, media_type, api_timeout_param)
+        listed_items_data = list_wikimedia_media(query, limit, media_type, api_timeout_param, max_width, max_height)
         listed_items = listed_items_data.get("items", [])
 
         if listed_items_data.get("error"):
@@ -290,17 +424,21 @@ if __name__ == "__main__":
                 downloaded_paths_list.append(dl_path)
         return downloaded_paths_list
 
-    downloaded_paths = search_wikimedia_refactored(
-        args.query,
-        args.limit,
-        args.output_dir,
-        args.media_type,
-        api_timeout_param=args.api_timeout,
-        download_timeout_param=args.download_timeout
-    )
+    with profiler.stage("search+download"):
+        downloaded_paths = search_wikimedia_refactored(
+            args.query,
+            args.limit,
+            args.output_dir,
+            args.media_type,
+            api_timeout_param=args.api_timeout,
+            download_timeout_param=args.download_timeout,
+            max_width=args.max_width,
+            max_height=args.max_height
+        )
 
     if downloaded_paths:
         print(f"Wikimedia: Successfully downloaded {len(downloaded_paths)} files.")
     # else: search_wikimedia_refactored prints its own status/errors.
 
     print("\nWikimedia CLI test process complete.")
+    profiler.write_report()